@@ -11,5 +11,10 @@ class ApiBaseboneConfig(AppConfig):
         from api_basebone.bsm.api import exposed
         import api_basebone.bsm.functions  # 注册所有云函数
         from api_basebone import db
+        from api_basebone.services import count  # 注册计数缓存失效的信号
+        from api_basebone.services import result_cache  # 注册结果缓存失效的信号
+
+        count.connect_signals()
+        result_cache.connect_signals()
 
         register_api(self.name, exposed)
@@ -86,6 +86,10 @@ BSM_DETAILS = 'details'
 # 详情布局
 BSM_DETAIL_LAYOUT = 'detail_layout'
 
+# 列表的分页方式，默认为页码分页，设置为 cursor 时使用游标分页
+BSM_PAGINATION = 'pagination'
+BSM_PAGINATION_CURSOR = 'cursor'
+
 # 合法的前端管理端的设置
 VALID_MANAGE_ATTRS = [
     BSM_AUTH_FILTER_FIELD,
@@ -117,6 +121,7 @@ VALID_MANAGE_ATTRS = [
     'detail',  # 详情页临时配置
     BSM_DETAILS,
     BSM_DETAIL_LAYOUT,
+    BSM_PAGINATION,
 ]
 
 # 属性和默认值映射
@@ -170,6 +175,13 @@ class BSMAdminModule:
     modules = {}
 
 
+def clear_admin_dependent_caches():
+    """admin 类或者 admin 配置变更时，清理依赖于 admin 的缓存"""
+    from api_basebone.restful.serializers import clear_serializer_class_cache
+
+    clear_serializer_class_cache()
+
+
 def register(*args, force=True, **kwargs):
     def _register(admin_class):
         _meta = admin_class.Meta.model._meta
@@ -177,6 +189,7 @@ def register(*args, force=True, **kwargs):
         if not force and key in BSMAdminModule.modules:
             return
         BSMAdminModule.modules[key] = admin_class
+        clear_admin_dependent_caches()
         return admin_class
     if args:
         return _register(args[0])
@@ -192,9 +205,10 @@ def set_config(model, config):
     else:
         key = '{}__{}'.format(model._meta.app_label, model._meta.model_name)
     if not config:
-        del config[key]
+        configs.pop(key, None)
     else:
         configs[key] = config
+    clear_admin_dependent_caches()
 
 def get_config(model, name, view_type='list', view=None):
     """获取指定模型的配置值，优先获取配置数据的值，其实是类的值。
@@ -66,6 +66,22 @@ ORDER_BY_FIELDS = 'order_by'
 """
 DATA_WITH_TREE = 'data_with_tree'
 
+"""树形数据的最大深度，根节点为第一层，不传则不限制
+
+支持的方法：POST, GET 当前适用于列表方法
+
+数据格式 Int
+"""
+TREE_MAX_DEPTH = 'tree_max_depth'
+
+"""不分页的列表数据流式输出，数据分块查询和序列化，内存占用只和每一块的大小有关
+
+支持的方法：POST, GET 当前适用于列表方法，通过 URL 查询参数传入
+
+数据格式 Bool：1 或者 true
+"""
+STREAM = 'stream'
+
 """在序列化时，指定排除的字段，数据格式为列表或者元组"""
 GMETA_SERIALIZER_EXCLUDE_FIELDS = 'exclude_fields'
 
@@ -44,6 +44,19 @@ def basebone_admin_property(model, display_name, field_type=None):
 
     FIXME: 暂时在 bsm admin 类中使用
 
+    计算属性一般会各自查询数据库，列表数据逐行计算时查询次数会随着行数增长，
+    这时可以再声明一个批量计算的方法，接收同一层级的所有数据，返回主键和值的映射（没有的主键输出 None），
+    声明了批量计算方法的字段，列表输出时每一层级只调用一次批量计算方法，例如：
+
+        @basebone_admin_property(Article, '评论数', FieldType.INTEGER)
+        def comment_count(self, instance):
+            return instance.comments.count()
+
+        @comment_count.batch
+        def comment_count(self, instances):
+            queryset = Comment.objects.filter(article__in=instances)
+            return dict(queryset.values_list('article').annotate(Count('id')))
+
     Params:
         display str 字段的可读名称
         field_type str 字段的类型
@@ -67,6 +80,13 @@ def basebone_admin_property(model, display_name, field_type=None):
                 'display_name': display_name,
                 'field_type': field_type,
             }
+
+        def batch(batch_func):
+            """声明批量计算的方法，返回原来的方法，所以批量计算的方法可以和原来的方法同名"""
+            model.bsm_admin_computed_fields_map[name]['batch'] = batch_func
+            return wrapper
+
+        wrapper.batch = batch
         return wrapper
 
     return middle
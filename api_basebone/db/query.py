@@ -1,5 +1,7 @@
 from django.db import connections
 
+from api_basebone.services.count import get_mysql_table_rows
+
 # from django.db.models import Model
 
 
@@ -23,25 +25,11 @@ class QuerySetExtend:
         if queryset_instance._result_cache is not None:
             return len(queryset_instance._result_cache)
 
-        is_mysql = 'mysql' in connections[self.db].client.executable_name.lower()
-
-        query = queryset_instance.query
-
-        if (
-            is_mysql
-            and not query.where
-            and query.high_mark is None
-            and query.low_mark == 0
-            and not query.select
-            and not query.group_by
-            and not query.having
-            and not query.distinct
-        ):
+        if connections[self.db].vendor == 'mysql':
             # If query has no constraints, we would be simply doing
-            # "SELECT COUNT(*) FROM foo". Monkey patch so the we
+            # "SELECT COUNT(*) FROM foo". Use the table status to
             # get an approximation instead.
-            cursor = connections[self.db].cursor()
-            cursor.execute("SHOW TABLE STATUS LIKE %s", (self.model._meta.db_table,))
-            return cursor.fetchall()[0][4]
-        else:
-            return query.get_count(using=self.db)
+            count = get_mysql_table_rows(queryset_instance)
+            if count is not None:
+                return count
+        return queryset_instance.query.get_count(using=self.db)
@@ -0,0 +1,105 @@
+"""
+读写分离的数据库路由
+
+在 settings.py 中添加
+
+```python
+DATABASE_ROUTERS = ['api_basebone.db.router.ReplicaRouter']
+
+BASEBONE_API_SERVICE = {
+    # 只读副本的数据库别名
+    'DATABASE_REPLICAS': ['replica'],
+}
+```
+
+- 只有通用接口中只读的操作（READ_ACTIONS）的查询会发送到只读副本，其他的查询和所有的写入仍然使用主库
+- 每个请求开始时选择一个只读副本，同一个请求中的查询都使用这个副本，不会读到不同副本之间复制进度不同的数据
+- 事务中的查询使用主库，例如 rest_services 中 transaction.atomic 包裹的操作
+- 用户写入数据后的 REPLICA_STICKY_SECONDS 秒内，此用户的查询都使用主库，避免因为复制延迟读不到刚写入的数据
+"""
+import random
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+from werkzeug import Local
+
+from api_basebone.settings import settings
+
+READ_ACTIONS = (
+    'list',
+    'set',
+    'retrieve',
+    'statistics',
+    'group_statistics',
+    'get_chart',
+    'export_file',
+)
+
+PRIMARY_STICKY_CACHE_KEY = 'bsm_primary_sticky:{user_id}'
+
+request_state = Local()
+
+
+@receiver(request_finished, dispatch_uid='clean_router_locals')
+def clean_local(sender, **kwargs):
+    for name in ('replica', 'wrote', 'user_id'):
+        if hasattr(request_state, name):
+            delattr(request_state, name)
+
+
+def get_sticky_key(user_id):
+    return PRIMARY_STICKY_CACHE_KEY.format(user_id=user_id)
+
+
+def use_replica(action, user=None):
+    """根据当前请求的操作和用户，决定当前请求中的查询是否可以使用只读副本，可以使用时选择一个只读副本"""
+    user_id = getattr(user, 'pk', None)
+    request_state.user_id = user_id
+    request_state.wrote = False
+    request_state.replica = None
+    replicas = settings.DATABASE_REPLICAS
+    if (
+        replicas
+        and action in READ_ACTIONS
+        and not (user_id is not None and cache.get(get_sticky_key(user_id)))
+    ):
+        request_state.replica = random.choice(replicas)
+
+
+class ReplicaRouter:
+    """只读的操作使用只读副本，写入数据后短时间内固定使用主库"""
+
+    def db_for_read(self, model, **hints):
+        # 不是通用接口的请求中，或者请求中已经写入了数据，使用默认的路由
+        replica = getattr(request_state, 'replica', None)
+        if replica is None or request_state.wrote:
+            return
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return
+        return replica
+
+    def db_for_write(self, model, **hints):
+        user_id = getattr(request_state, 'user_id', None)
+        if user_id is not None and not request_state.wrote:
+            request_state.wrote = True
+            timeout = settings.REPLICA_STICKY_SECONDS
+            if settings.DATABASE_REPLICAS and timeout:
+                cache.set(get_sticky_key(user_id), True, timeout)
+
+        # 从只读副本读取的数据写入时使用主库，其他情况保持默认的路由
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 只读副本和主库的数据相同，数据之间可以关联
+        dbs = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 只读副本通过数据库复制同步结构，不执行迁移
+        if db in settings.DATABASE_REPLICAS:
+            return False
@@ -1,16 +1,300 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+from collections import OrderedDict
+
+from django.core.paginator import EmptyPage, InvalidPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Manager, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import (
     _positive_int,
+    BasePagination,
     PageNumberPagination as OriginPageNumberPagination,
 )
 from rest_framework.response import Response
 
+from api_basebone.core import admin, exceptions
+from api_basebone.services.count import count_queryset
+
+TRUE_VALUES = ('1', 'true', 'True')
+
+
+def get_count_scope(request):
+    """计数缓存的用户范围"""
+    user = getattr(request, 'user', None)
+    return getattr(user, 'pk', None)
+
+
+def cursor_value_default(value):
+    """游标中的值转换为 json，时间保留微秒，避免分页的边界丢失精度"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def encode_cursor(ordering, values, reverse=False):
+    data = {'o': ordering, 'v': values, 'r': int(reverse)}
+    content = json.dumps(data, default=cursor_value_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(content.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return data['o'], data['v'], bool(data['r'])
+    except (TypeError, ValueError, KeyError, binascii.Error):
+        raise exceptions.BusinessException(
+            error_code=exceptions.PARAMETER_FORMAT_ERROR, error_data='无效的分页游标'
+        )
+
+
+class KeysetPagination(BasePagination):
+    """游标分页
+
+    根据结果集的排序（没有排序时使用模型默认的排序）加上主键作为唯一的排序，
+    通过上一页边界数据的排序值筛选下一页的数据，不使用 OFFSET，默认也不统计总数
+
+    - cursor 游标，为空时获取第一页
+    - size 每页的数量
+    - with_count 为真时返回总数，exact_count 为真时返回精确的总数
+    """
+
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'size'
+    count_query_param = 'with_count'
+    exact_count_query_param = 'exact_count'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, queryset):
+        """获取排序字段，返回 (字段名, 是否倒序) 的列表，最后一个总是主键"""
+        query = queryset.query
+        if query.order_by:
+            ordering = list(query.order_by)
+        elif query.default_ordering:
+            ordering = list(query.get_meta().ordering)
+        else:
+            ordering = []
+
+        model = queryset.model
+        result = []
+        for item in ordering:
+            if not isinstance(item, str) or item == '?':
+                raise exceptions.BusinessException(
+                    error_code=exceptions.PARAMETER_BUSINESS_ERROR,
+                    error_data='游标分页不支持当前的排序方式',
+                )
+            desc = item.startswith('-')
+            name = item.lstrip('-+')
+
+            # 外键排序时，如果关联模型没有默认排序，则按照外键的值排序
+            field = model._meta._forward_fields_map.get(name)
+            if field is not None and field.is_relation:
+                if field.related_model._meta.ordering:
+                    raise exceptions.BusinessException(
+                        error_code=exceptions.PARAMETER_BUSINESS_ERROR,
+                        error_data='游标分页不支持当前的排序方式',
+                    )
+                name = field.attname
+            result.append((name, desc))
+
+        pk = model._meta.pk
+        if not any(name in ('pk', pk.name, pk.attname) for name, _ in result):
+            result.append(('pk', result[-1][1] if result else False))
+        return result
+
+    def get_position(self, instance, ordering):
+        """获取数据在排序中的位置，即各个排序字段的值"""
+        values = []
+        for name, _ in ordering:
+            value = instance
+            for attr in name.split('__'):
+                value = getattr(value, attr, None)
+                if isinstance(value, Manager) or value is None:
+                    break
+            if isinstance(value, Manager):
+                raise exceptions.BusinessException(
+                    error_code=exceptions.PARAMETER_BUSINESS_ERROR,
+                    error_data='游标分页不支持当前的排序方式',
+                )
+            values.append(value)
+        return values
+
+    def get_after_condition(self, name, desc, value, nulls_largest):
+        """排在指定值之后的条件，空值的位置由数据库决定"""
+        nulls_after = nulls_largest != desc
+        if value is None:
+            return Q(**{f'{name}__isnull': False}) if not nulls_after else None
+
+        condition = Q(**{f'{name}__{"lt" if desc else "gt"}': value})
+        if nulls_after:
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def get_keyset_condition(self, ordering, values, nulls_largest):
+        """排在指定位置之后的条件
+
+        例如排序 (a, b) 的位置 (x, y) 之后的条件为 a > x or (a = x and b > y)
+        """
+        condition, equal = None, Q()
+        for (name, desc), value in zip(ordering, values):
+            after = self.get_after_condition(name, desc, value, nulls_largest)
+            if after is not None:
+                after = equal & after
+                condition = after if condition is None else condition | after
+
+            if value is None:
+                equal &= Q(**{f'{name}__isnull': True})
+            else:
+                equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = self.count_exact = None
+        if request.query_params.get(self.count_query_param) in TRUE_VALUES:
+            self.count, self.count_exact = count_queryset(
+                queryset,
+                scope=get_count_scope(request),
+                exact=request.query_params.get(self.exact_count_query_param) in TRUE_VALUES,
+            )
+
+        ordering = self.get_ordering(queryset)
+        ordering_key = [('-' if desc else '') + name for name, desc in ordering]
+
+        reverse, values = False, None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            cursor_ordering, values, reverse = decode_cursor(cursor)
+            if cursor_ordering != ordering_key or len(values) != len(ordering):
+                raise exceptions.BusinessException(
+                    error_code=exceptions.PARAMETER_FORMAT_ERROR,
+                    error_data='分页游标和当前的排序不一致',
+                )
+
+        # 向前翻页时反转排序，取出数据后再反转回来
+        effective = [(name, desc != reverse) for name, desc in ordering]
+        queryset = queryset.order_by(
+            *[('-' if desc else '') + name for name, desc in effective]
+        )
+        if values is not None:
+            nulls_largest = connections[queryset.db].features.nulls_order_largest
+            condition = self.get_keyset_condition(effective, values, nulls_largest)
+            queryset = queryset.filter(condition) if condition is not None else queryset.none()
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+
+        self.next_cursor = self.previous_cursor = None
+        if results and self.has_next:
+            self.next_cursor = encode_cursor(
+                ordering_key, self.get_position(results[-1], ordering)
+            )
+        if results and self.has_previous:
+            self.previous_cursor = encode_cursor(
+                ordering_key, self.get_position(results[0], ordering), reverse=True
+            )
+        return results
+
+    def get_paginated_response(self, data):
+        result = OrderedDict()
+        if self.count is not None:
+            result['count'] = self.count
+            result['count_exact'] = self.count_exact
+        result['next'] = self.next_cursor
+        result['previous'] = self.previous_cursor
+        result['results'] = data
+        return Response(result)
+
+
+class CountPaginator(Paginator):
+    """总数由计数服务提供的分页器
+
+    总数为近似值时，不再校验页码是否超出总页数，超出时返回空的数据
+    """
+
+    def __init__(self, object_list, per_page, scope=None, exact=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.scope = scope
+        self.exact = exact
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        count, self.count_exact = count_queryset(
+            self.object_list, scope=self.scope, exact=self.exact
+        )
+        return count
+
+    def validate_number(self, number):
+        if not self.count_approximate:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    @property
+    def count_approximate(self):
+        """总数是否为近似值，先获取总数才能知道总数是否精确"""
+        return self.count is not None and not self.count_exact
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.count_approximate:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
 
 class PageNumberPagination(OriginPageNumberPagination):
+    """页码分页
+
+    总数通过计数服务获取，数据量大时可能是近似值，返回的 count_exact 表示总数是否精确，
+    请求中 exact_count 为真时返回精确的总数
+    """
 
     max_page_size = 1000
     page_size = 100
     page_query_param = 'page'
     page_size_query_param = 'size'
+    cursor_query_param = 'cursor'
+    exact_count_query_param = 'exact_count'
+
+    django_paginator_class = CountPaginator
+
+    keyset_pagination_class = KeysetPagination
 
     def get_page_size(self, request):
         """重写此方法是为了支持以下场景
@@ -28,3 +312,61 @@ class PageNumberPagination(OriginPageNumberPagination):
             except (KeyError, ValueError):
                 return
         return self.page_size
+
+    def check_keyset_pagination(self, request, view):
+        """检测是否使用游标分页
+
+        - 请求中传入了游标参数，游标为空时获取第一页
+        - admin 中配置了游标分页，并且请求中传入了分页参数
+        """
+        if self.cursor_query_param in request.query_params:
+            return True
+
+        get_bsm_model_admin = getattr(view, 'get_bsm_model_admin', None)
+        admin_class = get_bsm_model_admin() if get_bsm_model_admin else None
+        pagination = getattr(admin_class, admin.BSM_PAGINATION, None)
+        return pagination == admin.BSM_PAGINATION_CURSOR and self.get_page_size(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_paginator = None
+        if self.check_keyset_pagination(request, view):
+            self.keyset_paginator = self.keyset_pagination_class()
+            return self.keyset_paginator.paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(
+            queryset,
+            page_size,
+            scope=get_count_scope(request),
+            exact=request.query_params.get(self.exact_count_query_param) in TRUE_VALUES,
+        )
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        self.request = request
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return Response(
+            OrderedDict(
+                [
+                    ('count', self.page.paginator.count),
+                    ('count_exact', self.page.paginator.count_exact),
+                    ('next', self.get_next_link()),
+                    ('previous', self.get_previous_link()),
+                    ('results', data),
+                ]
+            )
+        )
@@ -1,13 +1,19 @@
+import logging
+
 from django.core.signals import request_finished
 from django.dispatch import receiver
 from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
 import lightning_flags as flags
-from api_basebone.core.exceptions import ERROR_PHRASES
+from api_basebone.core.exceptions import ERROR_PHRASES, BusinessException
 from api_basebone.sandbox.logger import LogCollector
 from werkzeug import Local
 
+log = logging.getLogger(__name__)
+
 request_logs = Local()
 
 @receiver(request_finished, dispatch_uid='clean_request_locals')
@@ -46,6 +52,52 @@ def success_response(data=None):
     return Response(response_data)
 
 
+def streaming_success_response(chunks):
+    """成功返回的数据结构，result 为列表，按块逐步输出
+
+    数据结构和 success_response 一致，用于数据量很大的列表，内存占用只和每一块的大小有关
+
+    查询在输出响应时才执行，响应头已经发送，error_code 放在 result 之后输出，
+    中途出错时结束 result 列表，输出异常的 error_code 和 error_message，保证输出的是完整的 JSON
+
+    Params:
+        chunks iterable 每个元素为一块数据的列表
+    """
+    renderer = JSONRenderer()
+    error_code = '0' if flags.NUMERIC_RESPONSE_STATUS is False else 0
+
+    def render(data):
+        return renderer.render(data)
+
+    def content():
+        yield b'{"result":['
+        tail = {'error_code': error_code, 'error_message': ''}
+        first = True
+        try:
+            for chunk in chunks:
+                # 去掉列表两端的括号，块之间用逗号连接
+                items = render(chunk)[1:-1]
+                if not items:
+                    continue
+                yield items if first else b',' + items
+                first = False
+        except Exception as e:
+            log.exception('streaming response error')
+            if isinstance(e, BusinessException):
+                tail = {'error_code': e.error_code, 'error_message': e.error_message}
+            else:
+                tail = {
+                    'error_code': BusinessException.default_error_code,
+                    'error_message': BusinessException.default_error_message,
+                }
+
+        logger = settings.DEBUG and getattr(request_logs, 'logger', None)
+        tail['logs'] = logger.collect() if logger else []
+        yield b'],' + render(tail)[1:]
+
+    return StreamingHttpResponse(content(), content_type='application/json')
+
+
 def error_response(error_code, error_message=None, error_data=None, error_app=None, logs=None):
     """业务异常返回的数据结构"""
     logger = getattr(request_logs, 'logger', None)
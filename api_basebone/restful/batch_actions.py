@@ -11,6 +11,7 @@ from api_basebone.core import exceptions
 from api_basebone.core.decorators import BSM_BATCH_ACTION, BSM_CLIENT_BATCH_ACTION
 from api_basebone.utils import module
 from api_basebone.restful.const import MANAGE_END_SLUG
+from api_basebone.services.count import clean_count_cache
 
 
 def delete(request, queryset, *args):
@@ -116,6 +117,8 @@ class BatchActionForm(serializers.Serializer):
         return value
 
     def handle(self):
+        from api_basebone.services.result_cache import clean_result_cache
+
         request = self.context['request']
         try:
             return self.bsm_batch_action(request, self.bsm_batch_queryset, self.data.get('payload',{}))
@@ -124,3 +127,7 @@ class BatchActionForm(serializers.Serializer):
                 error_code=exceptions.BATCH_ACTION_HAND_ERROR,
                 error_data=str(e)
             )
+        finally:
+            # 批量动作直接操作查询集，不会发送 bsm 的信号
+            clean_count_cache(self.bsm_batch_queryset.model)
+            clean_result_cache(self.bsm_batch_queryset.model)
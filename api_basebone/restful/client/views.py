@@ -5,6 +5,7 @@ import logging
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
 
 from rest_framework import permissions
 from rest_framework.decorators import action
@@ -26,6 +27,8 @@ from api_basebone.utils import meta
 from api_basebone.utils import queryset as queryset_utils
 from api_basebone.utils.gmeta import get_gmeta_config_by_key
 from api_basebone.utils.operators import build_filter_conditions2
+from api_basebone.utils.semijoin import check_multiple_joins, check_multiple_ordering, semi_join_filter
+from api_basebone.utils.tree import get_tree_max_depth
 
 from api_basebone.restful.viewsets import BSMModelViewSet
 from api_basebone.services import rest_services
@@ -65,13 +68,22 @@ class QuerySetMixin:
                 self.model, gmeta.GMETA_CLIENT_FILTER_BY_LOGIN_USER
             )
             if user_field_name and filter_by_login_user:
-                return queryset.filter(**{user_field_name: user})
+                return self.basebone_semi_join_filter(queryset, Q(**{user_field_name: user}))
+        return queryset
+
+    def basebone_semi_join_filter(self, queryset, cons):
+        """筛选结果集，涉及对多关系的条件改写为子查询，无法改写时标记需要去重"""
+        queryset, distinct_queryset = semi_join_filter(queryset, cons)
+        if distinct_queryset:
+            self.basebone_distinct_queryset = True
         return queryset
 
     def get_queryset_by_order_by(self, queryset):
         """结果集支持排序"""
         fields = self.request.data.get(const.ORDER_BY_FIELDS)
         if isinstance(fields, list) and fields:
+            if check_multiple_ordering(self.model, fields):
+                self.basebone_distinct_queryset = True
             return queryset.order_by(*fields)
         return queryset
 
@@ -97,7 +109,7 @@ class QuerySetMixin:
         if filter_conditions:
             cons = build_filter_conditions2(filter_conditions)
             if cons:
-                queryset = queryset.filter(cons)
+                queryset = self.basebone_semi_join_filter(queryset, cons)
         return queryset
 
     def get_queryset_by_exclude_conditions(self, queryset):
@@ -131,10 +143,15 @@ class QuerySetMixin:
         return queryset
 
     def _get_queryset(self, queryset):
+        # 过滤条件中涉及对多关系并且无法改写为子查询，按照对多关系排序，
+        # 或者结果集本身已经连接了对多关系的表时，才对结果集去重
+        self.basebone_distinct_queryset = check_multiple_joins(queryset.query)
         methods = ['filter_user', 'filter_conditions', 'order_by', 'with_tree']
         for item in methods:
             queryset = getattr(self, f'get_queryset_by_{item}')(queryset)
-        return queryset.distinct()
+        if self.basebone_distinct_queryset:
+            return queryset.distinct()
+        return queryset
 
 
 class GenericViewMixin:
@@ -229,13 +246,16 @@ class GenericViewMixin:
     def _get_data_with_tree(self, request):
         """检测是否可以设置树形结构"""
         self.tree_data = None
+        self.tree_max_depth = None
 
-        data_with_tree = False
+        data_with_tree, tree_max_depth = False, None
         # 检测客户端传进来的树形数据结构的参数
         if request.method.upper() == 'GET':
             data_with_tree = request.query_params.get(const.DATA_WITH_TREE, False)
+            tree_max_depth = request.query_params.get(const.TREE_MAX_DEPTH)
         elif request.method.upper() == 'POST':
             data_with_tree = request.data.get(const.DATA_WITH_TREE, False)
+            tree_max_depth = request.data.get(const.TREE_MAX_DEPTH)
 
         # 如果客户端传进来的参数为真，则通过 admin 配置校验，即 admin 中有没有配置
         if data_with_tree:
@@ -251,6 +271,7 @@ class GenericViewMixin:
                         )
                         if parent_field_data:
                             self.tree_data = parent_field_data
+                            self.tree_max_depth = get_tree_max_depth(tree_max_depth)
                 except Exception:
                     pass
 
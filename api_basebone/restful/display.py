@@ -0,0 +1,125 @@
+"""
+显示字段的编译
+
+display_fields 支持 * 通配符和 - 排除，原来只在序列化之后对输出的数据做裁剪，所有的字段都会
+先查询、序列化再丢弃。这里把每一层的显示字段预先编译好，用于查询时的列选择以及序列化类的字段选择，
+裁剪掉的字段不再查询，也不再序列化。
+
+序列化后的裁剪（filter_sub_display_fields）、行投影以及这里的字段选择都使用 check_display_field 判断，
+保证输出的数据结构一致。
+
+每一层的显示字段都是相对于当前模型的，嵌套的显示字段通过 serializers.nested_display_fields 获取，
+例如 ['title', 'customer.name', '-customer.user'] 中 customer 这一层为 ['name', '-user']
+"""
+from api_basebone.settings import settings
+from api_basebone.utils.lru import LRUCache
+
+display_fields_cache = LRUCache(settings.DISPLAY_FIELDS_CACHE_SIZE)
+
+
+def get_display_fields_set(display_fields):
+    """把显示字段展开为集合，包含每一级的父路径，没有限制时返回 None"""
+    if not display_fields:
+        return
+
+    display_fields_set = set()
+    for field_str in display_fields:
+        if field_str.startswith('-'):
+            display_fields_set.add(field_str)
+        else:
+            items = field_str.split('.')
+            for i in range(len(items)):
+                display_fields_set.add('.'.join(items[: i + 1]))
+    return display_fields_set
+
+
+def check_display_field(display_fields_set, key, prefix=''):
+    """检测输出的键是否需要显示，display_fields_set 为 None 时显示所有字段
+
+    Params:
+        display_fields_set set 展开后的显示字段集合，参考 get_display_fields_set
+        key str 当前层级的键
+        prefix str 当前层级的路径
+    """
+    if display_fields_set is None:
+        return True
+
+    full_key = f'{prefix}.{key}' if prefix else key
+    star_key = f'{prefix}.*' if prefix else '*'
+
+    # 负号优先级高于星号
+    if '-' + full_key in display_fields_set:
+        return False
+    return star_key in display_fields_set or full_key in display_fields_set
+
+
+def filter_sub_display_fields(display_fields_set, record, prefix=''):
+    """按照显示字段裁剪字典，字典以及列表中的字典递归裁剪"""
+    display_record = {}
+    for k, v in record.items():
+        if check_display_field(display_fields_set, k, prefix):
+            display_record[k] = filter_display_value(display_fields_set, v, f'{prefix}.{k}' if prefix else k)
+    return display_record
+
+
+def filter_display_value(display_fields_set, value, prefix):
+    """裁剪输出的值，prefix 为值的完整路径，只有字典以及列表中的字典需要裁剪"""
+    if display_fields_set is None:
+        return value
+    if isinstance(value, dict):
+        return filter_sub_display_fields(display_fields_set, value, prefix)
+    if isinstance(value, list):
+        return [
+            filter_sub_display_fields(display_fields_set, item, prefix) if isinstance(item, dict) else item
+            for item in value
+        ]
+    return value
+
+
+class DisplayFields:
+    """编译后的一层显示字段
+
+    - star 是否有 * 通配符
+    - include 显示的字段名，包含嵌套显示字段的第一级
+    - exclude 排除的字段名
+    - nested 嵌套字段名和相对的显示字段列表的映射
+    """
+
+    def __init__(self, display_fields):
+        self.fields_set = get_display_fields_set(display_fields)
+        self.star = False
+        self.include, self.exclude, self.nested = set(), set(), {}
+
+        for item in display_fields:
+            if item.startswith('-'):
+                name, _, rest = item[1:].partition('.')
+                if rest:
+                    self.nested.setdefault(name, []).append('-' + rest)
+                else:
+                    self.exclude.add(name)
+                continue
+
+            name, _, rest = item.partition('.')
+            if name == '*':
+                self.star = True
+                continue
+            self.include.add(name)
+            if rest:
+                self.nested.setdefault(name, []).append(rest)
+
+    def check(self, name):
+        """检测字段是否需要显示"""
+        return check_display_field(self.fields_set, name)
+
+
+def compile_display_fields(display_fields):
+    """编译一层显示字段，没有限制时返回 None"""
+    if display_fields is None:
+        return
+
+    key = tuple(display_fields)
+    result = display_fields_cache.get(key)
+    if result is None:
+        result = DisplayFields(display_fields)
+        display_fields_cache.set(key, result)
+    return result
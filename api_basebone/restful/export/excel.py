@@ -2,13 +2,16 @@ import datetime
 try:
     import openpyxl
     from openpyxl import load_workbook
+    from openpyxl.utils import column_index_from_string
     from openpyxl.worksheet.datavalidation import DataValidation
 except:
     pass
 import collections
 import requests
+from io import BytesIO
 from time import time
 from tempfile import NamedTemporaryFile
+from django.core.exceptions import FieldDoesNotExist
 from django.db.models.fields.related import ManyToManyField
 from django.db.models.fields.reverse_related import ManyToManyRel, ManyToOneRel
 from django.db.models.query import QuerySet
@@ -18,6 +21,8 @@ from django.utils import timezone
 
 from rest_framework.exceptions import ValidationError
 
+from api_basebone.settings import settings
+from api_basebone.utils.prefetch import iterate_queryset, split_chunks
 from api_basebone.utils.timezone import local_timestamp
 from api_basebone.restful.export.formatter import format
 from api_basebone.restful.forms import get_form_class
@@ -136,15 +141,19 @@ def export_excel(config, queryset, detail=None):
 
     model_fields = dict([(f.name, f) for f in queryset.model._meta.fields])
     print('model_fields', model_fields)
+    # 分块读取，每一块单独 prefetch，数据很多时内存占用不会随着数据量增长
+    instances = iterate_queryset(queryset) if isinstance(queryset, QuerySet) else queryset
+    qs_len = None
     # 渲染列表
     if list_mapping:
         if use_template:  # 指定模板
             row = config.get('list_start_line', 1)
             end = config.get('list_end_line')
-            for instance in queryset:
+            for instance in instances:
                 for field in list_mapping:
                     sheet[f'{field["column"]}{row}'] = get_attribute(instance, field['field'], field.get('formatter', None))
                 row += 1
+            qs_len = row - config.get('list_start_line', 1)
 
             sheet.delete_rows(row, end - row + 1)
         else:
@@ -172,7 +181,7 @@ def export_excel(config, queryset, detail=None):
                 col += 1
             row += 1
 
-            for instance in queryset:
+            for instance in instances:
                 col = 1
                 for field in list_mapping:
                     value = get_attribute(instance, field['field'], field.get('formatter', None))
@@ -185,7 +194,8 @@ def export_excel(config, queryset, detail=None):
     if detail_mapping:
         # 渲染关联详情
         if use_template:  # 模型指定位置
-            qs_len = len(queryset)
+            if qs_len is None:
+                qs_len = len(queryset)
             for dfield in detail_mapping:
                 position = dfield['position']
                 if isinstance(position, str):
@@ -209,6 +219,121 @@ def export_excel(config, queryset, detail=None):
     return response
 
 
+def compile_import_columns(list_mapping, model):
+    """预先计算每一列的转换方式，避免每个单元格重复查找字段、构建选项
+
+    related 的格式为 (是否多对多, 关联模型, 关联模型中作为字段值的字段)
+    """
+    model_fields = dict([(f.name, f) for f in model._meta.fields])
+
+    columns = []
+    for field in list_mapping:
+        definition = model_fields.get(field['field'])
+        column = {
+            'field': field['field'],
+            'index': column_index_from_string(field['column']) - 1,
+            'date': isinstance(definition, models.DateField),
+            'choices': dict([(c[1], c[0]) for c in definition.choices]) if getattr(definition, 'choices', None) else None,
+            'to_field': field.get('to_field'),
+            'related': None,
+        }
+        # 通过 to_field 指定外键的唯一标识字段
+        if 'to_field' in field:
+            if definition is not None:
+                # 得到字段本身定义的to_field
+                column['related'] = (False, definition.related_model, definition.remote_field.field_name)
+            else:
+                try:
+                    field_definition = model._meta.get_field(field['field'])
+                except FieldDoesNotExist:
+                    field_definition = None
+                if isinstance(field_definition, models.ManyToManyField):
+                    column['related'] = (True, field_definition.related_model, 'pk')
+        columns.append(column)
+    return columns
+
+
+def read_import_rows(sheet, columns, start_line):
+    """逐行读取数据，返回 (行号, 数据)，遇到空行结束"""
+    max_col = max(column['index'] for column in columns) + 1
+    rows = sheet.iter_rows(min_row=start_line, max_col=max_col, values_only=True)
+    for line, values in enumerate(rows, start_line):
+        row_data = {}
+        for column in columns:
+            value = values[column['index']] if column['index'] < len(values) else None
+            if isinstance(value, datetime.datetime) and column['date']:
+                value = value.date()
+            if column['choices'] and value in column['choices']:
+                value = column['choices'][value]
+            row_data[column['field']] = value
+        if not [val for val in row_data.values() if val]:
+            return
+        yield line, row_data
+
+
+def get_lookup_normalizer(model, lookup):
+    """把单元格的值转换为查询字段的类型，和数据库中查询出的值比较"""
+    try:
+        field = model._meta.get_field(lookup)
+    except FieldDoesNotExist:
+        return lambda value: value
+
+    def normalize(value):
+        try:
+            return field.to_python(value)
+        except Exception:
+            return value
+
+    return normalize
+
+
+def resolve_related_values(columns, data):
+    """通过 to_field 批量查询关联数据，每一列执行一次 IN 查询"""
+    for column in columns:
+        if not column['related']:
+            continue
+        many, related_model, to_field = column['related']
+        name, lookup = column['field'], column['to_field']
+        normalize = get_lookup_normalizer(related_model, lookup)
+
+        rows = [row for row in data if row[name] and (not many or isinstance(row[name], str))]
+        if not rows:
+            continue
+        values = set()
+        for row in rows:
+            values.update(row[name].split('、') if many else [row[name]])
+
+        mapping = {}
+        queryset = related_model.objects.filter(**{f'{lookup}__in': values}).exclude(**{to_field: None})
+        for key, value in queryset.values_list(lookup, to_field):
+            if many:
+                mapping.setdefault(normalize(key), []).append(value)
+            else:
+                mapping.setdefault(normalize(key), value)
+
+        for row in rows:
+            if many:
+                pks = [pk for key in row[name].split('、') for pk in mapping.get(normalize(key), [])]
+                row[name] = list(dict.fromkeys(pks))
+            else:
+                row[name] = mapping.get(normalize(row[name]))
+
+
+def get_import_serializer(config, queryset, request, data):
+    if config['type'] == 'create':
+        return get_form_class(queryset.model, 'create', request=request)(data=data, many=True)
+    # 更新，是有条件的更新
+    # update_by = config.get('update_by', [])
+    pk_name = queryset.model._meta.pk.name
+    pk_values = [row[pk_name] for row in data]
+    instances = queryset.filter(**{f'{pk_name}__in': pk_values})
+
+    # FIXME 如果data里面有instances里面没有的数据时，要报无权修改
+    return get_form_class(queryset.model, 'update', request=request, batch=True)(
+        instances, data=data, partial=True, many=True
+    )
+
+
 def import_excel(config, content, queryset, request, detail_id=None, detail_field=None):
     """导入Exce
     参数：
@@ -226,83 +351,40 @@ def import_excel(config, content, queryset, request, detail_id=None, detail_fiel
         ],
         "list_start_line": 10  // 数据开始行
     }
-    """
-    with NamedTemporaryFile(suffix='.xlsx') as tmp:
-        tmp.write(content)
-        workbook = load_workbook(tmp.name)
-    print('excel file name: ', tmp.name)
-
-    sheet = workbook.worksheets[0]
 
-    list_mapping = config['list_mapping']
-    start_line = config.get('list_start_line', 1)
-    line = start_line
+    以只读模式逐行读取，每 IMPORT_CHUNK_SIZE 行批量查询关联数据、校验并保存，内存占用和文件大小无关。
+    任意一行校验失败时不再保存，校验完所有数据后报告所有的错误，已保存的数据随事务回滚
+    """
+    workbook = load_workbook(BytesIO(content), read_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        columns = compile_import_columns(config['list_mapping'], queryset.model)
+        start_line = config.get('list_start_line', 1)
 
-    model_fields = dict([(f.name, f) for f in queryset.model._meta.fields])
+        error_details = []
+        with transaction.atomic():
+            rows = read_import_rows(sheet, columns, start_line)
+            for chunk in split_chunks(rows, settings.IMPORT_CHUNK_SIZE):
+                data = [row_data for _, row_data in chunk]
+                resolve_related_values(columns, data)
+                if detail_field:
+                    for row_data in data:
+                        row_data[detail_field] = detail_id
 
-    data = []
-    eof = False
-    while not eof:
-        row_data = {}
-        for field in list_mapping:
-            value = sheet[f'{field["column"]}{line}'].value  # TODO 考虑多层级场景
-            if isinstance(value, datetime.datetime) and isinstance(model_fields[field["field"]], models.DateField):
-                value = value.date()
-            if field["field"] in model_fields and model_fields[field["field"]].choices:
-                choices = dict([(c[1], c[0]) for c in model_fields[field["field"]].choices])
-                if value in choices:
-                    value = choices[value]
-            # 通过 to_field 指定外键的唯一标识字段
-            if 'to_field' in field and value:
-                if field["field"] in model_fields:
-                    field_definition = model_fields[field["field"]]
-                    related_model = field_definition.related_model
-                    # 得到字段本身定义的to_field
-                    to_field = field_definition.remote_field.field_name
-                    value = related_model.objects.filter(**{field['to_field']: value}).exclude(**{to_field: None}).values(to_field).first()
-                    if value is not None:
-                        value = value[to_field]
-                else:
-                    try:
-                        field_definition = queryset.model._meta.get_field(field['field'])
-                        if isinstance(field_definition, models.ManyToManyField):
-                            value = field_definition.related_model.objects.filter(**{field['to_field']+'__in': value.split('、')}).values_list('pk', flat=True)
-                    except Exception:
-                        import traceback
-                        traceback.print_exc()
-            row_data[field["field"]] = value
-        line += 1
-        if not [val for val in row_data.values() if val]:
-            eof = True
-        else:
-            if detail_field:
-                row_data[detail_field] = detail_id
-            data.append(row_data)
+                serializer = get_import_serializer(config, queryset, request, data)
+                if not serializer.is_valid(raise_exception=False):
+                    errors = serializer.errors
+                    for idx in range(len(errors)):
+                        if errors[idx]:
+                            error_details.append({
+                                "line": chunk[idx][0],
+                                "error": errors[idx]
+                            })
+                elif not error_details:
+                    serializer.save()
 
-    if config['type'] == 'create':
-        serializer = get_form_class(queryset.model, 'create', request=request)(data=data, many=True)
-    elif config['type'] == 'update':
-        # 更新，是有条件的更新
-        # update_by = config.get('update_by', [])
-        pk_name = queryset.model._meta.pk.name
-        pk_values = [row[pk_name] for row in data]
-        condition = {f'{pk_name}__in': pk_values}
-        print('condition: ', condition)
-        instances = queryset.filter(**condition)
-
-        # FIXME 如果data里面有instances里面没有的数据时，要报无权修改
-        serializer = get_form_class(queryset.model, 'update', request=request, batch=True)(instances, data=data, partial=True, many=True)
-
-    if not serializer.is_valid(raise_exception=False):
-        error_details = []
-        errors = serializer.errors
-        for idx in range(len(errors)):
-            if errors[idx]:
-                error_details.append({
-                    "line": start_line + idx,
-                    "error": errors[idx]
-                })
-        raise ValidationError(error_details)
-    with transaction.atomic():
-        serializer.save()
+            if error_details:
+                raise ValidationError(error_details)
+    finally:
+        workbook.close()
     return success_response()
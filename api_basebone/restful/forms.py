@@ -1,6 +1,7 @@
 import functools
-from django.db import IntegrityError
-from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, models, router
+from django.db.models.signals import m2m_changed, post_save, pre_save
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 
 from rest_framework import serializers
 from rest_framework.utils.model_meta import get_field_info
@@ -12,8 +13,11 @@ from api_basebone.core.fields import JSONField
 from jsonfield import JSONField as OriginJSONField
 from rest_framework.fields import JSONField as DrfJSONField
 from api_basebone.restful.const import CLIENT_END_SLUG, MANAGE_END_SLUG
+from api_basebone.settings import settings
+from api_basebone.signals import before_bsm_bulk_create, post_bsm_bulk_create, post_bsm_bulk_update, post_bsm_create
 from api_basebone.utils import module
 from api_basebone.utils.gmeta import get_gmeta_config_by_key
+from api_basebone.utils.prefetch import split_chunks
 from werkzeug import Local
 
 rfu_modes = Local()
@@ -29,26 +33,242 @@ compare_funcs = {
 }
 
 class BulkCreateListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        """校验前一次查询所有行中外键、多对多的关联数据，避免每一行的每个关联字段单独查询"""
+        if isinstance(data, list) and len(data) > 1:
+            for field in self.child.fields.values():
+                self.prefetch_related_field(field, data)
+        return super().to_internal_value(data)
+
+    def prefetch_related_field(self, field, data):
+        relation, many = field, False
+        if isinstance(field, serializers.ManyRelatedField):
+            relation, many = field.child_relation, True
+        if field.read_only or type(relation) is not serializers.PrimaryKeyRelatedField or relation.pk_field:
+            return
+
+        values = set()
+        for row in data:
+            value = row.get(field.field_name) if isinstance(row, dict) else None
+            for item in (value if many and isinstance(value, list) else [value]):
+                if isinstance(item, (str, int)) and not isinstance(item, bool):
+                    values.add(item)
+        if not values:
+            return
+
+        try:
+            objects = {str(obj.pk): obj for obj in relation.get_queryset().filter(pk__in=values)}
+        except (TypeError, ValueError, ValidationError):
+            # 存在非法的值，逐行校验，由字段本身报错
+            return
+
+        origin = relation.to_internal_value
+
+        def to_internal_value(data):
+            obj = objects.get(str(data)) if isinstance(data, (str, int)) else None
+            return obj if obj is not None else origin(data)
+
+        relation.to_internal_value = to_internal_value
+
+    def check_bulk_create(self, validated_data):
+        """检测是否可以使用 bulk_create 批量插入
+
+        bulk_create 不会调用模型的 save，也不会发送 pre_save、post_save、m2m_changed 信号，
+        自定义了 save、create 或者此模型的信号有接收函数（包括没有指定 sender 的接收函数）时逐条创建；
+        多对多字段以及逐条发送 post_bsm_create 信号都需要新数据的主键，数据库不支持插入时返回主键时逐条创建
+        """
+        model = self.child.Meta.model
+        if not settings.BULK_CREATE_BATCH_SIZE or len(validated_data) <= 1:
+            return False
+        if type(self.child).create is not serializers.ModelSerializer.create:
+            return False
+        if model._meta.parents or model.save is not models.Model.save:
+            return False
+        if pre_save.has_listeners(model) or post_save.has_listeners(model):
+            return False
+        need_pk = self.check_row_signal(model)
+        for field in model._meta.many_to_many:
+            if not any(field.name in attrs for attrs in validated_data):
+                continue
+            # 自定义的中间表可能有必填字段
+            through = field.remote_field.through
+            if not through._meta.auto_created or m2m_changed.has_listeners(through):
+                return False
+            need_pk = True
+        if need_pk and not connections[router.db_for_write(model)].features.can_return_ids_from_bulk_insert:
+            return False
+        return True
+
+    def check_row_signal(self, model):
+        """检测批量创建时是否需要对每一条数据发送 post_bsm_create 信号"""
+        return f'{model._meta.app_label}__{model._meta.model_name}' in (settings.BULK_CREATE_ROW_SIGNAL_MODELS or [])
+
     def create(self, validated_data):
-        result = [self.child.create(attrs) for attrs in validated_data]        
-        # self.child.Meta.model.objects.bulk_create(result, ignore_conflicts=False)
-        
+        if self.check_bulk_create(validated_data):
+            return self.bulk_create(validated_data)
+        result = [self.child.create(attrs) for attrs in validated_data]
+        model = self.child.Meta.model
+        if self.check_row_signal(model):
+            # 逐条创建时同样对每一条数据发送 post_bsm_create 信号
+            request = self.context.get('request')
+            scope = self.context.get('scope')
+            for instance in result:
+                post_bsm_create.send(
+                    sender=model, instance=instance, create=True, request=request, old_instance=None, scope=scope
+                )
+        return result
+
+    def bulk_create(self, validated_data):
+        """按 BULK_CREATE_BATCH_SIZE 分批插入，每一批发送一次 before_bsm_bulk_create、post_bsm_bulk_create 信号
+
+        BULK_CREATE_ROW_SIGNAL_MODELS 中的模型，每一批插入后对每一条数据发送 post_bsm_create 信号
+        """
+        model = self.child.Meta.model
+        request = self.context.get('request')
+        scope = self.context.get('scope')
+        row_signal = self.check_row_signal(model)
+        m2m_fields = list(model._meta.many_to_many)
+
+        result = []
+        for chunk in split_chunks(validated_data, settings.BULK_CREATE_BATCH_SIZE):
+            before_bsm_bulk_create.send(sender=model, instances=chunk, request=request, scope=scope)
+            instances, m2m_values = [], []
+            for attrs in chunk:
+                attrs = dict(attrs)
+                m2m_values.append({field.name: attrs.pop(field.name) for field in m2m_fields if field.name in attrs})
+                instances.append(model(**attrs))
+            instances = model._default_manager.bulk_create(instances)
+
+            for field in m2m_fields:
+                through = field.remote_field.through
+                source = through._meta.get_field(field.m2m_field_name()).attname
+                target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+                # 新数据没有关联的数据，去掉同一行中重复的关联数据即可
+                rows = [
+                    through(**{source: instance.pk, target: target_id})
+                    for instance, values in zip(instances, m2m_values)
+                    for target_id in dict.fromkeys(getattr(value, 'pk', value) for value in values.get(field.name) or [])
+                ]
+                if rows:
+                    through._default_manager.bulk_create(rows)
+
+            post_bsm_bulk_create.send(sender=model, instances=instances, request=request, scope=scope)
+            if row_signal:
+                for instance in instances:
+                    post_bsm_create.send(
+                        sender=model, instance=instance, create=True, request=request, old_instance=None, scope=scope
+                    )
+            result.extend(instances)
         return result
     
     def update(self, instance, validated_data):
         """批量更新数据,目前只支持批量级新一个层级的字段，关联字段未支持更新
         """
-        print('批量更新数据')
         pk_name = instance.model._meta.pk.name
         origins = dict([(ins.pk, ins) for ins in instance])
-        ret = []
+        rows = []
         for data in validated_data:
             if data[pk_name] not in origins:
                 # 不在查询结果中，可能是无权限修改
                 continue
-            ins = origins[data[pk_name]]
-            ret.append(self.child.update(ins, data))
-        return ret
+            rows.append((origins[data[pk_name]], data))
+
+        if self.check_bulk_update(instance.model, rows):
+            return self.bulk_update(instance.model, rows)
+        return [self.child.update(ins, data) for ins, data in rows]
+
+    def check_bulk_update(self, model, rows):
+        """检测是否可以使用 bulk_update 批量更新，条件参考 check_bulk_create"""
+        if not settings.BULK_UPDATE_BATCH_SIZE or len(rows) <= 1:
+            return False
+        if type(self.child).update is not update_instance:
+            return False
+        if model.save is not models.Model.save:
+            return False
+        if pre_save.has_listeners(model) or post_save.has_listeners(model):
+            return False
+
+        names = {name for _, data in rows for name in data}
+        for name in names:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return False
+            if field.many_to_many:
+                through = field.remote_field.through
+                if not through._meta.auto_created or m2m_changed.has_listeners(through):
+                    return False
+            elif not field.concrete or field.model is not model:
+                # 多表继承的父模型中的字段
+                return False
+        return True
+
+    def bulk_update(self, model, rows):
+        """按照修改的字段分组，每一组按 BULK_UPDATE_BATCH_SIZE 分批执行 bulk_update，只更新修改了的字段
+
+        值没有变化的字段不更新，没有任何变化的数据不会执行更新；
+        多对多字段在中间表中批量删除、插入，rfu_modes.append 中的字段只添加不删除。
+        更新后发送一次 post_bsm_bulk_update 信号
+        """
+        request = self.context.get('request')
+        scope = self.context.get('scope')
+        auto_now_fields = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+        append_fields = getattr(rfu_modes, 'append', None) or []
+
+        groups, m2m_values = {}, {}
+        for instance, data in rows:
+            changed = []
+            for name, value in data.items():
+                field = model._meta.get_field(name)
+                if field.many_to_many:
+                    m2m_values.setdefault(field, []).append((instance, value))
+                    continue
+                origin = getattr(instance, field.attname)
+                setattr(instance, name, value)
+                if getattr(instance, field.attname) != origin:
+                    changed.append(field.name)
+            if changed:
+                for field in auto_now_fields:
+                    field.pre_save(instance, False)
+                    changed.append(field.name)
+                groups.setdefault(tuple(sorted(set(changed))), []).append(instance)
+
+        for fields, group in groups.items():
+            model._default_manager.bulk_update(group, fields, batch_size=settings.BULK_UPDATE_BATCH_SIZE)
+        for field, values in m2m_values.items():
+            self.bulk_set_many_to_many(field, values, append=field.name in append_fields)
+        instances = [instance for instance, _ in rows]
+        post_bsm_bulk_update.send(sender=model, instances=instances, request=request, scope=scope)
+        return instances
+
+    def bulk_set_many_to_many(self, field, values, append=False):
+        """批量设置多对多字段，values 的格式为 [(数据, 关联数据的列表)]"""
+        through = field.remote_field.through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+
+        batch_size = settings.BULK_UPDATE_BATCH_SIZE
+        current = {}
+        for chunk in split_chunks([instance.pk for instance, _ in values], batch_size):
+            queryset = through._default_manager.filter(**{f'{source}__in': chunk})
+            for pk, source_id, target_id in queryset.values_list('pk', source, target):
+                current.setdefault(source_id, {})[target_id] = pk
+
+        # 已经存在的关联数据已经去掉，不使用 ignore_conflicts，MySQL 中会忽略外键错误的数据
+        removed, added = [], {}
+        for instance, value in values:
+            exists = current.get(instance.pk, {})
+            targets = {getattr(item, 'pk', item) for item in value or []}
+            for item in targets:
+                if item not in exists:
+                    added[(instance.pk, item)] = through(**{source: instance.pk, target: item})
+            if not append:
+                removed += [pk for item, pk in exists.items() if item not in targets]
+
+        for chunk in split_chunks(removed, batch_size):
+            through._default_manager.filter(pk__in=chunk).delete()
+        if added:
+            through._default_manager.bulk_create(list(added.values()), batch_size=batch_size)
 
 def validate_condition_required(
     data, field=[], condition_field=None, operator=None, value=None
@@ -162,6 +382,25 @@ def simple_support_m2m_field_specify_through_model(func):
     return wrapper
 
 
+def update_instance(self, instance, validated_data):
+    """表单的更新方法"""
+    raise_errors_on_nested_writes('update', self, validated_data)
+    info = model_meta.get_field_info(instance)
+
+    for attr, value in validated_data.items():
+        if attr in info.relations and info.relations[attr].to_many:
+            field = getattr(instance, attr)
+            if rfu_modes.append and attr in rfu_modes.append:
+                field.add(*value)
+            else:
+                field.set(value)
+        else:
+            setattr(instance, attr, value)
+    instance.save()
+
+    return instance
+
+
 @simple_support_m2m_field_specify_through_model
 def create_form_class(model, action='create', batch=False, exclude_fields=None, fields=None, **kwargs):
     """构建序列化类"""
@@ -174,27 +413,10 @@ def create_form_class(model, action='create', batch=False, exclude_fields=None,
         self.serializer_field_mapping[OriginJSONField] = DrfJSONField
         super(serializers.ModelSerializer, self).__init__(*args, **kwargs)
 
-    def update(self, instance, validated_data):
-        raise_errors_on_nested_writes('update', self, validated_data)
-        info = model_meta.get_field_info(instance)
-
-        for attr, value in validated_data.items():
-            if attr in info.relations and info.relations[attr].to_many:
-                field = getattr(instance, attr)
-                if rfu_modes.append and attr in rfu_modes.append:
-                    field.add(value)
-                else:
-                    field.set(value)
-            else:
-                setattr(instance, attr, value)
-        instance.save()
-
-        return instance
-
     attrs = {
         'Meta': create_meta_class(model, exclude_fields=None, fields=fields),
         '__init__': __init__,
-        'update': update
+        'update': update_instance
     }
     if action == 'update' and batch:
         attrs[model._meta.pk.name] = serializers.ModelSerializer.serializer_field_mapping[type(model._meta.pk)]()
@@ -34,12 +34,15 @@ from api_basebone.restful.serializers import (
 from api_basebone.utils import meta, module as basebone_module
 from api_basebone.utils.data import get_prefetch_fields_from_export_fields
 from api_basebone.utils.operators import build_filter_conditions2
+from api_basebone.utils.semijoin import get_condition_lookups, semi_join_filter
+from api_basebone.utils.tree import get_tree_max_depth
 from api_basebone.restful.mixins import FormMixin
 from api_basebone.restful.viewsets import BSMModelViewSet
 
 from api_basebone.services import rest_services
 from api_basebone.utils import queryset as queryset_utils
 from api_basebone.services import queryset as queryset_service
+from api_basebone.services.guard import guard_queryset
 
 from .user_pip import add_login_user_data
 
@@ -171,26 +174,22 @@ class QuerySetMixin:
         if role_filters:
             filter_conditions += role_filters
 
-        # 这里做个动作 1 校验过滤条件中的字段，是否需要对结果集去重 2 组装过滤条件
+        # 组装过滤条件，涉及对多关系的条件改写为子查询，不需要再对结果集去重
         if filter_conditions:
-            # TODO: 这里没有做任何的检测，需要加上检测
-            fields = set()
-
-            def tree_check(cond):
-                for c in cond:
-                    if 'children' in c:
-                        tree_check(c['children'])
-                    else:
-                        fields.add(c['field'])
-
-            tree_check(filter_conditions)
-            self.basebone_check_distinct_queryset(list(fields))
             cons = build_filter_conditions2(
                 filter_conditions, context={'user': self.request.user}
             )
+            if not cons:
+                return queryset
+
+            # 统计时关系字段的聚合依赖过滤条件的连接，保持原来的连接查询
+            if self.action == 'statistics':
+                self.basebone_check_distinct_queryset(list(get_condition_lookups(cons)))
+                return queryset.filter(cons)
 
-            if cons:
-                queryset = queryset.filter(cons)
+            queryset, distinct_queryset = semi_join_filter(queryset, cons)
+            if distinct_queryset:
+                self.basebone_distinct_queryset = True
             return queryset
         return queryset
 
@@ -431,7 +430,7 @@ class GenericViewMixin:
         self.expand_fields = None
         if self.action in ['list']:
             fields = self.request.query_params.get(const.EXPAND_FIELDS)
-            self.expand_fields = fields.split(',') if fields else None
+            self.expand_fields = queryset_utils.split_expand_fields(fields) if fields else None
         elif self.action in ['retrieve', 'set']:
             self.expand_fields = self.request.data.get(const.EXPAND_FIELDS)
             # 详情的展开字段和列表的展开字段分开处理
@@ -468,20 +467,25 @@ class GenericViewMixin:
                         self._export_type_config,
                     )
                 )
-                
+
+        # 对多关系的数量限制，例如 items[:5 order by -id]
+        self.expand_fields, self.expand_limits = queryset_utils.parse_expand_fields(self.expand_fields)
 
     def _get_data_with_tree(self, request):
         """检测是否可以设置树形结构"""
         if isinstance(request.data, list):
             return
         self.tree_data = None
+        self.tree_max_depth = None
 
-        data_with_tree = False
+        data_with_tree, tree_max_depth = False, None
         # 检测客户端传进来的树形数据结构的参数
         if request.method.upper() == 'GET':
             data_with_tree = request.query_params.get(const.DATA_WITH_TREE, False)
+            tree_max_depth = request.query_params.get(const.TREE_MAX_DEPTH)
         elif request.method.upper() == 'POST':
             data_with_tree = request.data.get(const.DATA_WITH_TREE, False)
+            tree_max_depth = request.data.get(const.TREE_MAX_DEPTH)
 
         # 如果客户端传进来的参数为真，则通过 admin 配置校验，即 admin 中有没有配置
         if data_with_tree:
@@ -497,6 +501,7 @@ class GenericViewMixin:
                         )
                         if parent_field_data:
                             self.tree_data = parent_field_data
+                            self.tree_max_depth = get_tree_max_depth(tree_max_depth)
                 except Exception:
                     pass
 
@@ -520,7 +525,32 @@ class GenericViewMixin:
 
     def get_display_fields(self):
         return self.request.data.get(const.DISPLAY_FIELDS)
-    
+
+    def get_only_display_fields(self):
+        """用于选择查询列和序列化字段的显示字段
+
+        只有读取的操作做字段选择，树形结构的子节点和根节点的显示字段不同，所以也不做字段选择
+        """
+        if getattr(self, 'tree_data', None) or self.action not in ['list', 'set', 'retrieve']:
+            return
+        return self.get_display_fields() or None
+
+    def get_annotated_fields(self):
+        """需要 annotate 的字段，即显示、过滤、排序中用到的字段，返回 None 时添加所有的字段"""
+        if not settings.ANNOTATE_ON_DEMAND:
+            return
+        display_fields = self.get_only_display_fields()
+        if display_fields is None:
+            return
+        filters = list(self.request.data.get(const.FILTER_CONDITIONS) or [])
+        admin_class = self.get_bsm_model_admin()
+        if admin_class:
+            filters += getattr(admin_class, admin.BSM_DEFAULT_FILTER, None) or []
+        filters += self.get_user_role_filters() or []
+        return queryset_utils.get_annotated_field_names(
+            self.model, display_fields, filters, self.request.data.get(const.ORDER_BY_FIELDS)
+        )
+
     def get_queryset(self):
         """新版get_queryset方法，把组装queryset的方法全移出view之外，不与view绑定。
         """
@@ -530,6 +560,7 @@ class GenericViewMixin:
                 filters=self.request.data.get(const.FILTER_CONDITIONS, []),
                 fields=self.get_display_fields(),
                 expand_fields=self.expand_fields,
+                expand_limits=self.expand_limits,
                 order=self.request.data.get(const.ORDER_BY_FIELDS),
                 tree_data=self.tree_data,
                 skip_distinct=self.action == 'statistics',
@@ -553,13 +584,22 @@ class GenericViewMixin:
         context = {'user': self.request.user}
 
         expand_fields = self.expand_fields
+        display_fields = self.get_only_display_fields()
         if expand_fields:
             expand_fields = self.translate_expand_fields(expand_fields)
             expand_dict = sort_expand_fields(expand_fields)
-            display_fields = self.get_display_fields()
-            queryset = queryset_utils.queryset_prefetch(queryset, expand_dict, context, display_fields=display_fields)
+            expand_limits = dict(zip(
+                self.translate_expand_fields(list(self.expand_limits)), self.expand_limits.values()
+            ))
+            queryset = queryset_utils.queryset_prefetch(
+                queryset, expand_dict, context, display_fields=display_fields, limits=expand_limits
+            )
+        elif display_fields:
+            queryset = queryset_utils.queryset_only(queryset, display_fields)
         if self.action not in ['get_chart', 'group_statistics']:
-            queryset = queryset_utils.annotate(queryset, context=context)
+            queryset = queryset_utils.annotate(
+                queryset, fields=self.get_annotated_fields(), context=context
+            )
 
         if hasattr(self.model, 'GMeta'):
             try:
@@ -590,35 +630,7 @@ class GenericViewMixin:
             check_action = self.action in ['retrieve', 'list', 'set']
 
             if check_not_is_superuser and check_action and check_model:
-                from guardian.ctypes import get_content_type
-                from guardian.models import UserObjectPermission, GroupObjectPermission
-                from django.contrib.auth.models import Permission
-
-                content_type = get_content_type(self.model)
-                permission = Permission.objects.filter(
-                    codename=f'view_{self.model_slug}', content_type=content_type
-                ).first()
-
-                content_object_set = set()
-
-                # 如果存在对应的权限
-                if permission:
-                    permission_object_list = UserObjectPermission.objects.filter(
-                        user=self.request.user, permission=permission
-                    ).values('object_pk')
-                    for item in permission_object_list:
-                        content_object_set.add(item['object_pk'])
-
-                user_groups = self.request.user.groups.all()
-                if user_groups:
-                    group_object_list = GroupObjectPermission.objects.filter(
-                        permission=permission, group__in=user_groups
-                    ).values('object_pk')
-                    for item in group_object_list:
-                        content_object_set.add(item['object_pk'])
-
-                if content_object_set:
-                    queryset = queryset.filter(id__in=content_object_set)
+                queryset = guard_queryset(queryset, self.request.user, self.model)
         return queryset
 
     def get_serializer_class(self, expand_fields=None):
@@ -640,6 +652,7 @@ class GenericViewMixin:
                 tree_structure=tree_data,
                 action=self.action,
                 end_slug=self.end_slug,
+                display_fields=self.get_only_display_fields(),
             )
         else:
             # 如果有展开字段，则创建嵌套的序列化类
@@ -7,7 +7,7 @@ from api_basebone.core import admin, exceptions
 from api_basebone.drf.response import success_response
 from api_basebone.restful import const
 from api_basebone.restful.serializers import get_model_exclude_fields
-from api_basebone.utils.meta import get_all_relation_fields
+from api_basebone.utils.meta import get_all_relation_fields, get_model_meta_index
 from api_basebone.utils.meta import get_bsm_model_admin
 from api_basebone.services.expresstion import resolve_expression, FieldExpression
 from api_basebone.utils.operators import build_filter_conditions2
@@ -47,11 +47,7 @@ class CheckValidateMixin:
             return
 
         # 获取非一对一的关系字段
-        relation_fields = [
-            item.name
-            for item in get_all_relation_fields(self.model)
-            if not item.one_to_one
-        ]
+        relation_fields = get_model_meta_index(self.model).multiple_relation_field_names
 
         if not isinstance(fields, list):
             fields = [fields]
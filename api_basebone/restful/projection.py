@@ -0,0 +1,238 @@
+"""
+只读列表数据的行投影
+
+列表接口默认使用 DRF 的序列化类逐行逐字段序列化，然后再根据 display_fields
+对输出的数据做一次裁剪。这里把序列化类的字段和 display_fields 预先编译成扁平
+的投影计划，遍历数据时一次性输出裁剪后的字典，输出的数据结构和原来保持一致。
+
+- 普通的列直接读取模型实例的属性，再交给对应的序列化字段转换，例如 BigInteger 转字符串
+- 外键直接输出外键的值，不再构造 PKOnlyObject
+- 展开的关系字段编译为嵌套的投影计划，数据来自查询集中已经 prefetch 的数据
+- 计算属性、annotate 字段以及其他字段沿用 DRF 字段的取值方式
+
+如果序列化类不能编译（例如树形结构的递归序列化，或者自定义了 to_representation），
+则返回 None，调用方需要回退到 DRF 的序列化方式。
+"""
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+
+from api_basebone.utils import meta
+
+from .display import check_display_field, filter_display_value
+from .serializers import BaseModelSerializerMixin, get_nested_instances, represent_computed_field
+
+# 模型中普通的列
+COLUMN = 'column'
+# 外键，直接输出外键的值
+PK_RELATION = 'pk_relation'
+# 展开的关系字段
+NESTED = 'nested'
+# 其他的字段，沿用 DRF 字段的取值方式
+GENERIC = 'generic'
+
+
+def get_field_kind(model, field):
+    """获取序列化字段的取值方式"""
+    if isinstance(field, serializers.BaseSerializer):
+        return NESTED
+
+    if len(field.source_attrs) != 1:
+        return GENERIC
+
+    try:
+        model_field = meta.get_model_meta_index(model).fields[field.source_attrs[0]]
+    except KeyError:
+        return GENERIC
+
+    if not model_field.concrete:
+        return GENERIC
+
+    if isinstance(field, PrimaryKeyRelatedField):
+        if field.pk_field is None and (model_field.many_to_one or model_field.one_to_one):
+            return PK_RELATION
+        return GENERIC
+
+    if model_field.is_relation:
+        return GENERIC
+    return COLUMN
+
+
+def check_can_compile(serializer):
+    """检测序列化类是否可以编译为投影计划"""
+    if not isinstance(serializer, BaseModelSerializerMixin):
+        return False
+    return type(serializer).to_representation is BaseModelSerializerMixin.to_representation
+
+
+class Projection:
+    """编译后的投影计划，对应一层模型的序列化类"""
+
+    def __init__(self, steps, computed_fields=None, display_fields_set=None, prefix=''):
+        self.steps = steps
+        self.computed_fields = computed_fields or []
+        # 字典类型的值（例如 JSONField）和序列化后的裁剪一样按照显示字段递归裁剪
+        self.display_fields_set = display_fields_set
+        self.prefix = prefix
+        # 批量计算的计算属性，格式为 {字段名: {主键: 值}}
+        self.computed_values = None
+        self.has_batch_computed_fields = any(
+            batch_func for _, _, batch_func, _ in self.computed_fields
+        ) or any(
+            sub_projection.has_batch_computed_fields
+            for _, sub_projection in self._nested_projections()
+        )
+
+    def _nested_projections(self):
+        for kind, _, field, _, variants in self.steps:
+            if kind != NESTED:
+                continue
+            for keep, sub_projection in variants.values():
+                if keep:
+                    yield field, sub_projection
+
+    def prepare_computed_values(self, instances):
+        """批量计算同一层级数据的计算属性，嵌套的投影计划也按层级一并计算"""
+        self.computed_values = {
+            name: batch_func(instances)
+            for name, _, batch_func, _ in self.computed_fields
+            if batch_func
+        }
+        for field, sub_projection in self._nested_projections():
+            if sub_projection.has_batch_computed_fields:
+                sub_projection.prepare_computed_values(
+                    get_nested_instances(field, instances)
+                )
+
+    def clear_computed_values(self):
+        self.computed_values = None
+        for _, sub_projection in self._nested_projections():
+            sub_projection.clear_computed_values()
+
+    def filter_value(self, key, value):
+        """按照显示字段裁剪字典以及列表类型的值"""
+        if self.display_fields_set is None or not isinstance(value, (dict, list)):
+            return value
+        return filter_display_value(self.display_fields_set, value, f'{self.prefix}.{key}' if self.prefix else key)
+
+    def represent(self, instance):
+        """把单个模型实例投影为字典"""
+        ret = {}
+        for kind, name, field, attr, variants in self.steps:
+            if kind == COLUMN:
+                value = getattr(instance, attr)
+                ret[name] = None if value is None else self.filter_value(name, field.to_representation(value))
+                continue
+
+            if kind == PK_RELATION:
+                ret[name] = getattr(instance, attr)
+                continue
+
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+
+            check_for_none = (
+                attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            )
+
+            key = name
+            if isinstance(attribute, models.Manager):
+                # 反向字段的 related_name 转换为反向字段的名称
+                key = attr
+                attribute = attribute.all()
+
+            keep, sub_projection = variants[key]
+            if not keep:
+                continue
+
+            if check_for_none is None:
+                ret[key] = None
+            elif kind == NESTED:
+                if isinstance(field, serializers.ListSerializer):
+                    ret[key] = [sub_projection.represent(item) for item in attribute]
+                else:
+                    ret[key] = sub_projection.represent(attribute)
+            else:
+                ret[key] = self.filter_value(key, field.to_representation(attribute))
+
+        computed_values = self.computed_values or {}
+        for name, computed_func, _, field in self.computed_fields:
+            value = represent_computed_field(instance, name, computed_func, field, computed_values)
+            ret[name] = self.filter_value(name, value)
+        return ret
+
+    def represent_many(self, instances):
+        """把模型实例列表投影为字典的列表"""
+        represent = self.represent
+        if not self.has_batch_computed_fields:
+            return [represent(instance) for instance in instances]
+
+        instances = list(instances)
+        self.prepare_computed_values(instances)
+        try:
+            return [represent(instance) for instance in instances]
+        finally:
+            self.clear_computed_values()
+
+
+def compile_computed_fields(serializer, display_fields_set, prefix):
+    """编译 admin 中声明的计算属性字段"""
+    return [
+        item
+        for item in serializer.admin_computed_fields
+        if check_display_field(display_fields_set, item[0], prefix)
+    ]
+
+
+def compile_projection(serializer, display_fields_set=None, prefix=''):
+    """把序列化类编译为投影计划
+
+    Params:
+        serializer 序列化类的实例，字段已经绑定好上下文
+        display_fields_set set 展开后的显示字段集合，None 表示显示所有字段
+        prefix str 嵌套序列化类的键前缀
+
+    Returns:
+        Projection 投影计划，不能编译时返回 None
+    """
+    if not check_can_compile(serializer):
+        return
+
+    model = serializer.Meta.model
+    reverse_field_map = meta.get_reverse_field_name_map(model)
+
+    steps = []
+    for field in serializer._readable_fields:
+        name = field.field_name
+        kind = get_field_kind(model, field)
+
+        if kind in (COLUMN, PK_RELATION):
+            if check_display_field(display_fields_set, name, prefix):
+                attr = field.source_attrs[0]
+                if kind == PK_RELATION:
+                    attr = model._meta.get_field(attr).attname
+                steps.append((kind, name, field, attr, None))
+            continue
+
+        # 取值为 Manager 时，输出的键会转换为反向字段的名称
+        manager_name = reverse_field_map.get(name, name)
+        variants = {}
+        for key in {name, manager_name}:
+            keep = check_display_field(display_fields_set, key, prefix)
+            sub_projection = None
+            if keep and kind == NESTED:
+                child = getattr(field, 'child', field)
+                full_key = f'{prefix}.{key}' if prefix else key
+                sub_projection = compile_projection(child, display_fields_set, full_key)
+                if sub_projection is None:
+                    return
+            variants[key] = (keep, sub_projection)
+
+        if any(keep for keep, _ in variants.values()):
+            steps.append((kind, name, field, manager_name, variants))
+
+    computed_fields = compile_computed_fields(serializer, display_fields_set, prefix)
+    return Projection(steps, computed_fields, display_fields_set, prefix)
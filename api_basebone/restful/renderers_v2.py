@@ -15,6 +15,7 @@ from api_basebone.core import gmeta
 from api_basebone.core.decorators import BSM_ADMIN_COMPUTED_FIELDS_MAP
 from api_basebone.utils.gmeta import get_attr_in_gmeta_class
 from api_basebone.utils.meta import get_all_relation_fields
+from api_basebone.utils.prefetch import iterate_queryset
 from api_basebone.utils.timezone import local_timestamp
 
 
@@ -254,7 +255,7 @@ def csv_render(model, queryset, serializer_class, export_config=None):
         writer.writerow(verbose_names)
 
         # 处理结果集
-        queryset_iter = queryset if isinstance(queryset, list) else queryset.all()
+        queryset_iter = queryset if isinstance(queryset, list) else iterate_queryset(queryset.all())
 
         for instance in queryset_iter:
             instance_data = serializer_class(instance).data
@@ -270,7 +271,7 @@ def csv_render(model, queryset, serializer_class, export_config=None):
         writer.writerow(verbose_names)
 
         # 处理结果集
-        queryset_iter = queryset if isinstance(queryset, list) else queryset.all()
+        queryset_iter = queryset if isinstance(queryset, list) else iterate_queryset(queryset.all())
 
         for instance in queryset_iter:
             instance_data = serializer_class(instance).data
@@ -287,19 +288,11 @@ def excel_render(model, queryset, serializer_class, export_config=None):
     response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     response['Content-Disposition'] = f'attachment; filename="{file_name}.xlsx"'
 
-    datas = []
-    
     get_fields = get_merge_fields if export_config['merge_bref'] else get_no_merge_fields
     row_data = row_data_merge if export_config['merge_bref'] else row_data_no_merge
 
     fields = get_fields(model, serializer_class, export_config)
-    # 处理结果集
-    queryset_iter = queryset if isinstance(queryset, list) else queryset.all()
-    for instance in queryset_iter:
-        instance_data = serializer_class(instance).data
-        rows = row_data(model, fields, instance_data, export_config['fields'])
-        datas.append(rows)
-    
+
     workbook = openpyxl.Workbook()
     sheet = workbook.active
 
@@ -307,9 +300,13 @@ def excel_render(model, queryset, serializer_class, export_config=None):
     print('titles: ', titles)
     for i in range(len(titles)):
         sheet.cell(1, i + 1, titles[i])
-    
+
+    # 处理结果集，分块读取后直接写入表格，不再缓存所有的行数据
     insert_line = 2
-    for rows in datas:
+    queryset_iter = queryset if isinstance(queryset, list) else iterate_queryset(queryset.all())
+    for instance in queryset_iter:
+        instance_data = serializer_class(instance).data
+        rows = row_data(model, fields, instance_data, export_config['fields'])
         for row in rows:
             for i in range(len(row)):
                 cell = sheet.cell(insert_line, i + 1, row[i])
@@ -1,3 +1,4 @@
+import types
 from collections import OrderedDict
 from collections.abc import Mapping
 
@@ -18,15 +19,44 @@ from jsonfield import JSONField as OriginJSONField
 from rest_framework.fields import JSONField as DrfJSONField
 from api_basebone.drf.fields import CharIntegerField
 from api_basebone.export.fields import get_attr_in_gmeta_class
+from api_basebone.settings import settings
 from api_basebone.utils import meta, module
 from api_basebone.utils.gmeta import get_gmeta_config_by_key
+from api_basebone.utils.lru import LRUCache, freeze
 from api_basebone.utils.module import import_class_from_string
 
 from .const import MANAGE_END_SLUG
+from .display import compile_display_fields
 
 # 导出文件的动作
 EXPORT_FILE_ACTION = 'export_file'
 
+# 动态生成的序列化类的缓存，键为生成序列化类的参数签名
+serializer_class_cache = LRUCache(settings.SERIALIZER_CLASS_CACHE_SIZE)
+
+
+def serializer_class_cache_key(model, **kwargs):
+    """生成序列化类缓存的键，如果参数不能哈希，则返回 None，即不使用缓存"""
+    key = (model, freeze(kwargs))
+    try:
+        hash(key)
+    except TypeError:
+        return
+    return key
+
+
+def clear_serializer_class_cache():
+    """清空序列化类的缓存
+
+    admin 配置变更时需要调用，避免使用到旧的序列化类
+    """
+    serializer_class_cache.clear()
+
+
+def get_serializer_class_cache_info():
+    """获取序列化类缓存的命中统计"""
+    return serializer_class_cache.info()
+
 
 class ModelSerializer(serializers.ModelSerializer):
 
@@ -39,13 +69,7 @@ def get_model_exclude_fields(model, exclude_fields):
     Params:
         model class django 模型类
     """
-    field_list = []
-    gmeta_class = getattr(model, 'GMeta', None)
-    if gmeta_class:
-        exclude = getattr(gmeta_class, gmeta.GMETA_SERIALIZER_EXCLUDE_FIELDS, None)
-        if exclude and isinstance(exclude, (list, tuple)):
-            fields = [item.name for item in model._meta.get_fields()]
-            field_list = [item for item in exclude if item in fields]
+    field_list = list(meta.get_model_meta_index(model).exclude_fields)
     key = f'{model._meta.app_label}__{model._meta.model_name}'
     if isinstance(exclude_fields, dict) and exclude_fields:
         if key in exclude_fields and isinstance(exclude_fields[key], list):
@@ -53,6 +77,73 @@ def get_model_exclude_fields(model, exclude_fields):
     return field_list
 
 
+def get_admin_computed_fields(model, action=None):
+    """获取 admin 中声明的计算属性字段
+
+    Returns:
+        list 元素为 (字段名, 计算方法, 批量计算方法, 序列化字段) 的元组，没有批量计算方法时为 None
+    """
+    admin_computed_fields = getattr(model, BSM_ADMIN_COMPUTED_FIELDS_MAP, {})
+    if not admin_computed_fields:
+        return []
+    admin_class = meta.get_bsm_model_admin(model)
+    if not admin_class:
+        return []
+
+    admin_instance, result = admin_class(), []
+    for name, field_value in admin_computed_fields.items():
+        field_type = field_value['field_type']
+        computed_func = getattr(admin_instance, name, None)
+        if not computed_func:
+            continue
+
+        batch_func = field_value.get('batch')
+        if batch_func:
+            batch_func = types.MethodType(batch_func, admin_instance)
+
+        serializer_class = ComputedFieldTypeSerializerMap[field_type]
+        # 如果是导出，则使用导出的字段序列化类
+        if action == EXPORT_FILE_ACTION and field_type in ExportFieldTypeSerializerMap:
+            serializer_class = ExportFieldTypeSerializerMap[field_type]
+        result.append((name, computed_func, batch_func, serializer_class(read_only=True)))
+    return result
+
+
+def represent_computed_field(instance, name, computed_func, field, computed_values):
+    """输出计算属性字段的值，computed_values 为批量计算的结果
+
+    和逐行计算一样总是交给序列化字段转换，导出的字段会把空值转换为 '' 等可读的值，
+    批量计算的结果中没有的主键输出 None
+    """
+    if name in computed_values:
+        if instance.pk not in computed_values[name]:
+            return None
+        value = computed_values[name][instance.pk]
+    else:
+        value = computed_func(instance)
+    return field.to_representation(value)
+
+
+def get_nested_instances(field, instances):
+    """获取嵌套字段对应的所有模型实例"""
+    result = []
+    for instance in instances:
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            continue
+        if attribute is None:
+            continue
+
+        if isinstance(attribute, models.Manager):
+            result.extend(attribute.all())
+        elif isinstance(field, serializers.ListSerializer):
+            result.extend(attribute)
+        else:
+            result.append(attribute)
+    return result
+
+
 class RecursiveSerializer(serializers.Serializer):
     """递归序列化类，目标是为了形成树形数据结构"""
 
@@ -67,6 +158,14 @@ class BaseModelSerializerMixin:
     class Meta:
         fields = '__all__'
 
+    # 当前层级的显示字段，None 表示显示所有字段
+    basebone_display_fields = None
+
+    _admin_computed_fields = None
+    _has_batch_computed_fields = None
+    # 批量计算的计算属性，格式为 {字段名: {主键: 值}}
+    _computed_values = None
+
     def to_representation(self, instance):
         """
         Object instance -> Dict of primitive datatypes.
@@ -75,16 +174,7 @@ class BaseModelSerializerMixin:
         fields = self._readable_fields
 
         # 获取反向字段 related_name 和 name 的映射
-        model, reverse_field_map = self.Meta.model, {}
-        reverse_fields = meta.get_reverse_fields(model)
-
-        if reverse_fields:
-            for item in reverse_fields:
-                related_name = meta.get_relation_field_related_name(
-                    item.related_model, item.remote_field.name
-                )
-                if related_name:
-                    reverse_field_map[related_name[0]] = item.name
+        reverse_field_map = meta.get_reverse_field_name_map(self.Meta.model)
 
         for field in fields:
             try:
@@ -110,34 +200,84 @@ class BaseModelSerializerMixin:
             else:
                 ret[field.field_name] = field.to_representation(attribute)
 
-        # 这了处理 admin 中计算属性字段的业务
-        if self.basebone_end_slug == MANAGE_END_SLUG:
-            admin_computed_fields = getattr(
-                self.basebone_model, BSM_ADMIN_COMPUTED_FIELDS_MAP, {}
-            )
-            if not admin_computed_fields:
-                return ret
-            admin_class = meta.get_bsm_model_admin(self.basebone_model)
-            if not admin_class:
-                return ret
-
-            admin_instance = admin_class()
-            for name, field_value in admin_computed_fields.items():
-                field_type = field_value['field_type']
-                computed_func = getattr(admin_instance, name, None)
-                if not computed_func:
-                    continue
-                value = computed_func(instance)
-                serializer_class = ComputedFieldTypeSerializerMap[field_type]
-                # 如果是导出，则使用导出的字段序列化类
-                if (
-                    self.action == EXPORT_FILE_ACTION
-                    and field_type in ExportFieldTypeSerializerMap
-                ):
-                    serializer_class = ExportFieldTypeSerializerMap[field_type]
-                ret[name] = serializer_class(read_only=True).to_representation(value)
+        # 这了处理 admin 中计算属性字段的业务，已经批量计算的直接取值
+        computed_values = self._computed_values or {}
+        for name, computed_func, _, field in self.admin_computed_fields:
+            ret[name] = represent_computed_field(instance, name, computed_func, field, computed_values)
         return ret
 
+    @property
+    def admin_computed_fields(self):
+        """admin 中声明的计算属性字段，只有管理端输出"""
+        if self._admin_computed_fields is None:
+            self._admin_computed_fields = []
+            if self.basebone_end_slug == MANAGE_END_SLUG:
+                plan = compile_display_fields(self.basebone_display_fields)
+                self._admin_computed_fields = [
+                    item
+                    for item in get_admin_computed_fields(self.basebone_model, self.action)
+                    if plan is None or plan.check(item[0])
+                ]
+        return self._admin_computed_fields
+
+    @property
+    def has_batch_computed_fields(self):
+        """当前以及嵌套的序列化类中是否有声明了批量计算的计算属性字段"""
+        if self._has_batch_computed_fields is None:
+            self._has_batch_computed_fields = any(
+                batch_func for _, _, batch_func, _ in self.admin_computed_fields
+            ) or any(
+                child.has_batch_computed_fields
+                for _, child in self._nested_serializers()
+            )
+        return self._has_batch_computed_fields
+
+    def _nested_serializers(self):
+        for field in self._readable_fields:
+            child = getattr(field, 'child', field)
+            if isinstance(child, BaseModelSerializerMixin):
+                yield field, child
+
+    def prepare_computed_values(self, instances):
+        """批量计算同一层级数据的计算属性，嵌套的序列化类也按层级一并计算
+
+        Params:
+            instances list 同一层级的模型实例
+        """
+        self._computed_values = {
+            name: batch_func(instances)
+            for name, _, batch_func, _ in self.admin_computed_fields
+            if batch_func
+        }
+        for field, child in self._nested_serializers():
+            if child.has_batch_computed_fields:
+                child.prepare_computed_values(get_nested_instances(field, instances))
+
+    def clear_computed_values(self):
+        self._computed_values = None
+        for _, child in self._nested_serializers():
+            if child._computed_values is not None:
+                child.clear_computed_values()
+
+
+class BaseModelListSerializer(serializers.ListSerializer):
+    """列表序列化类，输出前对整页数据批量计算 admin 中的计算属性"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+
+        # 嵌套的列表已经由上一层级统一计算过了
+        child = self.child
+        if child._computed_values is not None or not child.has_batch_computed_fields:
+            return [child.to_representation(item) for item in iterable]
+
+        instances = list(iterable)
+        child.prepare_computed_values(instances)
+        try:
+            return [child.to_representation(item) for item in instances]
+        finally:
+            child.clear_computed_values()
+
 
 class CustomModelSerializer(serializers.ModelSerializer):
     """由于BigInteger类型的数据到了前端，JS丢失了精度，所以在接口返回的时候就直接转成字符串
@@ -175,7 +315,7 @@ def create_meta_class(
         exclude_fields list 排除的字段
     """
 
-    attrs = {'model': model}
+    attrs = {'model': model, 'list_serializer_class': BaseModelListSerializer}
 
     exclude_field_list = get_model_exclude_fields(model, exclude_fields)
     if action in ['list', 'set', 'retrieve']:
@@ -197,14 +337,16 @@ def create_meta_class(
             if f.concrete and (not isinstance(f, OneToOneField) or allow_one_to_one)
         ]
 
-    if display_fields is not None and '*' not in display_fields:
-        flat_fields = list(set(flat_fields) & set(display_fields))
+    # 按照显示字段选择字段，支持 * 通配符和 - 排除
+    plan = compile_display_fields(display_fields)
+    if plan is not None:
+        flat_fields = [name for name in flat_fields if plan.check(name)]
 
     if extra_fields:
         flat_fields += extra_fields
 
     if exclude_field_list:
-        attrs['fields'] = list(set(flat_fields).difference(set(exclude_field_list)))
+        attrs['fields'] = [name for name in flat_fields if name not in exclude_field_list]
     else:
         attrs['fields'] = flat_fields
     return type('Meta', (object,), attrs)
@@ -222,9 +364,37 @@ def create_serializer_class(
 ):
     """构建序列化类
 
+    没有传入 attrs 时，生成的序列化类会被缓存，相同的参数直接返回缓存的类
+
     Params:
         tree_structure 元组 admin 中做对应配置
     """
+    kwargs = {
+        'exclude_fields': exclude_fields,
+        'tree_structure': tree_structure,
+        'action': action,
+        'end_slug': end_slug,
+        'display_fields': display_fields,
+        'allow_one_to_one': allow_one_to_one,
+    }
+    key = None if attrs else serializer_class_cache_key(model, **kwargs)
+    if key is None:
+        return _create_serializer_class(model, attrs=attrs, **kwargs)
+    return serializer_class_cache.get_or_set(
+        key, lambda: _create_serializer_class(model, **kwargs)
+    )
+
+
+def _create_serializer_class(
+    model,
+    exclude_fields=None,
+    tree_structure=None,
+    action=None,
+    end_slug=None,
+    attrs=None,
+    display_fields=None,
+    allow_one_to_one=False,
+):
     if attrs is None:
         attrs = {}
 
@@ -256,10 +426,16 @@ def create_serializer_class(
     if tree_structure:
         extra_fields.append(tree_structure[1])
         new_attr[tree_structure[1]] = RecursiveSerializer(many=True)
+        # 子节点和根节点使用同一个序列化类，但是子节点的显示字段和根节点不同，所以这里不做字段选择
+        display_fields = None
+    plan = compile_display_fields(display_fields)
 
     # 构建计算属性字段
     computed_fields = get_gmeta_config_by_key(model, gmeta.GMETA_COMPUTED_FIELDS)
     if computed_fields:
+        computed_fields = [
+            f for f in computed_fields if plan is None or plan.check(f['name'])
+        ]
         extra_fields += [f['name'] for f in computed_fields]
         for field in computed_fields:
             name = field['name']
@@ -279,8 +455,10 @@ def create_serializer_class(
     # 构建annotate算属性字段
     annotated_fields = get_attr_in_gmeta_class(model, gmeta.GMETA_ANNOTATED_FIELDS, {})
     if annotated_fields:
-        extra_fields += annotated_fields.keys()
         for name, field in annotated_fields.items():
+            if plan is not None and not plan.check(name):
+                continue
+            extra_fields.append(name)
             new_attr[name] = ComputedFieldTypeSerializerMap[field['type']](read_only=True)
 
     class_name = f'{model.__name__}ModelSerializer'
@@ -299,6 +477,7 @@ def create_serializer_class(
             'action': action,
             'basebone_model': model,
             'basebone_end_slug': end_slug,
+            'basebone_display_fields': display_fields,
             '__init__': __init__,
             **new_attr,
             **attrs,
@@ -316,21 +495,12 @@ def get_field(model, field_name):
     Returns:
         field 指定 model 的字段
     """
-    valid_fields = {item.name: item for item in model._meta.get_fields()}
-    if field_name in valid_fields:
-        return valid_fields[field_name]
+    index = meta.get_model_meta_index(model)
+    if field_name in index.fields:
+        return index.fields[field_name]
 
     # 如果没有找到指定的字段，则通过反向字段的 related_name 进行查找
-    related_field_map = {}
-    for field in meta.get_reverse_fields(model):
-        related_name = meta.get_relation_field_related_name(
-            field.related_model, field.remote_field.name
-        )
-        if related_name:
-            related_field_map[related_name[0]] = field
-
-    if field_name in related_field_map:
-        return related_field_map[field_name]
+    return index.related_name_fields.get(field_name)
 
 
 def dict_merge(dct, merge_dct):
@@ -390,19 +560,15 @@ def nested_display_fields(model, super_display_fields, key):
     if not super_display_fields:
         return None
 
-    reverse_fields = meta.get_reverse_fields(model)
-
-    reverse_field_map = {}
-    if reverse_fields:
-        for item in reverse_fields:
-            related_name = meta.get_relation_field_related_name(
-                item.related_model, item.remote_field.name
-            )
-            if related_name:
-                reverse_field_map[related_name[0]] = item.name
+    reverse_field_map = meta.get_reverse_field_name_map(model)
     if key in reverse_field_map:
         key = reverse_field_map[key]
-    return ['.'.join(d.split('.')[1:]) for d in super_display_fields if d.startswith(key+'.')]
+    # 排除的字段也传递到下一层，例如 -customer.user 转换为 -user
+    return [
+        '.'.join(d.split('.')[1:]) if not d.startswith('-') else '-' + d[len(key) + 2:]
+        for d in super_display_fields
+        if d.startswith(key + '.') or d.startswith('-' + key + '.')
+    ]
 
 
 def create_nested_serializer_class(
@@ -450,7 +616,7 @@ def create_nested_serializer_class(
 
 
 def display_fields_to_expand_fields(display_fields):
-    return [d.rsplit('.', 1)[0] for d in display_fields if '.' in d]
+    return [d.rsplit('.', 1)[0] for d in display_fields if '.' in d and not d.startswith('-')]
 
 
 def multiple_create_serializer_class(
@@ -462,15 +628,41 @@ def multiple_create_serializer_class(
     end_slug=None,
     display_fields=None,
 ):
-    """多重创建序列化类"""
-    attrs = {}
+    """多重创建序列化类
 
+    生成的序列化类会被缓存，键为模型、展开字段树、显示字段、动作、端、排除字段和树形结构
+    """
     if expand_fields is None:
         if display_fields is not None:
             expand_fields = display_fields_to_expand_fields(display_fields)
         else:
             expand_fields = []
     expand_dict = sort_expand_fields(expand_fields)
+    kwargs = {
+        'tree_structure': tree_structure,
+        'exclude_fields': exclude_fields,
+        'action': action,
+        'end_slug': end_slug,
+        'display_fields': display_fields,
+    }
+    key = serializer_class_cache_key(model, expand_dict=expand_dict, **kwargs)
+    if key is None:
+        return _multiple_create_serializer_class(model, expand_dict, **kwargs)
+    return serializer_class_cache.get_or_set(
+        key, lambda: _multiple_create_serializer_class(model, expand_dict, **kwargs)
+    )
+
+
+def _multiple_create_serializer_class(
+    model,
+    expand_dict,
+    tree_structure=None,
+    exclude_fields=None,
+    action=None,
+    end_slug=None,
+    display_fields=None,
+):
+    attrs = {}
     for key, value in expand_dict.items():
         field = get_field(model, key)
         # 如果是反向字段，则使用另外一种方式
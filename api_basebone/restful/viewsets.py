@@ -2,10 +2,22 @@ from rest_framework import viewsets
 from rest_framework.decorators import action
 
 from api_basebone.core import const
-from api_basebone.services import rest_services
+from api_basebone.db import router
+from api_basebone.services import query_profile, rest_services, result_cache
 
 
 class BSMModelViewSet(viewsets.ModelViewSet):
+    def dispatch(self, request, *args, **kwargs):
+        # 统计请求中执行的 SQL，参考 services.query_profile
+        return query_profile.profile_response(
+            self, lambda: super(BSMModelViewSet, self).dispatch(request, *args, **kwargs)
+        )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # 只读的操作可以使用只读副本
+        router.use_replica(self.action, request.user)
+
     def perform_create(self, serializer):
         return serializer.save()
 
@@ -15,7 +27,7 @@ class BSMModelViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         """获取列表数据"""
         display_fields = request.data.get(const.DISPLAY_FIELDS)
-        return rest_services.display(self, display_fields)
+        return result_cache.cached_response(self, lambda: rest_services.display(self, display_fields))
 
     @action(methods=['POST'], detail=False, url_path='list')
     def set(self, request, app, model, **kwargs):
@@ -25,7 +37,7 @@ class BSMModelViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         """获取数据详情"""
         display_fields = request.data.get(const.DISPLAY_FIELDS)
-        return rest_services.retrieve(self, display_fields)
+        return result_cache.cached_response(self, lambda: rest_services.retrieve(self, display_fields))
 
     def destroy(self, request, *args, **kwargs):
         """删除数据"""
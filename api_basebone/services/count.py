@@ -0,0 +1,188 @@
+"""
+列表数据的计数服务
+
+分页时每一页都会执行一次 COUNT(*)，数据量大的表上非常慢，这里提供：
+
+- 近似计数，只适用于没有筛选条件的查询，PostgreSQL 使用查询计划的估算行数，MySQL 使用 SHOW TABLE STATUS
+- 精确计数的短期缓存，缓存键由查询语句的指纹和用户范围组成，只对 COUNT_CACHE_MODELS 中的模型开启
+
+近似计数默认关闭，COUNT_APPROXIMATE_THRESHOLD 大于 0 时开启，近似计数小于此数量时，估算的误差相对较大，仍然使用精确计数
+
+开启了计数缓存的模型，以下数据变动时计数缓存立即失效：
+
+- 模型的 post_save、post_delete 信号，只对这些模型连接信号，其他模型的删除仍然可以使用 fast delete
+- bsm 的信号、批量动作、按条件删除和更新，它们直接操作查询集，不会发送信号
+
+筛选条件中关联模型的数据变动以及直接执行的 QuerySet.update，计数缓存在 COUNT_CACHE_TIMEOUT 秒后过期
+"""
+import hashlib
+import json
+import logging
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api_basebone.settings import settings
+from api_basebone.signals import post_bsm_bulk_create, post_bsm_bulk_update, post_bsm_create, post_bsm_delete
+
+log = logging.getLogger(__name__)
+
+COUNT_CACHE_KEY = 'bsm_count:{label}:{version}:{fingerprint}'
+COUNT_VERSION_CACHE_KEY = 'bsm_count_version:{label}'
+
+
+def get_model_label(model):
+    return model._meta.concrete_model._meta.label_lower
+
+
+def get_model_key(model):
+    return f'{model._meta.app_label}__{model._meta.model_name}'
+
+
+def check_cache_model(model):
+    """检测模型是否开启了计数缓存"""
+    return bool(settings.COUNT_CACHE_TIMEOUT) and get_model_key(model) in (settings.COUNT_CACHE_MODELS or [])
+
+
+def get_count_version(model):
+    return cache.get(COUNT_VERSION_CACHE_KEY.format(label=get_model_label(model)), 0)
+
+
+def clean_count_cache(model):
+    """模型的数据变动后，使模型所有的计数缓存失效"""
+    key = COUNT_VERSION_CACHE_KEY.format(label=get_model_label(model))
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_fingerprint(queryset, scope=None):
+    """查询语句的指纹"""
+    sql, params = queryset.query.sql_with_params()
+    content = json.dumps([sql, [str(item) for item in params], scope])
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def check_unconstrained(query):
+    """检测查询是否没有任何的筛选条件"""
+    return (
+        not query.where
+        and query.high_mark is None
+        and query.low_mark == 0
+        and not query.select
+        and not query.group_by
+        and not query.distinct
+    )
+
+
+def get_mysql_table_rows(queryset):
+    """MySQL 的表行数估算，只适用于没有筛选条件的查询"""
+    if not check_unconstrained(queryset.query):
+        return
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('SHOW TABLE STATUS LIKE %s', (queryset.model._meta.db_table,))
+        row = cursor.fetchone()
+    return row[4] if row else None
+
+
+def get_postgresql_plan_rows(queryset):
+    """PostgreSQL 查询计划估算的行数，依赖表的统计信息，有筛选条件时误差很大，只用于没有筛选条件的查询"""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+APPROXIMATE_COUNT_HANDLERS = {
+    'mysql': get_mysql_table_rows,
+    'postgresql': get_postgresql_plan_rows,
+}
+
+
+def get_approximate_count(queryset):
+    """近似计数，数据库不支持或者有筛选条件时返回 None"""
+    handler = APPROXIMATE_COUNT_HANDLERS.get(connections[queryset.db].vendor)
+    if handler is None or not check_unconstrained(queryset.query):
+        return
+    try:
+        return handler(queryset)
+    except Exception as e:
+        log.warning(f'get approximate count error: {e}')
+
+
+def get_exact_count(queryset, scope=None):
+    """精确计数，结果会缓存 COUNT_CACHE_TIMEOUT 秒"""
+    if not check_cache_model(queryset.model):
+        return queryset.count()
+
+    key = COUNT_CACHE_KEY.format(
+        label=get_model_label(queryset.model),
+        version=get_count_version(queryset.model),
+        fingerprint=get_fingerprint(queryset, scope),
+    )
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def count_queryset(queryset, scope=None, exact=False):
+    """统计结果集的数量
+
+    Params:
+        queryset 结果集
+        scope 用户范围，例如用户的主键，作为缓存键的一部分
+        exact bool 是否必须精确计数
+
+    Returns:
+        (int, bool) 数量以及是否精确
+    """
+    if not isinstance(queryset, QuerySet):
+        return len(queryset), True
+    if queryset._result_cache is not None:
+        return len(queryset._result_cache), True
+
+    threshold = settings.COUNT_APPROXIMATE_THRESHOLD
+    if not exact and threshold:
+        count = get_approximate_count(queryset)
+        if count is not None and count >= threshold:
+            return count, False
+    return get_exact_count(queryset, scope), True
+
+
+@receiver(post_bsm_create, dispatch_uid='bsm_count_clean_by_bsm_create')
+@receiver(post_bsm_bulk_create, dispatch_uid='bsm_count_clean_by_bsm_bulk_create')
+@receiver(post_bsm_bulk_update, dispatch_uid='bsm_count_clean_by_bsm_bulk_update')
+@receiver(post_bsm_delete, dispatch_uid='bsm_count_clean_by_bsm_delete')
+def clean_count_cache_by_signal(sender, **kwargs):
+    if check_cache_model(sender):
+        clean_count_cache(sender)
+
+
+def iter_signal_receivers():
+    """按照模型连接的信号，格式为 (信号, 接收函数, 发送者, dispatch_uid)"""
+    for key in settings.COUNT_CACHE_MODELS or []:
+        model = apps.get_model(*key.split('__'))
+        label = get_model_label(model)
+        yield post_save, clean_count_cache_by_signal, model, f'bsm_count_clean_by_save:{label}'
+        yield post_delete, clean_count_cache_by_signal, model, f'bsm_count_clean_by_delete:{label}'
+
+
+def connect_signals():
+    """只对 COUNT_CACHE_MODELS 中的模型连接 post_save、post_delete 信号，在 AppConfig.ready 中调用"""
+    for signal, func, sender, dispatch_uid in iter_signal_receivers():
+        signal.connect(func, sender=sender, dispatch_uid=dispatch_uid)
+
+
+def disconnect_signals():
+    for signal, func, sender, dispatch_uid in iter_signal_receivers():
+        signal.disconnect(func, sender=sender, dispatch_uid=dispatch_uid)
@@ -1,4 +1,5 @@
 import re
+import copy
 import json
 import logging
 import operator
@@ -11,6 +12,7 @@ from django.db.models import *
 from django.db.models.functions import Concat, Cast, Coalesce
 
 from api_basebone.services.functions import GroupConcat
+from api_basebone.utils.lru import LRUCache
 
 log = logging.getLogger(__name__)
 
@@ -55,57 +57,154 @@ FUNCS = {
 }
 
 
+class ExpressionSyntaxError(ValueError):
+    """表达式的语法错误，position 为出错的位置"""
+
+    def __init__(self, message, expression, position):
+        self.expression = expression
+        self.position = position
+        super().__init__(f'{message} at position {position}: {expression}')
+
+
+# 表达式的语法树节点
+Literal = namedtuple('Literal', ['value'])
+Name = namedtuple('Name', ['name'])
+Attribute = namedtuple('Attribute', ['value', 'name'])
+Call = namedtuple('Call', ['function', 'arguments'])
+
+IDENTIFIER_PATTERN = re.compile(r'\w+')
+SPACE_PATTERN = re.compile(r'\s*')
+# 作为字面量的标识符，和 json 一致
+LITERAL_IDENTIFIERS = {'true': True, 'false': False, 'null': None, 'NaN': float('nan'), 'Infinity': float('inf')}
+json_decoder = json.JSONDecoder()
+
+
+class ExpressionParser:
+    """表达式的解析器，把表达式解析为语法树
+
+    语法如下，字面量为 json 的格式：
+
+        expression := primary ('.' identifier)*
+        primary    := literal | identifier '(' [expression (',' expression)* [',']] ')' | identifier
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.position = 0
+
+    def error(self, message, position=None):
+        return ExpressionSyntaxError(
+            message, self.expression, self.position if position is None else position
+        )
+
+    def skip_space(self):
+        self.position = SPACE_PATTERN.match(self.expression, self.position).end()
+
+    def peek(self):
+        self.skip_space()
+        return self.expression[self.position:self.position + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            found = self.peek() or 'end of expression'
+            raise self.error(f'expected "{char}" but found "{found}"')
+        self.position += 1
+
+    def parse(self):
+        node = self.parse_expression()
+        if self.peek():
+            raise self.error(f'unexpected "{self.peek()}"')
+        return node
+
+    def parse_expression(self):
+        node = self.parse_primary()
+        while self.peek() == '.':
+            self.position += 1
+            node = Attribute(node, self.parse_identifier())
+        return node
+
+    def parse_identifier(self):
+        self.skip_space()
+        matched = IDENTIFIER_PATTERN.match(self.expression, self.position)
+        if not matched:
+            found = self.peek() or 'end of expression'
+            raise self.error(f'expected identifier but found "{found}"')
+        self.position = matched.end()
+        return matched.group()
+
+    def parse_primary(self):
+        char = self.peek()
+        if not char:
+            raise self.error('unexpected end of expression')
+
+        if char in '"[{-' or char.isdigit():
+            try:
+                value, self.position = json_decoder.raw_decode(self.expression, self.position)
+            except json.JSONDecodeError as e:
+                raise self.error(f'invalid literal, {e.msg}', e.pos)
+            return Literal(value)
+
+        name = self.parse_identifier()
+        if self.peek() == '(':
+            self.position += 1
+            return Call(name, tuple(self.parse_arguments()))
+        if name in LITERAL_IDENTIFIERS:
+            return Literal(LITERAL_IDENTIFIERS[name])
+        return Name(name)
+
+    def parse_arguments(self):
+        arguments = []
+        while self.peek() != ')':
+            arguments.append(self.parse_expression())
+            if self.peek() != ',':
+                break
+            self.position += 1
+        self.expect(')')
+        return arguments
+
+
+# 解析后的语法树的缓存，键为 (表达式的类，表达式)
+expression_ast_cache = LRUCache(1024)
+
+
+def parse_expression(expression_class, expression):
+    """解析表达式，相同的表达式只解析一次"""
+    key = (expression_class, expression)
+    node = expression_ast_cache.get(key)
+    if node is None:
+        node = ExpressionParser(expression).parse()
+        expression_ast_cache.set(key, node)
+    return node
+
+
 class BaseExpression:
     function_set = FUNCS
 
-    @staticmethod
-    def split_expression(expression, sep=','):
-        expression = expression.strip()
-        quote = False
-        surround = 0
-        buffer = ''
-        escape = False
-        for char in expression:
-            if escape and quote:
-                escape = False
-            else:
-                if char == sep:
-                    if surround == 0 and not quote:
-                        yield buffer
-                        buffer = ''
-                        continue
-                elif char == '\\':
-                    if quote:
-                        escape = True
-                elif char == '"':
-                    quote = not quote
-                elif char in '([{' and not quote:
-                    surround += 1
-                elif char in ')]}' and not quote:
-                    surround -= 1
-            buffer += char
-        if buffer:
-            yield buffer
-
-    def execute_function(self, function_name, arguments):
-        args = tuple(self.resolve(buffer) for buffer in arguments)
-        log.debug(f'returning calling Fun: {function_name} with args: {args}')
-        return self.function_set[function_name](*args)
-
     def resolve(self, expression):
-        expression = expression.strip()
+        node = parse_expression(type(self), expression)
+        return self.evaluate(node, self.function_set)
 
-        try:
-            return json.loads(expression)
-        except json.JSONDecodeError:
-            pass
-        log.debug(f'resolving expression: {expression}')
-        matched = re.match(r'^(\w+)\((.*)\)$', expression, flags=re.DOTALL)
-        if matched:
-            func, arg_str = matched.groups()
-            return self.execute_function(func, self.split_expression(arg_str))
-        log.warning(f'error when resolving expression: {expression}', exc_info=True)
-        raise NotImplementedError()
+    def evaluate(self, node, function_set):
+        """对语法树求值，变量从 __variable_root__ 中获取"""
+        node_type = type(node)
+        if node_type is Literal:
+            value = node.value
+            # json 的列表和字典每次都返回新的对象，和原来每次重新解析的结果一致
+            return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+        if node_type is Call:
+            args = tuple(self.evaluate(item, function_set) for item in node.arguments)
+            log.debug(f'returning calling Fun: {node.function} with args: {args}')
+            return function_set[node.function](*args)
+
+        # 变量和属性需要 __variable_root__
+        if '__variable_root__' not in function_set:
+            log.warning(f'error when resolving expression: {node}')
+            raise NotImplementedError()
+
+        if node_type is Name:
+            return function_set['__getattr__'](function_set['__variable_root__'](), node.name)
+        return function_set['__getattr__'](self.evaluate(node.value, function_set), node.name)
 
 
 class Expression(BaseExpression):
@@ -120,15 +219,6 @@ class Expression(BaseExpression):
             '__variable_root__': lambda: self.variable_root,
         }
 
-    def resolve(self, expression):
-        try:
-            return super().resolve(expression)
-        except NotImplementedError:
-            if '.' in expression:
-                # 点操作符，getattr的语法糖
-                return self.resolve(reduce(lambda exp, seg: f'__getattr__({exp}, "{seg}")', expression.split('.')))
-            return self.resolve('__getattr__(__variable_root__(), "{}")'.format(expression))
-
 
 def aggregation_align(aggregation):
     return lambda expression, q=None: aggregation(expression, filter=q)
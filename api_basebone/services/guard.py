@@ -0,0 +1,66 @@
+"""
+guardian 对象权限的数据筛选
+
+原来把用户以及用户所属的用户组有权限的 object_pk 全部查询出来，再使用 id__in 筛选，
+数据多的时候一次请求会有成千上万个绑定参数，超出数据库参数数量的限制。
+
+这里把 UserObjectPermission 和 GroupObjectPermission 作为子查询，object_pk 转换为
+主键的类型后和主键比较，由数据库完成筛选。
+"""
+from django.db.models import Exists, Q
+from django.db.models.functions import Cast
+
+
+def get_view_permission_filter(model):
+    """模型的 view_{model_name} 权限的筛选条件
+
+    按照权限的 codename 和内容类型关联筛选，不缓存权限的主键，
+    权限删除后重新创建时主键会变化，缓存的旧主键筛选不到任何对象权限，会导致不做筛选
+    """
+    from guardian.ctypes import get_content_type
+
+    return {'codename': f'view_{model._meta.model_name}', 'content_type': get_content_type(model)}
+
+
+def get_pk_field(model):
+    """获取主键最终指向的字段，例如多表继承时子模型的主键为指向父模型的一对一字段"""
+    field = model._meta.pk
+    while field.is_relation:
+        field = field.target_field
+    return field
+
+
+def get_object_pk_subquery(queryset, model):
+    """把对象权限的 object_pk 转换为模型主键的类型，作为子查询"""
+    return queryset.annotate(
+        guard_object_pk=Cast('object_pk', output_field=get_pk_field(model))
+    ).values('guard_object_pk')
+
+
+def guard_queryset(queryset, user, model=None):
+    """按照用户以及用户所属的用户组的 view 对象权限筛选结果集
+
+    和原来的逻辑保持一致，用户没有任何的对象权限时不做筛选
+    """
+    from django.contrib.auth.models import Permission
+    from guardian.models import UserObjectPermission, GroupObjectPermission
+
+    model = model or queryset.model
+    permission_filter = get_view_permission_filter(model)
+    related_filter = {f'permission__{key}': value for key, value in permission_filter.items()}
+
+    user_permissions = UserObjectPermission.objects.filter(user=user, **related_filter)
+    group_permissions = GroupObjectPermission.objects.filter(group__in=user.groups.all(), **related_filter)
+    # 权限以及用户、用户组的对象权限是否存在，在同一次查询中检测，权限不存在时同样不做筛选
+    granted = (
+        Permission.objects.filter(**permission_filter)
+        .annotate(user_granted=Exists(user_permissions), group_granted=Exists(group_permissions))
+        .filter(Q(user_granted=True) | Q(group_granted=True))
+    )
+    if not granted.exists():
+        return queryset
+
+    return queryset.filter(
+        Q(pk__in=get_object_pk_subquery(user_permissions, model))
+        | Q(pk__in=get_object_pk_subquery(group_permissions, model))
+    )
@@ -0,0 +1,158 @@
+"""
+请求的 SQL 统计和查询预算
+
+QUERY_PROFILE 开启后，通用接口的每个请求记录执行的 SQL：
+
+- 查询的数量和总耗时，通过响应头 Server-Timing 输出，浏览器的开发者工具中可以直接查看
+- 重复的查询：去掉参数后语句相同的查询执行了 QUERY_PROFILE_DUPLICATES 次及以上，通常是 N+1 查询
+- 最慢的 QUERY_PROFILE_SLOWEST 条语句
+
+管理员（is_staff）用户的响应中，统计的摘要追加到 logs 中。
+
+QUERY_BUDGETS 声明接口的查询预算，格式为 {app_label}__{model_name}: {action: 查询数量}，
+action 为 '*' 时对所有操作生效。超出预算时记录警告日志，QUERY_BUDGET_RAISE 开启时抛出 QueryBudgetExceeded，
+测试中开启后，展开字段等改动导致的查询数量增长会直接使测试失败。
+
+只统计当前线程的数据库连接，分块 prefetch 的工作线程中的查询不在统计范围内。
+流式输出的查询在视图返回之后才执行，开启统计或者查询预算时，不分页的列表不使用流式输出。
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+from rest_framework.response import Response
+
+from api_basebone.settings import settings
+
+log = logging.getLogger(__name__)
+
+LOG_PREFIX = '【Server-sql】'
+
+IN_PARAMS_PATTERN = re.compile(r'\bIN \((?:%s, )*%s\)', re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r'\b\d+\b')
+SPACE_PATTERN = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """接口的查询数量超出了 QUERY_BUDGETS 中声明的预算"""
+
+
+def get_fingerprint(sql):
+    """去掉参数的语句，IN 列表的长度、LIMIT 等数字不同的语句视为相同"""
+    sql = IN_PARAMS_PATTERN.sub('IN (...)', sql)
+    sql = NUMBER_PATTERN.sub('?', sql)
+    return SPACE_PATTERN.sub(' ', sql).strip()
+
+
+class QueryProfile:
+    """记录执行的语句，格式为 [(数据库别名, 语句, 耗时)]，耗时的单位为秒"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((context['connection'].alias, sql, time.perf_counter() - start))
+
+    def capture(self):
+        """在所有数据库连接上记录执行的语句"""
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, _, duration in self.queries)
+
+    def get_duplicates(self, threshold=None):
+        """重复的语句，格式为 [(语句, 次数)]，按次数倒序"""
+        threshold = threshold or settings.QUERY_PROFILE_DUPLICATES
+        counter = Counter(get_fingerprint(sql) for _, sql, _ in self.queries)
+        return [(sql, times) for sql, times in counter.most_common() if times >= threshold]
+
+    def get_slowest(self, size=None):
+        size = settings.QUERY_PROFILE_SLOWEST if size is None else size
+        return sorted(self.queries, key=lambda item: item[2], reverse=True)[:size]
+
+    def summary(self):
+        """统计的摘要，格式和 LogCollector 收集的日志一致，为 [(日志级别, 消息)]"""
+        messages = [(logging.INFO, f'{LOG_PREFIX}queries: {self.count}, time: {self.duration * 1000:.1f}ms')]
+        for sql, times in self.get_duplicates():
+            messages.append((logging.WARN, f'{LOG_PREFIX}duplicate x{times}: {sql}'))
+        for alias, sql, duration in self.get_slowest():
+            messages.append((logging.INFO, f'{LOG_PREFIX}slow {duration * 1000:.1f}ms [{alias}]: {sql}'))
+        return messages
+
+
+def check_enabled():
+    return bool(settings.QUERY_PROFILE or settings.QUERY_BUDGETS)
+
+
+def get_budget(view):
+    """接口声明的查询预算，没有声明时返回 None"""
+    kwargs = getattr(view, 'kwargs', None) or {}
+    budgets = (settings.QUERY_BUDGETS or {}).get(f'{kwargs.get("app")}__{kwargs.get("model")}')
+    if not budgets:
+        return None
+    return budgets.get(getattr(view, 'action', None), budgets.get('*'))
+
+
+def check_staff(view):
+    try:
+        user = view.request.user
+    except Exception:
+        # 认证失败时，再次获取用户会重新认证并抛出异常
+        return False
+    return bool(getattr(user, 'is_staff', False))
+
+
+def add_server_timing(response, profile):
+    value = f'db;dur={profile.duration * 1000:.1f};desc="{profile.count} queries"'
+    origin = response.get('Server-Timing')
+    response['Server-Timing'] = f'{origin}, {value}' if origin else value
+
+
+def check_budget(view, profile):
+    budget = get_budget(view)
+    if budget is None or profile.count <= budget:
+        return
+    kwargs = view.kwargs
+    message = (
+        f'{kwargs.get("app")}__{kwargs.get("model")} {getattr(view, "action", None)}: '
+        f'{profile.count} queries exceed the budget {budget}'
+    )
+    duplicates = profile.get_duplicates()
+    if duplicates:
+        message += ', duplicates: ' + '; '.join(f'x{times} {sql}' for sql, times in duplicates)
+    if settings.QUERY_BUDGET_RAISE:
+        raise QueryBudgetExceeded(message)
+    log.warning(message)
+
+
+def profile_response(view, func):
+    """统计 func 中执行的 SQL，func 为视图实际的处理函数，返回响应对象"""
+    if not check_enabled():
+        return func()
+
+    profile = QueryProfile()
+    with profile.capture():
+        response = func()
+
+    if settings.QUERY_PROFILE:
+        add_server_timing(response, profile)
+        data = getattr(response, 'data', None)
+        if isinstance(response, Response) and isinstance(data, dict) and check_staff(view):
+            data['logs'] = list(data.get('logs') or []) + profile.summary()
+    check_budget(view, profile)
+    return response
@@ -3,8 +3,10 @@ import logging
 from django.contrib.auth import get_user_model
 
 from api_basebone.utils.operators import build_filter_conditions2
+from api_basebone.utils.semijoin import semi_join_filter
+from api_basebone.services.guard import guard_queryset
 from api_basebone.settings import settings
-from api_basebone.utils.meta import get_bsm_model_admin, get_all_relation_fields
+from api_basebone.utils.meta import get_bsm_model_admin
 from api_basebone.utils import meta, module as basebone_module
 from api_basebone.utils import queryset as queryset_utils
 from api_basebone.core import admin
@@ -20,7 +22,7 @@ class Query:
             cls = model.GMeta.query_class
         return super().__new__(cls)
 
-    def __init__(self, request, model, action='list', filters=[], fields=[], expand_fields=[], order=[], tree_data=None, skip_distinct=False, view=None):
+    def __init__(self, request, model, action='list', filters=[], fields=[], expand_fields=[], order=[], tree_data=None, skip_distinct=False, view=None, expand_limits=None):
         """通用数据查询类。
         - user，当前查询用户
         - model，查询的模型
@@ -28,6 +30,7 @@ class Query:
         - fields，需要返回的字段
         - expand_fields，需要关联查询的其他字段
         - order, 排序
+        - expand_limits，对多关系的展开字段的数量限制，参考 queryset_utils.parse_expand_fields
         """
         self.request = request
         self.model = model
@@ -35,6 +38,7 @@ class Query:
         self.filters = filters
         self.fields = fields
         self.expand_fields = expand_fields
+        self.expand_limits = expand_limits or {}
         self.order = order
         self.tree_data = tree_data
         self.skip_distinct = skip_distinct
@@ -83,6 +87,7 @@ class Query:
         for idx, item in enumerate(self.expand_fields):
             # 这里一定要在 expand_fields 原对象上修改，因为 expand_fields 传了进来修改完成后，外面后续的程序还要依赖于修改后的格式
             self.expand_fields[idx] = self.expand_field_mapper(item)
+        self.expand_limits = {self.expand_field_mapper(k): v for k, v in self.expand_limits.items()}
 
     def _guard(self, queryset):
         # 如果不是超级用户，则进行对应的数据筛选
@@ -99,36 +104,7 @@ class Query:
         check_action = action in ['retrieve', 'list', 'set']
 
         if check_not_is_superuser and check_action and check_model:
-            from guardian.ctypes import get_content_type
-            from guardian.models import UserObjectPermission, GroupObjectPermission
-            from django.contrib.auth.models import Permission
-
-            content_type = get_content_type(model)
-            permission = Permission.objects.filter(
-                codename=f'view_{model._meta.model_name}', content_type=content_type
-            ).first()
-
-            content_object_set = set()
-
-            # 如果存在对应的权限
-            if permission:
-                permission_object_list = UserObjectPermission.objects.filter(
-                    user=user, permission=permission
-                ).values('object_pk')
-                for item in permission_object_list:
-                    content_object_set.add(item['object_pk'])
-
-            user_groups = user.groups.all()
-            if user_groups:
-                group_object_list = GroupObjectPermission.objects.filter(
-                    permission=permission, group__in=user_groups
-                ).values('object_pk')
-                for item in group_object_list:
-                    content_object_set.add(item['object_pk'])
-
-            if content_object_set:
-                queryset = queryset.filter(id__in=content_object_set)
-            return queryset
+            return guard_queryset(queryset, user, model)
         return queryset
 
     def get_queryset_by_filter_user(self, role_config, queryset):
@@ -178,54 +154,6 @@ class Query:
             return queryset.order_by(*fields)
         return queryset
 
-    def should_distinct_queryset(self, fields):
-        """检测是否需要
-
-        检测是否需要对结果集去重，去重需要单独做好检测
-        因为去重在统计业务中，如果去重，对于关联的查询，会做子查询，导致
-        结果不符合预期
-
-        这里对于关系字段都需要做去重操作
-
-        - 一对多
-        - 多对一
-        - 多对多
-        """
-        model = self.model
-        action = self.action
-        # 如果动作是创建或者跟单条数据相关的，不在进行去重操作
-        if action in [
-            'create',
-            'retrieve',
-            'destroy',
-            'custom_patch',
-            'update',
-            'partial_update',
-        ]:
-            return False
-
-        if not fields:
-            return False
-
-        # 获取非一对一的关系字段
-        relation_fields = [
-            item.name
-            for item in get_all_relation_fields(model)
-            if not item.one_to_one
-        ]
-
-        if not isinstance(fields, list):
-            fields = [fields]
-
-        separator = '__'
-
-        for item in fields:
-            if not isinstance(item, str):
-                continue
-            field = item.split(separator)[0]
-            if field in relation_fields:
-                return True
-
     def get_queryset_by_filter_conditions(self, role_config, queryset):
         """
         用于检测客户端传入的过滤条件
@@ -270,27 +198,17 @@ class Query:
         if role_filters:
             filter_conditions += role_filters
 
-        # 这里做个动作 1 校验过滤条件中的字段，是否需要对结果集去重 2 组装过滤条件
+        # 组装过滤条件，涉及对多关系的条件改写为子查询，不需要再对结果集去重
         if filter_conditions:
-            # TODO: 这里没有做任何的检测，需要加上检测
-            fields = set()
-
-            def tree_check(cond):
-                for c in cond:
-                    if 'children' in c:
-                        tree_check(c['children'])
-                    else:
-                        fields.add(c['field'])
-
-            tree_check(filter_conditions)
-            distinct_queryset = self.should_distinct_queryset(list(fields))
             cons = build_filter_conditions2(
                 filter_conditions, context={'user': user}
             )
-
-            if cons:
-                queryset = queryset.filter(cons)
-            return queryset, distinct_queryset
+            if not cons:
+                return queryset, False
+            # 统计和图表的场景不需要去重，保持原来的连接查询
+            if self.skip_distinct:
+                return queryset.filter(cons), False
+            return semi_join_filter(queryset, cons)
         return queryset, False
 
     def get_queryset_by_with_tree(self, queryset):
@@ -301,6 +219,27 @@ class Query:
             return queryset.filter(**params)
         return queryset
 
+    def get_display_fields(self):
+        """用于选择查询列的显示字段
+
+        只有读取的操作做列选择，树形结构的子节点和根节点的显示字段不同，所以也不做列选择
+        """
+        if self.tree_data or self.action not in ('list', 'set', 'retrieve'):
+            return
+        return self.fields or None
+
+    def get_annotated_fields(self, role_config):
+        """需要 annotate 的字段，即显示、过滤、排序中用到的字段，返回 None 时添加所有的字段"""
+        if not settings.ANNOTATE_ON_DEMAND:
+            return
+        filters = list(self.filters or [])
+        filters += get_config(self.model, 'defaultFilter', 'list', self.view) or []
+        if self.request:
+            filters += self.get_user_role_filters(role_config) or []
+        return queryset_utils.get_annotated_field_names(
+            self.model, self.get_display_fields(), filters, self.order
+        )
+
     def get_annotation_context(self):
         request = self.request
         return {'user': request.user} if request else {}
@@ -315,15 +254,25 @@ class Query:
 
         admin_class = get_bsm_model_admin(model)
 
-        # 2. 添加expand_field
+        # 2. 添加expand_field，并根据显示字段选择查询的列
+        display_fields = self.get_display_fields()
         if self.expand_fields:
             self.translate_expand_fields()
             expand_dict = sort_expand_fields(self.expand_fields)
-            queryset = queryset_utils.queryset_prefetch(queryset, expand_dict, context, display_fields=self.fields)
+            queryset = queryset_utils.queryset_prefetch(
+                queryset, expand_dict, context, display_fields=display_fields, limits=self.expand_limits
+            )
+        elif display_fields:
+            queryset = queryset_utils.queryset_only(queryset, display_fields)
+
+        role_config = self.basebone_get_model_role_config()
+        log.debug(f'role_config: {role_config}')
 
         # 3. 添加计算字段的annotate
         if self.action not in ['get_chart', 'group_statistics']:
-            queryset = queryset_utils.annotate(queryset, context=context)
+            queryset = queryset_utils.annotate(
+                queryset, fields=self.get_annotated_fields(role_config), context=context
+            )
 
         # 4. 如果GMeta重定义了get_queryset
         if hasattr(model, 'GMeta') and request:
@@ -337,9 +286,6 @@ class Query:
                     if gmeta_get_queryset is not None:
                         queryset = gmeta_get_queryset(queryset, request, None)
 
-        role_config = self.basebone_get_model_role_config()
-        log.debug(f'role_config: {role_config}')
-
         # 5. 根据当前用户过滤
         if request:
             queryset = self.get_queryset_by_filter_user(role_config, queryset)
@@ -2,6 +2,8 @@ import requests
 import logging
 from copy import copy
 
+import lightning_flags as flags
+
 from django.db import transaction
 from django.db.models.query import QuerySet
 from django.apps import apps
@@ -13,14 +15,24 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 
 from api_basebone.permissions import BasePermission
-from api_basebone.core import exceptions
+from api_basebone.core import const, exceptions
 from api_basebone.settings import settings
 from api_basebone.signals import post_bsm_create, post_bsm_delete, before_bsm_create, before_bsm_delete
 from api_basebone.restful.funcs import find_func, get_funcs
+from api_basebone.restful.display import filter_sub_display_fields, get_display_fields_set
+from api_basebone.restful.projection import compile_projection
 from api_basebone.restful.relations import forward_relation_hand, reverse_relation_hand
-from api_basebone.drf.response import success_response, get_or_create_logger
+from api_basebone.drf.pagination import TRUE_VALUES
+from api_basebone.drf.response import (
+    success_response, streaming_success_response, get_or_create_logger
+)
 from api_basebone.sandbox.logger import LogCollector
+from api_basebone.utils.prefetch import iterate_chunks
+from api_basebone.utils.tree import prefetch_tree
 from api_basebone.restful.client import user_pip as client_user_pip
+from api_basebone.services import query_profile
+from api_basebone.services.count import clean_count_cache
+from api_basebone.services.result_cache import clean_result_cache
 
 log = logging.getLogger(__name__)
 
@@ -31,14 +43,7 @@ def filter_display_fields(data, display_fields):
         """没有限制的情况下，显示所有"""
         return data
 
-    display_fields_set = set()
-    for field_str in display_fields:
-        if field_str.startswith('-'):
-            display_fields_set.add(field_str)
-        else:
-            items = field_str.split('.')
-            for i in range(len(items)):
-                display_fields_set.add('.'.join(items[: i + 1]))
+    display_fields_set = get_display_fields_set(display_fields)
     if isinstance(data, list):
         results = []
         for record in data:
@@ -49,57 +54,56 @@ def filter_display_fields(data, display_fields):
         return filter_sub_display_fields(display_fields_set, data)
 
 
-def filter_sub_display_fields(display_fields_set, record, prefix=''):
-    display_record = {}
+def serialize_display_data(genericAPIView, data, display_fields):
+    """序列化列表数据，并只保留显示的列
+
+    开启了 ROW_PROJECTOR 时，使用编译好的投影计划直接输出数据，不能编译时回退到 DRF 序列化
+    """
+    serializer = genericAPIView.get_serializer(data, many=True)
+    if flags.ROW_PROJECTOR and hasattr(serializer, 'child'):
+        projection = compile_projection(
+            serializer.child, get_display_fields_set(display_fields)
+        )
+        if projection is not None:
+            return projection.represent_many(data)
+    return filter_display_fields(serializer.data, display_fields)
+
+
+def prefetch_tree_data(genericAPIView, queryset, data):
+    """树形结构的数据，一次性查询并组装所有的子孙节点"""
+    tree_data = getattr(genericAPIView, 'tree_data', None)
+    if not tree_data:
+        return data
+    return prefetch_tree(
+        data,
+        tree_data,
+        max_depth=getattr(genericAPIView, 'tree_max_depth', None),
+        lookups=getattr(queryset, '_prefetch_related_lookups', None),
+    )
 
-    # 星号为通配符，该层所有属性都匹配
-    if prefix:
-        star_key = prefix + '.*'
-    else:
-        star_key = '*'
-
-    for k, v in record.items():
-        if prefix:
-            full_key = prefix + '.' + k
-        else:
-            full_key = k
-        exclude_key = '-' + full_key
-
-        # 负号优先级高于星号
-        if exclude_key in display_fields_set:
-            """负号表示该属性不显示"""
-            continue
-
-        if isinstance(v, list):
-            if (star_key not in display_fields_set) and (
-                full_key not in display_fields_set
-            ):
-                """星号为通配符"""
-                continue
-
-            display_record[k] = []
-            for d in v:
-                if isinstance(d, dict):
-                    sub_record = filter_sub_display_fields(
-                        display_fields_set, d, full_key
-                    )
-                    display_record[k].append(sub_record)
-                else:
-                    display_record[k].append(d)
-        elif isinstance(v, dict):
-            if (star_key not in display_fields_set) and (
-                full_key not in display_fields_set
-            ):
-                """星号为通配符"""
-                continue
-            display_record[k] = filter_sub_display_fields(display_fields_set, v, full_key)
-        # 星号优先级高于具体的列名
-        elif star_key in display_fields_set:
-            """星号为通配符"""
-            display_record[k] = v
-        elif full_key in display_fields_set:
-            display_record[k] = v
-    return display_record
+
+def check_stream_display(genericAPIView, queryset):
+    """检测不分页的列表是否使用流式输出，请求中 stream 为真时开启，树形结构的数据不支持
+
+    流式输出的查询在视图返回之后才执行，开启了 SQL 统计或者查询预算时不使用流式输出，
+    否则 Server-Timing 和查询预算统计不到这些查询
+    """
+    request = genericAPIView.request
+    if request.query_params.get(const.STREAM) not in TRUE_VALUES:
+        return False
+    if query_profile.check_enabled():
+        return False
+    return isinstance(queryset, QuerySet) and not getattr(genericAPIView, 'tree_data', None)
+
+
+def iter_display_chunks(genericAPIView, queryset, display_fields):
+    """分块查询并序列化列表数据
+
+    每一块使用 iterator 读取 STREAM_CHUNK_SIZE 条数据，iterator 会忽略 prefetch_related，
+    这里对每一块单独执行 prefetch，查询次数为块数乘以 prefetch 字段数
+    """
+    for chunk in iterate_chunks(queryset, settings.STREAM_CHUNK_SIZE):
+        yield serialize_display_data(genericAPIView, chunk, display_fields)
 
 
 def display(genericAPIView, display_fields):
@@ -109,13 +113,18 @@ def display(genericAPIView, display_fields):
     page = genericAPIView.paginate_queryset(queryset)
     if page is not None:
         """分页查询"""
-        serializer = genericAPIView.get_serializer(page, many=True)
-        result = filter_display_fields(serializer.data, display_fields)
+        page = prefetch_tree_data(genericAPIView, queryset, page)
+        result = serialize_display_data(genericAPIView, page, display_fields)
         response = genericAPIView.get_paginated_response(result)
         result = response.data
+    elif check_stream_display(genericAPIView, queryset):
+        """不分页的大列表，分块查询、序列化并逐步输出"""
+        return streaming_success_response(
+            iter_display_chunks(genericAPIView, queryset, display_fields)
+        )
     else:
-        serializer = genericAPIView.get_serializer(queryset, many=True)
-        result = filter_display_fields(serializer.data, display_fields)
+        data = prefetch_tree_data(genericAPIView, queryset, queryset)
+        result = serialize_display_data(genericAPIView, data, display_fields)
     return success_response(result)
 
 
@@ -291,7 +300,7 @@ def manage_create(genericAPIView, request, set_data):
     with transaction.atomic():
         forward_relation_hand(genericAPIView.model, set_data)
         serializer = genericAPIView.get_validate_form(genericAPIView.action)(
-            data=set_data, context=genericAPIView.get_serializer_context(),
+            data=set_data, context=dict(genericAPIView.get_serializer_context(), scope='admin'),
             many=many
         )
         serializer.is_valid(raise_exception=True)
@@ -481,6 +490,8 @@ def delete_by_conditon(genericAPIView):
     """按查询条件删除"""
     queryset = genericAPIView.filter_queryset(genericAPIView.get_queryset())
     deleted, rows_count = queryset.delete()
+    clean_count_cache(queryset.model)
+    clean_result_cache(queryset.model)
     result = {'deleted': deleted}
 
     return success_response(result)
@@ -489,6 +500,8 @@ def delete_by_conditon(genericAPIView):
 def update_by_conditon(genericAPIView, set_fields):
     queryset = genericAPIView.filter_queryset(genericAPIView.get_queryset())
     count = queryset.update(**set_fields)
+    clean_count_cache(queryset.model)
+    clean_result_cache(queryset.model)
     result = {'count': count}
     return success_response(result)
 
@@ -0,0 +1,276 @@
+"""
+列表和详情的结果缓存
+
+管理后台的看板会反复发出相同的列表、详情请求，对 RESULT_CACHE_MODELS 中声明的模型，
+list、set、retrieve 的结果按照请求的指纹缓存 RESULT_CACHE_TIMEOUT 秒：
+
+- 请求的指纹由接口路径、查询参数、请求体（过滤条件、排序、显示字段、展开字段、分页等）组成
+- 用户范围：超级用户共用缓存，其他用户按照用户以及角色配置（例如 shield 的规则）区分
+- 模型的版本号：结果涉及的模型（本身、展开、显示、过滤、排序中的关联模型以及声明的依赖模型）的数据变动时版本号递增，
+  版本号是缓存键的一部分，旧的缓存不再命中
+
+数据变动包括：
+
+- 开启了缓存的模型以及声明的依赖模型的 post_save、post_delete 信号，以及它们的多对多关系的 m2m_changed 信号，
+  只对这些模型连接信号，其他模型的删除仍然可以使用 fast delete
+- 所有模型的 post_bsm_create、post_bsm_bulk_create、post_bsm_bulk_update、post_bsm_delete 信号
+- bsm 的批量动作、按条件删除和更新，它们直接操作查询集，不会发送信号
+
+其他途径修改的没有声明为依赖的关联模型，以及直接执行的 QuerySet.update，缓存在 RESULT_CACHE_TIMEOUT 秒后过期。
+
+RESULT_CACHE_MODELS 为列表时，元素格式为 {app_label}__{model_name}；为字典时，值为额外依赖的模型列表，
+例如 annotate 字段、计算属性中查询的其他模型。开启了 guardian 数据权限检测的模型不做缓存。
+"""
+import hashlib
+import json
+import logging
+
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from api_basebone.core import const
+from api_basebone.drf.response import success_response
+from api_basebone.restful.serializers import get_field
+from api_basebone.settings import settings
+from api_basebone.signals import post_bsm_bulk_create, post_bsm_bulk_update, post_bsm_create, post_bsm_delete
+from api_basebone.utils.queryset import iter_filter_fields
+
+log = logging.getLogger(__name__)
+
+RESULT_CACHE_KEY = 'bsm_result:{label}:{fingerprint}'
+RESULT_VERSION_CACHE_KEY = 'bsm_result_version:{label}'
+RESULT_STATS_CACHE_KEY = 'bsm_result_stats:{label}:{name}'
+
+CACHE_ACTIONS = ('list', 'set', 'retrieve')
+
+
+def get_cache():
+    return caches[settings.RESULT_CACHE_ALIAS]
+
+
+def get_model_label(model):
+    return model._meta.concrete_model._meta.label_lower
+
+
+def get_model_key(model):
+    return f'{model._meta.app_label}__{model._meta.model_name}'
+
+
+def check_cache_model(model):
+    """检测模型是否开启了结果缓存"""
+    key = get_model_key(model)
+    if key not in (settings.RESULT_CACHE_MODELS or []):
+        return False
+    # 数据权限依赖 guardian 的对象权限，对象权限的变更无法反映到版本号中
+    if settings.MANAGE_GUARDIAN_DATA_PERMISSION_CHECK and key in settings.MANAGE_GUARDIAN_DATA_APP_MODELS:
+        return False
+    return True
+
+
+def clean_result_cache(*models):
+    """模型的数据变动后，递增模型的版本号，涉及此模型的缓存不再命中"""
+    if not settings.RESULT_CACHE_MODELS:
+        return
+    cache = get_cache()
+    for label in {get_model_label(model) for model in models if model is not None}:
+        key = RESULT_VERSION_CACHE_KEY.format(label=label)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_path_models(model, path):
+    """获取字段路径经过的关联模型"""
+    models = []
+    for name in path.lstrip('-').split('.'):
+        field = get_field(model, name)
+        if field is None:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                break
+        if not field.is_relation or field.related_model is None:
+            break
+        model = field.related_model
+        models.append(model)
+    return models
+
+
+def get_dependent_models(view):
+    """请求的结果涉及的模型"""
+    model = view.model
+    data = view.request.data if isinstance(view.request.data, dict) else {}
+    paths = list(getattr(view, 'expand_fields', None) or [])
+    for name in (const.DISPLAY_FIELDS, const.ORDER_BY_FIELDS):
+        value = data.get(name)
+        if isinstance(value, list):
+            paths += [item for item in value if isinstance(item, str)]
+    paths += iter_filter_fields(data.get(const.FILTER_CONDITIONS))
+
+    models = {model}
+    for path in paths:
+        models.update(get_path_models(model, path))
+
+    models.update(get_declared_models(model))
+    return models
+
+
+def get_declared_models(model):
+    """RESULT_CACHE_MODELS 中声明的模型额外依赖的模型"""
+    config = settings.RESULT_CACHE_MODELS
+    if not isinstance(config, dict):
+        return []
+    return [apps.get_model(*item.split('__')) for item in config.get(get_model_key(model)) or []]
+
+
+def get_user_scope(view):
+    """用户范围，超级用户的数据范围相同，共用缓存"""
+    user = view.request.user
+    if user.is_superuser:
+        return 'superuser'
+    role_config = None
+    get_role_config = getattr(view, 'basebone_get_model_role_config', None)
+    if get_role_config is not None:
+        role_config = get_role_config()
+    return [user.pk, role_config]
+
+
+def get_cache_key(view):
+    """请求的缓存键，由请求、用户范围以及涉及的模型的版本号组成"""
+    request = view.request
+    labels = sorted({get_model_label(model) for model in get_dependent_models(view)})
+    version_keys = [RESULT_VERSION_CACHE_KEY.format(label=label) for label in labels]
+    versions = get_cache().get_many(version_keys)
+    content = json.dumps(
+        [
+            view.action,
+            getattr(view, 'end_slug', None),
+            request.path,
+            sorted(request.query_params.lists()),
+            request.data,
+            get_user_scope(view),
+            [versions.get(key, 0) for key in version_keys],
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return RESULT_CACHE_KEY.format(
+        label=get_model_label(view.model), fingerprint=hashlib.md5(content.encode()).hexdigest()
+    )
+
+
+def incr_stats(label, name):
+    cache = get_cache()
+    key = RESULT_STATS_CACHE_KEY.format(label=label, name=name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_result_cache_stats():
+    """开启了结果缓存的模型的命中次数、未命中次数和命中率"""
+    cache = get_cache()
+    result = {}
+    for key in settings.RESULT_CACHE_MODELS or []:
+        label = get_model_label(apps.get_model(*key.split('__')))
+        stats_keys = {
+            name: RESULT_STATS_CACHE_KEY.format(label=label, name=name) for name in ('hit', 'miss')
+        }
+        values = cache.get_many(list(stats_keys.values()))
+        hit, miss = (values.get(stats_keys[name], 0) for name in ('hit', 'miss'))
+        result[label] = {'hit': hit, 'miss': miss, 'ratio': hit / (hit + miss) if hit + miss else 0}
+    return result
+
+
+def cached_response(view, func):
+    """结果缓存，func 为实际查询的函数，返回响应对象
+
+    只缓存成功的普通响应，流式输出等其他响应不做缓存
+    """
+    if view.action not in CACHE_ACTIONS or not check_cache_model(view.model):
+        return func()
+
+    try:
+        key = get_cache_key(view)
+    except Exception as e:
+        log.warning(f'result cache key error: {e}')
+        return func()
+
+    cache = get_cache()
+    label = get_model_label(view.model)
+    content = cache.get(key)
+    if content is not None:
+        incr_stats(label, 'hit')
+        return success_response(json.loads(content))
+
+    incr_stats(label, 'miss')
+    response = func()
+    if isinstance(response, Response) and response.status_code == 200 and 'result' in response.data:
+        # 序列化为 JSON 后缓存，和缓存的后端无关，也不会缓存序列化器等对象
+        cache.set(key, JSONRenderer().render(response.data['result']), settings.RESULT_CACHE_TIMEOUT)
+    return response
+
+
+@receiver(post_bsm_create, dispatch_uid='bsm_result_clean_by_bsm_create')
+@receiver(post_bsm_bulk_create, dispatch_uid='bsm_result_clean_by_bsm_bulk_create')
+@receiver(post_bsm_bulk_update, dispatch_uid='bsm_result_clean_by_bsm_bulk_update')
+@receiver(post_bsm_delete, dispatch_uid='bsm_result_clean_by_bsm_delete')
+def clean_result_cache_by_signal(sender, **kwargs):
+    clean_result_cache(sender)
+
+
+def clean_result_cache_by_m2m_changed(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        clean_result_cache(sender, type(instance), model)
+
+
+def get_signal_models():
+    """需要监听数据变动的模型，即开启了缓存的模型以及声明的依赖模型"""
+    models = set()
+    for key in settings.RESULT_CACHE_MODELS or []:
+        model = apps.get_model(*key.split('__'))
+        models.add(model)
+        models.update(get_declared_models(model))
+    return models
+
+
+def get_through_models(model):
+    """模型的正向以及反向的多对多关系的中间表"""
+    result = set()
+    for field in model._meta.get_fields(include_hidden=True):
+        if field.many_to_many:
+            result.add(field.remote_field.through if field.concrete else field.through)
+    return result
+
+
+def iter_signal_receivers():
+    """按照模型连接的信号，格式为 (信号, 接收函数, 发送者, dispatch_uid)"""
+    for model in get_signal_models():
+        label = get_model_label(model)
+        yield post_save, clean_result_cache_by_signal, model, f'bsm_result_clean_by_save:{label}'
+        yield post_delete, clean_result_cache_by_signal, model, f'bsm_result_clean_by_delete:{label}'
+        for through in get_through_models(model):
+            yield (
+                m2m_changed,
+                clean_result_cache_by_m2m_changed,
+                through,
+                f'bsm_result_clean_by_m2m_changed:{get_model_label(through)}',
+            )
+
+
+def connect_signals():
+    """只对 RESULT_CACHE_MODELS 相关的模型连接 post_save、post_delete、m2m_changed 信号，在 AppConfig.ready 中调用"""
+    for signal, func, sender, dispatch_uid in iter_signal_receivers():
+        signal.connect(func, sender=sender, dispatch_uid=dispatch_uid)
+
+
+def disconnect_signals():
+    for signal, func, sender, dispatch_uid in iter_signal_receivers():
+        signal.disconnect(func, sender=sender, dispatch_uid=dispatch_uid)
@@ -8,6 +8,58 @@ DEFAULTS = {
     'MANAGE_GUARDIAN_DATA_PERMISSION_CHECK': False,
     # 管理端使用 guardian 检测的应用模型，元素数据格式为 {app_name}__{model_name}
     'MANAGE_GUARDIAN_DATA_APP_MODELS': [],
+    # 动态生成的序列化类的缓存容量，设置为 0 则不缓存
+    'SERIALIZER_CLASS_CACHE_SIZE': 512,
+    # 编译后的显示字段的缓存容量，设置为 0 则不缓存
+    'DISPLAY_FIELDS_CACHE_SIZE': 1024,
+    # 编译后的过滤条件模板的缓存容量，设置为 0 则不缓存
+    'FILTER_TEMPLATE_CACHE_SIZE': 1024,
+    # 开启列表精确计数缓存的模型，元素格式为 {app_label}__{model_name}，
+    # 会对这些模型连接 post_save、post_delete 信号，删除时不再使用 fast delete，批量创建时逐条创建
+    'COUNT_CACHE_MODELS': [],
+    # 列表精确计数的缓存时间，单位为秒，设置为 0 则不缓存
+    'COUNT_CACHE_TIMEOUT': 30,
+    # 没有筛选条件的列表，近似计数达到此数量时直接使用近似计数，默认为 0，即总是使用精确计数
+    'COUNT_APPROXIMATE_THRESHOLD': 0,
+    # 不分页的列表流式输出时，每一块查询和序列化的数据条数
+    'STREAM_CHUNK_SIZE': 500,
+    # 列表只 annotate 显示、过滤、排序中用到的 annotate 字段，默认关闭，
+    # 开启前需要确认 admin 或者 GMeta 的 get_queryset 中没有用到 annotate 字段
+    'ANNOTATE_ON_DEMAND': False,
+    # prefetch 时每一块原数据的数量，避免 IN 列表超出数据库参数数量的限制
+    'PREFETCH_CHUNK_SIZE': 500,
+    # 分块 prefetch 并行的线程数，每个线程使用单独的数据库连接，设置为 1 则串行执行
+    'PREFETCH_WORKERS': 1,
+    # 开启列表和详情结果缓存的模型，元素格式为 {app_label}__{model_name}，
+    # 也可以是字典，值为额外依赖的模型列表，参考 services.result_cache
+    'RESULT_CACHE_MODELS': [],
+    # 结果缓存的时间，单位为秒
+    'RESULT_CACHE_TIMEOUT': 60,
+    # 结果缓存使用的缓存后端
+    'RESULT_CACHE_ALIAS': 'default',
+    # 只读副本的数据库别名，需要在 DATABASE_ROUTERS 中添加 api_basebone.db.router.ReplicaRouter
+    'DATABASE_REPLICAS': [],
+    # 用户写入数据后固定使用主库的时间，单位为秒
+    'REPLICA_STICKY_SECONDS': 5,
+    # 统计通用接口每个请求执行的 SQL，输出 Server-Timing 响应头，管理员的响应中在 logs 中追加摘要
+    'QUERY_PROFILE': False,
+    # 去掉参数后相同的语句执行达到此次数时视为重复查询
+    'QUERY_PROFILE_DUPLICATES': 3,
+    # 摘要中输出的最慢的语句的数量
+    'QUERY_PROFILE_SLOWEST': 3,
+    # 接口的查询预算，格式为 {app_label}__{model_name}: {action: 查询数量}，action 为 '*' 时对所有操作生效
+    'QUERY_BUDGETS': {},
+    # 超出查询预算时抛出异常，用于测试
+    'QUERY_BUDGET_RAISE': False,
+    # 批量创建时 bulk_create 每一批的数量，设置为 0 则逐条创建
+    'BULK_CREATE_BATCH_SIZE': 500,
+    # 批量创建时对每一条数据发送 post_bsm_create 信号的模型，元素格式为 {app_label}__{model_name}，
+    # 信号中的数据需要主键，数据库不支持插入时返回主键（MySQL、SQLite）时这些模型逐条创建
+    'BULK_CREATE_ROW_SIGNAL_MODELS': [],
+    # 批量更新时 bulk_update 每一批的数量，设置为 0 则逐条更新
+    'BULK_UPDATE_BATCH_SIZE': 500,
+    # 导入 Excel 时每一块查询关联数据、校验并保存的行数
+    'IMPORT_CHUNK_SIZE': 1000,
 }
 
 
@@ -2,5 +2,10 @@ from django.dispatch import Signal
 
 post_bsm_create = Signal(providing_args=['instance', 'create', 'request', 'old_instance'])
 before_bsm_create = Signal(providing_args=['instance', 'create', 'request'])
+# 批量创建时，每一批数据发送一次，instances 为校验后的数据或者创建的数据的列表
+post_bsm_bulk_create = Signal(providing_args=['instances', 'request', 'scope'])
+before_bsm_bulk_create = Signal(providing_args=['instances', 'request', 'scope'])
+# 批量更新后发送一次，instances 为更新的数据的列表
+post_bsm_bulk_update = Signal(providing_args=['instances', 'request', 'scope'])
 post_bsm_delete = Signal(providing_args=['instance', 'request'])
 before_bsm_delete = Signal(providing_args=['instance', 'request'])
@@ -0,0 +1,158 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api_basebone.models import AdminLog
+from api_basebone.restful.forms import BulkCreateListSerializer, create_form_class
+from api_basebone.settings import settings
+from api_basebone.signals import post_bsm_bulk_create, post_bsm_bulk_update, post_bsm_create
+
+
+class BulkCreateTest(TestCase):
+    """批量创建使用 bulk_create 分批插入"""
+
+    def setUp(self):
+        super().setUp()
+        settings._cached_attrs.add('BULK_CREATE_BATCH_SIZE')
+        settings.BULK_CREATE_BATCH_SIZE = 2
+        self.batches = []
+        post_bsm_bulk_create.connect(self.receive, sender=Permission)
+
+    def tearDown(self):
+        post_bsm_bulk_create.disconnect(self.receive, sender=Permission)
+        settings.BULK_CREATE_BATCH_SIZE = 500
+        super().tearDown()
+
+    def receive(self, sender, instances, **kwargs):
+        self.batches.append(len(instances))
+
+    def save(self, model, data):
+        serializer = create_form_class(model)(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_bulk_create(self):
+        content_type = ContentType.objects.get_for_model(Group)
+        data = [{'name': f'bulk {i}', 'codename': f'bulk_{i}', 'content_type': content_type.pk} for i in range(5)]
+        with CaptureQueriesContext(connection) as context:
+            self.save(Permission, data)
+        sqls = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(1, len([sql for sql in sqls if 'django_content_type' in sql]))
+        self.assertEqual(3, len([sql for sql in sqls if sql.startswith('INSERT')]))
+        self.assertEqual([2, 2, 1], self.batches)
+        self.assertEqual(5, Permission.objects.filter(codename__startswith='bulk_').count())
+
+    def test_row_signal(self):
+        settings._cached_attrs.add('BULK_CREATE_ROW_SIGNAL_MODELS')
+        settings.BULK_CREATE_ROW_SIGNAL_MODELS = ['auth__permission']
+        receiver = mock.Mock()
+        post_bsm_create.connect(receiver, sender=Permission)
+        content_type = ContentType.objects.get_for_model(Group)
+        data = [{'name': f'row {i}', 'codename': f'row_{i}', 'content_type': content_type.pk} for i in range(3)]
+        features = connection.features
+        try:
+            # 数据库不支持插入时返回主键时，逐条创建后发送信号，信号中的数据有主键
+            with mock.patch.object(features, 'can_return_ids_from_bulk_insert', False):
+                self.save(Permission, data)
+        finally:
+            post_bsm_create.disconnect(receiver, sender=Permission)
+            settings.BULK_CREATE_ROW_SIGNAL_MODELS = []
+        self.assertEqual([], self.batches)
+        self.assertEqual(3, receiver.call_count)
+        self.assertTrue(all(call[1]['instance'].pk for call in receiver.call_args_list))
+
+    def test_validate_related(self):
+        permissions = list(Permission.objects.all()[:2])
+        data = [{'name': f'related {i}', 'permissions': [p.pk for p in permissions]} for i in range(3)]
+        # Group 有针对此模型的 post_save 接收函数，逐条创建
+        groups = self.save(Group, data)
+        for group in groups:
+            self.assertEqual({p.pk for p in permissions}, set(group.permissions.values_list('pk', flat=True)))
+
+        serializer = create_form_class(Group)(data=[{'name': 'a', 'permissions': [0]}, {'name': 'b'}], many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('permissions', serializer.errors[0])
+
+    def test_many_to_many(self):
+        User = get_user_model()
+        manager = User._default_manager
+        origin_bulk_create = manager.bulk_create
+
+        def bulk_create(instances, **kwargs):
+            # SQLite 不支持插入时返回主键，插入后查询主键，模拟支持的数据库
+            result = origin_bulk_create(instances, **kwargs)
+            pks = dict(manager.filter(username__in=[item.username for item in instances]).values_list('username', 'pk'))
+            for instance in instances:
+                instance.pk = pks[instance.username]
+            return result
+
+        p1, p2 = Permission.objects.order_by('pk')[:2]
+        data = [
+            # 同一行中重复的关联数据只插入一次
+            {'username': 'bulk_m2m_0', 'password': 'x', 'user_permissions': [p1.pk, p1.pk, p2.pk]},
+            {'username': 'bulk_m2m_1', 'password': 'x', 'user_permissions': [p2.pk]},
+        ]
+        with mock.patch.object(BulkCreateListSerializer, 'check_bulk_create', return_value=True), mock.patch.object(
+            manager, 'bulk_create', side_effect=bulk_create
+        ) as patched:
+            users = self.save(User, data)
+        patched.assert_called_once()
+        self.assertEqual(
+            [{p1.pk, p2.pk}, {p2.pk}],
+            [set(user.user_permissions.values_list('pk', flat=True)) for user in users],
+        )
+
+
+class BulkUpdateTest(TestCase):
+    """批量更新按照修改的字段分组执行 bulk_update"""
+
+    def test_bulk_update(self):
+        user = get_user_model().objects.create(username='bulk update')
+        logs = [AdminLog.objects.create(user=user, action='add', message=f'log {i}') for i in range(4)]
+        data = [
+            {'id': logs[0].pk, 'message': 'changed 0'},
+            {'id': logs[1].pk, 'message': 'changed 1'},
+            {'id': logs[2].pk, 'action': 'update'},
+            {'id': logs[3].pk, 'message': 'log 3'},
+        ]
+        queryset = AdminLog.objects.filter(pk__in=[log.pk for log in logs])
+        serializer = create_form_class(AdminLog, 'update', batch=True)(queryset, data=data, partial=True, many=True)
+        serializer.is_valid(raise_exception=True)
+        create_receiver, update_receiver = mock.Mock(), mock.Mock()
+        post_bsm_bulk_create.connect(create_receiver, sender=AdminLog)
+        post_bsm_bulk_update.connect(update_receiver, sender=AdminLog)
+        try:
+            with CaptureQueriesContext(connection) as context:
+                serializer.save()
+        finally:
+            post_bsm_bulk_create.disconnect(create_receiver, sender=AdminLog)
+            post_bsm_bulk_update.disconnect(update_receiver, sender=AdminLog)
+        self.assertEqual(2, len([query for query in context.captured_queries if query['sql'].startswith('UPDATE')]))
+        # 更新只发送一次 post_bsm_bulk_update 信号
+        create_receiver.assert_not_called()
+        update_receiver.assert_called_once()
+        self.assertEqual(logs, update_receiver.call_args[1]['instances'])
+        self.assertEqual(
+            [('add', 'changed 0'), ('add', 'changed 1'), ('update', 'log 2'), ('add', 'log 3')],
+            list(queryset.order_by('pk').values_list('action', 'message')),
+        )
+
+    def test_many_to_many(self):
+        p1, p2, p3 = Permission.objects.order_by('pk')[:3]
+        groups = [Group.objects.create(name=f'bulk update {i}') for i in range(2)]
+        groups[0].permissions.set([p1, p2])
+        field = Group._meta.get_field('permissions')
+        serializer = BulkCreateListSerializer(child=create_form_class(Group, 'update')())
+        # 已经存在的关联数据不重复插入，同一条数据出现多次时只插入一次
+        serializer.bulk_set_many_to_many(
+            field, [(groups[0], [p2.pk, p3.pk]), (groups[1], [p1, p1.pk]), (groups[1], [p1.pk])]
+        )
+        self.assertEqual(
+            [{p2.pk, p3.pk}, {p1.pk}],
+            [set(group.permissions.values_list('pk', flat=True)) for group in groups],
+        )
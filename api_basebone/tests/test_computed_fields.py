@@ -0,0 +1,100 @@
+import json
+
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+
+from api_basebone.core.admin import BSMAdminModule
+from api_basebone.core.decorators import BSM_ADMIN_COMPUTED_FIELDS_MAP, basebone_admin_property
+from api_basebone.export.specs import FieldType
+from api_basebone.restful.const import MANAGE_END_SLUG
+from api_basebone.restful.projection import compile_projection
+from api_basebone.restful.serializers import (
+    EXPORT_FILE_ACTION,
+    clear_serializer_class_cache,
+    multiple_create_serializer_class,
+)
+from api_basebone.services.rest_services import get_display_fields_set
+
+ADMIN_KEY = 'auth__group'
+
+
+class ComputedFieldTest(TestCase):
+    """admin 中声明的计算属性字段的输出"""
+
+    def setUp(self):
+        super().setUp()
+        self.origin_admin = BSMAdminModule.modules.get(ADMIN_KEY)
+        self.origin_fields = getattr(Group, BSM_ADMIN_COMPUTED_FIELDS_MAP, None)
+        setattr(Group, BSM_ADMIN_COMPUTED_FIELDS_MAP, {})
+        self.batch_calls = []
+
+        test = self
+
+        class GroupAdmin:
+            @basebone_admin_property(Group, '权限数', FieldType.INTEGER)
+            def permission_count(self, instance):
+                return instance.permissions.count()
+
+            @permission_count.batch
+            def permission_count(self, instances):
+                test.batch_calls.append(len(instances))
+                queryset = Group.permissions.through.objects.filter(group__in=instances)
+                # 没有权限的分组不在结果中，输出 None
+                return {group_id: 1 for group_id in queryset.values_list('group_id', flat=True)}
+
+            @basebone_admin_property(Group, '审核时间', FieldType.DATETIME)
+            def reviewed_at(self, instance):
+                return None
+
+            @basebone_admin_property(Group, '是否启用', FieldType.BOOL)
+            def enabled(self, instance):
+                return None
+
+        BSMAdminModule.modules[ADMIN_KEY] = GroupAdmin
+        clear_serializer_class_cache()
+
+        permission = Permission.objects.first()
+        for i in range(3):
+            group = Group.objects.create(name=f'computed {i}')
+            if i:
+                group.permissions.add(permission)
+        self.queryset = Group.objects.filter(name__startswith='computed').order_by('pk')
+
+    def tearDown(self):
+        if self.origin_admin is None:
+            BSMAdminModule.modules.pop(ADMIN_KEY, None)
+        else:
+            BSMAdminModule.modules[ADMIN_KEY] = self.origin_admin
+        setattr(Group, BSM_ADMIN_COMPUTED_FIELDS_MAP, self.origin_fields)
+        clear_serializer_class_cache()
+        super().tearDown()
+
+    def get_serializer_class(self, action='list'):
+        return multiple_create_serializer_class(Group, None, action=action, end_slug=MANAGE_END_SLUG)
+
+    def test_export_empty_value(self):
+        data = self.get_serializer_class(EXPORT_FILE_ACTION)(self.queryset, many=True).data
+        self.assertEqual([''] * 3, [item['reviewed_at'] for item in data])
+        self.assertEqual([False] * 3, [item['enabled'] for item in data])
+
+        data = self.get_serializer_class()(self.queryset, many=True).data
+        self.assertEqual([None] * 3, [item['reviewed_at'] for item in data])
+
+    def test_batch(self):
+        serializer_class = self.get_serializer_class()
+        data = serializer_class(self.queryset, many=True).data
+        self.assertEqual([3], self.batch_calls)
+        self.assertEqual([None, 1, 1], [item['permission_count'] for item in data])
+
+        # 单个对象逐行计算
+        self.assertEqual(1, serializer_class(self.queryset.last()).data['permission_count'])
+
+        instances = list(self.queryset)
+        serializer = serializer_class(instances, many=True)
+        projection = compile_projection(serializer.child, get_display_fields_set(None))
+        self.assertEqual(
+            json.loads(JSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(projection.represent_many(instances))),
+        )
+        self.assertEqual([3, 3], self.batch_calls)
@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase
+
+from api_basebone.services import count
+from api_basebone.settings import settings
+from api_basebone.signals import post_bsm_create
+
+
+class CountTest(TestCase):
+    """列表计数"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for i in range(3):
+            Group.objects.create(name=f'count {i}')
+
+    def tearDown(self):
+        settings.COUNT_APPROXIMATE_THRESHOLD = 0
+        cache.clear()
+        super().tearDown()
+
+    def test_approximate(self):
+        queryset = Group.objects.all()
+        handlers = {'sqlite': lambda queryset: 1000}
+        with mock.patch.dict(count.APPROXIMATE_COUNT_HANDLERS, handlers):
+            # 默认关闭近似计数
+            self.assertEqual((3, True), count.count_queryset(queryset))
+
+            settings._cached_attrs.add('COUNT_APPROXIMATE_THRESHOLD')
+            settings.COUNT_APPROXIMATE_THRESHOLD = 10
+            self.assertEqual((1000, False), count.count_queryset(queryset))
+            self.assertEqual((3, True), count.count_queryset(queryset, exact=True))
+            # 有筛选条件时只使用精确计数
+            self.assertEqual((1, True), count.count_queryset(queryset.filter(name='count 0')))
+
+    def test_cache(self):
+        queryset = Group.objects.filter(name__startswith='count')
+        # 没有开启计数缓存的模型每次都查询
+        with self.assertNumQueries(2):
+            count.count_queryset(queryset)
+            count.count_queryset(queryset)
+
+        settings._cached_attrs.add('COUNT_CACHE_MODELS')
+        settings.COUNT_CACHE_MODELS = ['auth__group']
+        count.connect_signals()
+        try:
+            self.assertEqual((3, True), count.count_queryset(queryset))
+            with self.assertNumQueries(0):
+                self.assertEqual((3, True), count.count_queryset(queryset))
+
+            # 直接执行的 QuerySet.update 不会使缓存失效
+            Group.objects.filter(name='count 2').update(name='updated')
+            self.assertEqual((3, True), count.count_queryset(queryset))
+            post_bsm_create.send(
+                sender=Group,
+                instance=Group.objects.get(name='updated'),
+                create=False,
+                request=None,
+                old_instance=None,
+                scope='',
+            )
+            self.assertEqual((2, True), count.count_queryset(queryset))
+
+            # 通过 ORM 创建、删除数据时缓存失效
+            instance = Group.objects.create(name='count 3')
+            self.assertEqual((3, True), count.count_queryset(queryset))
+            instance.delete()
+            self.assertEqual((2, True), count.count_queryset(queryset))
+        finally:
+            count.disconnect_signals()
+            settings.COUNT_CACHE_MODELS = []
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.test import TestCase
+
+from api_basebone.restful.const import MANAGE_END_SLUG
+from api_basebone.restful.serializers import clear_serializer_class_cache, multiple_create_serializer_class
+from api_basebone.utils.queryset import queryset_only
+
+
+def get_label(instance):
+    return f'<{instance.name}>'
+
+
+class DisplayColumnsTest(TestCase):
+    """根据显示字段选择查询的列"""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            Group.objects.create(name=f'columns {i}')
+        clear_serializer_class_cache()
+
+    def tearDown(self):
+        clear_serializer_class_cache()
+        super().tearDown()
+
+    def patch_computed_field(self, **kwargs):
+        """给 Group 声明计算属性 label"""
+        GMeta = type('GMeta', (), {'computed_fields': [dict(name='label', display_name='标签', type='string', **kwargs)]})
+        return mock.patch.multiple(Group, create=True, GMeta=GMeta, label=property(get_label))
+
+    def serialize(self, display_fields):
+        queryset = queryset_only(Group.objects.filter(name__startswith='columns').order_by('pk'), display_fields)
+        serializer_class = multiple_create_serializer_class(
+            Group, None, action='list', end_slug=MANAGE_END_SLUG, display_fields=display_fields
+        )
+        return queryset, [item['label'] for item in serializer_class(queryset, many=True).data]
+
+    def test_only(self):
+        queryset = queryset_only(Group.objects.all(), ['id'])
+        self.assertEqual(({'id'}, False), queryset.query.deferred_loading)
+
+        queryset = queryset_only(Group.objects.all(), ['*', '-name'])
+        self.assertEqual(({'name'}, True), queryset.query.deferred_loading)
+
+    def test_computed_field_deps(self):
+        expected = [f'<columns {i}>' for i in range(3)]
+        with self.patch_computed_field(deps=['name']):
+            with self.assertNumQueries(1):
+                queryset, labels = self.serialize(['label'])
+            self.assertEqual(expected, labels)
+            self.assertEqual(({'id', 'name'}, False), queryset.query.deferred_loading)
+
+    def test_computed_field_without_deps(self):
+        # 没有声明依赖时查询所有的列，序列化时不会逐行加载延迟的字段
+        expected = [f'<columns {i}>' for i in range(3)]
+        with self.patch_computed_field():
+            with self.assertNumQueries(1):
+                queryset, labels = self.serialize(['label'])
+            self.assertEqual(expected, labels)
+            self.assertEqual((frozenset(), True), queryset.query.deferred_loading)
@@ -0,0 +1,47 @@
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from api_basebone.utils.queryset import parse_expand_fields, queryset_prefetch, split_expand_fields
+from api_basebone.restful.serializers import sort_expand_fields
+
+
+class ExpandLimitTest(TestCase):
+    """对多关系的展开字段按照数量限制查询"""
+
+    def setUp(self):
+        super().setUp()
+        self.content_types = list(ContentType.objects.order_by('pk')[:3])
+        self.group = Group.objects.create(name='expand')
+        self.group.permissions.set(Permission.objects.filter(content_type__in=self.content_types))
+
+    def test_parse(self):
+        self.assertEqual(
+            ['items[:5 order by -id,name]', 'customer'], split_expand_fields('items[:5 order by -id,name],customer')
+        )
+        fields, limits = parse_expand_fields(['customer.orders[:2 order by -id title].items[:1]', 'tags'])
+        self.assertEqual(['customer.orders.items', 'tags'], fields)
+        self.assertEqual({'customer.orders': (2, ['-id', 'title']), 'customer.orders.items': (1, [])}, limits)
+
+    def test_reverse_relation(self):
+        fields, limits = parse_expand_fields(['permission_set[:2 order by -codename]'])
+        queryset = queryset_prefetch(
+            ContentType.objects.filter(pk__in=[c.pk for c in self.content_types]).order_by('pk'),
+            sort_expand_fields(fields),
+            limits=limits,
+        )
+        expected = [
+            list(Permission.objects.filter(content_type=c).order_by('-codename')[:2])
+            for c in self.content_types
+        ]
+        with self.assertNumQueries(2):
+            result = [list(content_type.permission_set.all()) for content_type in queryset]
+        self.assertEqual(expected, result)
+
+    def test_many_to_many(self):
+        fields, limits = parse_expand_fields(['permissions[:1 order by codename]'])
+        queryset = queryset_prefetch(Group.objects.all(), sort_expand_fields(fields), limits=limits)
+        group = queryset.get(pk=self.group.pk)
+        self.assertEqual(
+            [self.group.permissions.order_by('codename').first()], list(group.permissions.all())
+        )
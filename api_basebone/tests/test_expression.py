@@ -0,0 +1,61 @@
+import unittest
+
+from api_basebone.services.expresstion import (
+    BaseExpression,
+    Expression,
+    ExpressionSyntaxError,
+    expression_ast_cache,
+    parse_expression,
+)
+
+
+class Variables:
+    count = 3
+    tags = [1, 2]
+
+
+class ExpressionTest(unittest.TestCase):
+    """测试表达式的解析和求值"""
+
+    def resolve(self, expression):
+        return Expression(Variables()).resolve(expression)
+
+    def test_literal(self):
+        self.assertEqual(1, self.resolve('1'))
+        self.assertEqual('a.b', self.resolve('"a.b"'))
+        self.assertEqual([1, {'a': None}], self.resolve('[1, {"a": null}]'))
+        self.assertIs(True, self.resolve('true'))
+
+    def test_function_and_variable(self):
+        self.assertEqual(6, self.resolve('add(1, 2, count)'))
+        self.assertEqual('big', self.resolve('if(gt(count, 1), "big", "small")'))
+        self.assertEqual(2, self.resolve('len(tags)'))
+        self.assertEqual(2, self.resolve('getitem(tags, 1)'))
+
+    def test_cache(self):
+        node = parse_expression(Expression, 'mul(count, 2)')
+        self.assertIs(node, parse_expression(Expression, 'mul(count, 2)'))
+        self.assertIn((Expression, 'mul(count, 2)'), expression_ast_cache)
+
+        # 缓存的语法树对不同的变量求值
+        other = Variables()
+        other.count = 5
+        self.assertEqual(6, self.resolve('mul(count, 2)'))
+        self.assertEqual(10, Expression(other).resolve('mul(count, 2)'))
+
+    def test_literal_is_not_shared(self):
+        self.resolve('[1, 2]').append(3)
+        self.assertEqual([1, 2], self.resolve('[1, 2]'))
+
+    def test_syntax_error(self):
+        with self.assertRaises(ExpressionSyntaxError) as context:
+            self.resolve('add(1 2)')
+        self.assertEqual(6, context.exception.position)
+
+        with self.assertRaises(ExpressionSyntaxError) as context:
+            self.resolve('tags.')
+        self.assertEqual(5, context.exception.position)
+
+    def test_variable_not_supported(self):
+        with self.assertRaises(NotImplementedError):
+            BaseExpression().resolve('count')
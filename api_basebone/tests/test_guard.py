@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from guardian.shortcuts import assign_perm
+
+from api_basebone.services.guard import guard_queryset
+
+
+class GuardQuerysetTest(TestCase):
+    """按照 guardian 的对象权限筛选结果集"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create(username='guard')
+        self.groups = [Group.objects.create(name=f'guard {i}') for i in range(3)]
+        self.queryset = Group.objects.filter(name__startswith='guard').order_by('pk')
+
+    def test_guard(self):
+        # 没有任何对象权限时不做筛选
+        self.assertEqual(self.groups, list(guard_queryset(self.queryset, self.user)))
+        # 权限以及对象权限是否存在只查询一次
+        with self.assertNumQueries(1):
+            guard_queryset(self.queryset, self.user)
+
+        assign_perm('auth.view_group', self.user, self.groups[0])
+        member_group = Group.objects.create(name='member')
+        member_group.user_set.add(self.user)
+        assign_perm('auth.view_group', member_group, self.groups[2])
+        self.assertEqual([self.groups[0], self.groups[2]], list(guard_queryset(self.queryset, self.user)))
+
+    def test_permission_recreated(self):
+        assign_perm('auth.view_group', self.user, self.groups[0])
+        self.assertEqual([self.groups[0]], list(guard_queryset(self.queryset, self.user)))
+
+        # 权限重新创建后主键变化，不能因为旧的主键导致不做筛选
+        permission = Permission.objects.get(codename='view_group')
+        permission.delete()
+        Permission.objects.create(
+            codename='view_group', name='Can view group', content_type=ContentType.objects.get_for_model(Group)
+        )
+        assign_perm('auth.view_group', self.user, self.groups[1])
+        self.assertEqual([self.groups[1]], list(guard_queryset(self.queryset, self.user)))
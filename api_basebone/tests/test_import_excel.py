@@ -0,0 +1,69 @@
+import io
+from types import SimpleNamespace
+
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from openpyxl import Workbook
+from rest_framework.exceptions import ValidationError
+
+from api_basebone.restful.export.excel import import_excel
+from api_basebone.settings import settings
+
+
+class ImportExcelTest(TestCase):
+    """分块导入 Excel"""
+
+    config = {
+        'type': 'create',
+        'list_start_line': 2,
+        'list_mapping': [
+            {'column': 'A', 'field': 'name'},
+            {'column': 'B', 'field': 'codename'},
+            {'column': 'C', 'field': 'content_type', 'to_field': 'model'},
+        ],
+    }
+
+    def setUp(self):
+        super().setUp()
+        settings._cached_attrs.add('IMPORT_CHUNK_SIZE')
+        settings.IMPORT_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        settings.IMPORT_CHUNK_SIZE = 1000
+        super().tearDown()
+
+    def get_content(self, rows):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['名称', '标识', '模型'])
+        for row in rows:
+            sheet.append(row)
+        content = io.BytesIO()
+        workbook.save(content)
+        return content.getvalue()
+
+    def import_excel(self, rows):
+        request = SimpleNamespace(query_params={})
+        return import_excel(self.config, self.get_content(rows), Permission.objects.all(), request)
+
+    def test_import(self):
+        rows = [[f'import {i}', f'import_{i}', 'group' if i % 2 else 'permission'] for i in range(5)]
+        self.import_excel(rows)
+
+        group, permission = (ContentType.objects.get(app_label='auth', model=model) for model in ('group', 'permission'))
+        self.assertEqual(
+            [group.pk if i % 2 else permission.pk for i in range(5)],
+            list(
+                Permission.objects.filter(codename__startswith='import_')
+                .order_by('codename')
+                .values_list('content_type', flat=True)
+            ),
+        )
+
+    def test_errors(self):
+        rows = [[f'error {i}', f'error_{i}', 'missing' if i in (1, 3) else 'group'] for i in range(4)]
+        with self.assertRaises(ValidationError) as context:
+            self.import_excel(rows)
+        self.assertEqual([3, 5], [int(item['line']) for item in context.exception.detail])
+        self.assertFalse(Permission.objects.filter(codename__startswith='error_').exists())
@@ -0,0 +1,80 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models import F
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api_basebone.core.exceptions import BusinessException
+from api_basebone.drf.pagination import KeysetPagination
+from bsm_config.models import Menu
+
+factory = APIRequestFactory()
+
+
+class KeysetPaginationTest(TestCase):
+    """游标分页向前、向后翻页的结果和 OFFSET 分页一致"""
+
+    def setUp(self):
+        super().setUp()
+        # 名称有空值，也有重复的值
+        for name in [None, 'a', 'b', None, 'a', 'c', 'b', None]:
+            Menu.objects.create(name=name, type=Menu.TYPE_GROUP)
+
+    def paginate(self, queryset, cursor):
+        paginator = KeysetPagination()
+        request = Request(factory.get('/', {'cursor': cursor, 'size': 3}))
+        results = paginator.paginate_queryset(queryset, request)
+        return paginator, [item.pk for item in results]
+
+    def assert_pages(self, *ordering):
+        queryset = Menu.objects.order_by(*ordering)
+        expected = list(queryset.values_list('pk', flat=True))
+        expected = [expected[i: i + 3] for i in range(0, len(expected), 3)]
+
+        pages, paginator = [], None
+        while paginator is None or paginator.next_cursor:
+            paginator, pks = self.paginate(queryset, paginator.next_cursor if paginator else '')
+            pages.append(pks)
+        self.assertEqual(expected, pages)
+
+        # 从最后一页向前翻页
+        while paginator.previous_cursor:
+            paginator, pks = self.paginate(queryset, paginator.previous_cursor)
+            pages.pop()
+            self.assertEqual(pages[-1], pks)
+        self.assertEqual(1, len(pages))
+
+    def test_null_ordering(self):
+        self.assert_pages('name', 'pk')
+
+    def test_descending(self):
+        self.assert_pages('-name', '-pk')
+        self.assert_pages('-pk')
+
+    def test_ties(self):
+        # 排序字段的值重复时按照主键区分
+        self.assert_pages('name', '-pk')
+        self.assert_pages('-name', 'pk')
+
+    def test_cursor_ordering_changed(self):
+        paginator, _ = self.paginate(Menu.objects.order_by('name'), '')
+        with self.assertRaises(BusinessException):
+            self.paginate(Menu.objects.order_by('-name'), paginator.next_cursor)
+
+    def test_unsupported_ordering(self):
+        queryset_list = [
+            Menu.objects.order_by(F('name').asc()),
+            Menu.objects.order_by('?'),
+            # 关联模型有默认排序
+            Group.objects.order_by('permissions'),
+        ]
+        for queryset in queryset_list:
+            with self.assertRaises(BusinessException):
+                self.paginate(queryset, '')
+
+        # 对多的关系字段排序
+        permission = Permission.objects.first()
+        for i in range(4):
+            Group.objects.create(name=f'keyset {i}').permissions.add(permission)
+        with self.assertRaises(BusinessException):
+            self.paginate(Group.objects.order_by('permissions__codename'), '')
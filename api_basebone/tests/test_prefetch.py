@@ -0,0 +1,52 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models import Prefetch
+from django.test import TestCase
+
+from api_basebone.settings import settings
+from api_basebone.utils.prefetch import chunked_prefetch_queryset, iterate_queryset
+
+
+def dump(groups):
+    """读取 prefetch 的数据，包括嵌套的一层"""
+    return [
+        (group.name, [(p.codename, p.content_type.model) for p in group.permissions.all()])
+        for group in groups
+    ]
+
+
+class ChunkedPrefetchTest(TestCase):
+    """分块 prefetch 的结果和一次 prefetch 的结果一致"""
+
+    def setUp(self):
+        super().setUp()
+        permissions = list(Permission.objects.order_by('pk')[:6])
+        for i in range(5):
+            group = Group.objects.create(name=f'prefetch {i}')
+            group.permissions.set(permissions[i: i + 3])
+
+        settings._cached_attrs.add('PREFETCH_CHUNK_SIZE')
+        settings.PREFETCH_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        settings.PREFETCH_CHUNK_SIZE = 500
+        super().tearDown()
+
+    def get_queryset(self):
+        permissions = Permission.objects.order_by('codename')
+        return (
+            Group.objects.filter(name__startswith='prefetch')
+            .order_by('pk')
+            .prefetch_related(Prefetch('permissions', queryset=permissions), 'permissions__content_type')
+        )
+
+    def test_chunked_prefetch(self):
+        expected = dump(self.get_queryset())
+
+        # 1 次主查询，3 块数据每块 2 次 prefetch 的查询
+        with self.assertNumQueries(7):
+            result = dump(chunked_prefetch_queryset(self.get_queryset()))
+        self.assertEqual(expected, result)
+
+    def test_iterate_queryset(self):
+        expected = dump(self.get_queryset())
+        self.assertEqual(expected, dump(iterate_queryset(self.get_queryset())))
@@ -0,0 +1,69 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+
+from api_basebone.models import AdminLog
+from api_basebone.restful.const import MANAGE_END_SLUG
+from api_basebone.restful.projection import compile_projection
+from api_basebone.restful.serializers import multiple_create_serializer_class
+from api_basebone.services.rest_services import filter_display_fields, get_display_fields_set
+
+
+def render(data):
+    return json.loads(JSONRenderer().render(data))
+
+
+class ProjectionTest(TestCase):
+    """行投影输出的数据和 DRF 序列化后裁剪的数据一致"""
+
+    def setUp(self):
+        super().setUp()
+        permissions = list(Permission.objects.order_by('pk')[:3])
+        for i in range(3):
+            group = Group.objects.create(name=f'projection {i}')
+            group.permissions.set(permissions[: i + 1])
+        Group.objects.create(name='projection empty')
+
+    def assert_same_output(self, expand_fields, display_fields, queryset=None):
+        if queryset is None:
+            queryset = Group.objects.filter(name__startswith='projection').order_by('pk')
+        serializer_class = multiple_create_serializer_class(
+            queryset.model, expand_fields, action='list', end_slug=MANAGE_END_SLUG, display_fields=display_fields
+        )
+        if expand_fields:
+            queryset = queryset.prefetch_related(*[field.replace('.', '__') for field in expand_fields])
+        data = list(queryset)
+
+        serializer = serializer_class(data, many=True)
+        projection = compile_projection(serializer.child, get_display_fields_set(display_fields))
+        self.assertIsNotNone(projection)
+        self.assertEqual(
+            render(filter_display_fields(serializer.data, display_fields)),
+            render(projection.represent_many(data)),
+        )
+
+    def test_all_fields(self):
+        self.assert_same_output(None, None)
+
+    def test_expand_fields(self):
+        self.assert_same_output(['permissions.content_type'], None)
+
+    def test_display_fields(self):
+        self.assert_same_output(
+            ['permissions.content_type'], ['name', 'permissions.codename', 'permissions.content_type.*']
+        )
+        self.assert_same_output(['permissions'], ['*', '-permissions.name'])
+
+    def test_json_field(self):
+        user = get_user_model().objects.create(username='projection')
+        for params in [{'a': 1, 'b': 2, 'c': {'x': 1, 'y': 2}, 'd': [{'x': 1, 'y': 2}, 3]}, {}, {'b': 1}]:
+            AdminLog.objects.create(user=user, action='add', params=params)
+        queryset = AdminLog.objects.order_by('pk')
+
+        # JSONField 的值按照显示字段递归裁剪
+        self.assert_same_output([], ['action', 'params.a', 'params.c.*', '-params.c.y', 'params.d.x'], queryset)
+        self.assert_same_output([], ['*', '-params.b'], queryset)
+        self.assert_same_output([], ['params'], queryset)
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import Group
+from django.test import TestCase
+
+from api_basebone.services.query_profile import QueryProfile, get_fingerprint
+
+
+class QueryProfileTest(TestCase):
+    """请求的 SQL 统计"""
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            get_fingerprint('SELECT "id" FROM "t" WHERE "id" IN (%s, %s, %s) LIMIT 21'),
+            get_fingerprint('SELECT "id"  FROM "t" WHERE "id" IN (%s) LIMIT 1'),
+        )
+
+    def test_duplicates(self):
+        groups = [Group.objects.create(name=f'profile {i}') for i in range(3)]
+        profile = QueryProfile()
+        with profile.capture():
+            for group in groups:
+                list(group.permissions.all())
+            Group.objects.count()
+
+        self.assertEqual(4, profile.count)
+        duplicates = profile.get_duplicates(threshold=3)
+        self.assertEqual(1, len(duplicates))
+        self.assertEqual(3, duplicates[0][1])
+        self.assertEqual(2, len(profile.get_slowest(2)))
+        self.assertEqual(1 + 1 + 3, len(profile.summary()))
@@ -0,0 +1,64 @@
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models.deletion import Collector
+from django.test import TestCase
+
+from api_basebone.models import AdminLog
+from api_basebone.services.result_cache import (
+    RESULT_VERSION_CACHE_KEY,
+    connect_signals,
+    disconnect_signals,
+    get_model_label,
+    get_path_models,
+)
+from api_basebone.settings import settings
+
+
+class ResultCacheVersionTest(TestCase):
+    """数据变动时递增模型的版本号"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        settings._cached_attrs.add('RESULT_CACHE_MODELS')
+        settings.RESULT_CACHE_MODELS = ['auth__group']
+        connect_signals()
+
+    def tearDown(self):
+        disconnect_signals()
+        settings.RESULT_CACHE_MODELS = []
+        super().tearDown()
+
+    def get_version(self, model):
+        return cache.get(RESULT_VERSION_CACHE_KEY.format(label=get_model_label(model)), 0)
+
+    def test_path_models(self):
+        self.assertEqual([Permission, ContentType], get_path_models(Group, 'permissions.content_type.model'))
+        self.assertEqual([], get_path_models(Group, '-name'))
+
+    def test_signals(self):
+        group = Group.objects.create(name='result cache')
+        version = self.get_version(Group)
+        self.assertGreater(version, 0)
+
+        group.name = 'updated'
+        group.save()
+        self.assertEqual(version + 1, self.get_version(Group))
+
+        permission_version = self.get_version(Permission)
+        group.permissions.add(Permission.objects.first())
+        self.assertEqual(version + 2, self.get_version(Group))
+        self.assertEqual(permission_version + 1, self.get_version(Permission))
+
+    def test_signal_models(self):
+        # 只对开启了缓存的模型连接信号，其他模型的删除仍然可以使用 fast delete
+        self.assertTrue(Collector(using='default').can_fast_delete(AdminLog.objects.all()))
+        self.assertFalse(Collector(using='default').can_fast_delete(Group.objects.all()))
+
+        # 没有声明为依赖的模型直接修改时不递增版本号
+        content_type = ContentType.objects.get_for_model(Group)
+        permission = Permission.objects.create(name='result cache', codename='result_cache', content_type=content_type)
+        permission_version = self.get_version(Permission)
+        Permission.objects.filter(pk=permission.pk).update(name='updated')
+        self.assertEqual(permission_version, self.get_version(Permission))
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from api_basebone.db import router
+from api_basebone.settings import settings
+
+REPLICAS = ['replica_1', 'replica_2', 'replica_3']
+
+
+class ReplicaRouterTest(SimpleTestCase):
+    """只读副本的路由"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        settings._cached_attrs.add('DATABASE_REPLICAS')
+        settings.DATABASE_REPLICAS = REPLICAS
+        self.router = router.ReplicaRouter()
+        self.user = SimpleNamespace(pk=1)
+
+    def tearDown(self):
+        settings.DATABASE_REPLICAS = []
+        router.clean_local(sender=None)
+        cache.clear()
+        super().tearDown()
+
+    def test_one_replica_per_request(self):
+        for choice in REPLICAS:
+            with mock.patch('random.choice', return_value=choice) as random_choice:
+                router.use_replica('list', self.user)
+                self.assertEqual(
+                    [choice] * 5, [self.router.db_for_read(Group) for _ in range(5)]
+                )
+            random_choice.assert_called_once_with(REPLICAS)
+
+    def test_write_actions(self):
+        router.use_replica('create', self.user)
+        self.assertIsNone(self.router.db_for_read(Group))
+
+        # 没有配置只读副本时不选择
+        settings.DATABASE_REPLICAS = []
+        router.use_replica('list', self.user)
+        self.assertIsNone(self.router.db_for_read(Group))
+
+    def test_sticky(self):
+        router.use_replica('list', self.user)
+        self.assertIn(self.router.db_for_read(Group), REPLICAS)
+
+        # 请求中写入数据后，当前请求以及此用户后续的请求都使用主库
+        instance = Group(name='router')
+        instance._state.db = self.router.db_for_read(Group)
+        self.assertEqual('default', self.router.db_for_write(Group, instance=instance))
+        self.assertIsNone(self.router.db_for_read(Group))
+
+        router.use_replica('list', self.user)
+        self.assertIsNone(self.router.db_for_read(Group))
+
+        # 其他用户不受影响
+        router.use_replica('list', SimpleNamespace(pk=2))
+        self.assertIn(self.router.db_for_read(Group), REPLICAS)
+
+        # 过期后恢复使用只读副本
+        cache.delete(router.get_sticky_key(self.user.pk))
+        router.use_replica('list', self.user)
+        self.assertIn(self.router.db_for_read(Group), REPLICAS)
+
+    def test_outside_request(self):
+        self.assertIsNone(self.router.db_for_read(Group))
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Q
+from django.test import TestCase
+
+from api_basebone.restful.client.views import QuerySetMixin
+from api_basebone.utils.operators import build_filter_conditions2
+from api_basebone.utils.semijoin import (
+    check_multiple_joins,
+    check_multiple_lookup,
+    check_multiple_ordering,
+    semi_join_filter,
+)
+
+
+class SemiJoinFilterTest(TestCase):
+    """对多关系的条件改写为子查询后，结果和去重的结果一致"""
+
+    def setUp(self):
+        super().setUp()
+        content_type = ContentType.objects.get_for_model(Group)
+        self.permissions = [
+            Permission.objects.create(
+                name=f'perm {i}', codename=f'semi_join_{i}', content_type=content_type
+            )
+            for i in range(4)
+        ]
+        self.groups = []
+        for i in range(6):
+            group = Group.objects.create(name=f'group {i}')
+            group.permissions.set(self.permissions[: i % 5])
+            self.groups.append(group)
+
+    def assertSameResult(self, queryset, filters):
+        cons = build_filter_conditions2(filters)
+        expected = list(queryset.filter(cons).distinct().order_by('pk'))
+        result, distinct = semi_join_filter(queryset, cons)
+        if distinct:
+            result = result.distinct()
+        self.assertEqual(expected, list(result.order_by('pk')))
+        return result, distinct
+
+    def test_check_multiple_lookup(self):
+        self.assertTrue(check_multiple_lookup(Group, 'permissions__codename'))
+        self.assertTrue(check_multiple_lookup(Permission, 'group__name__exact'))
+        self.assertTrue(check_multiple_lookup(Permission, 'content_type__permission__pk'))
+        self.assertFalse(check_multiple_lookup(Group, 'name__icontains'))
+        self.assertFalse(check_multiple_lookup(Permission, 'content_type__app_label'))
+        self.assertIsNone(check_multiple_lookup(Group, 'permission_count'))
+
+    def test_check_multiple_ordering(self):
+        self.assertTrue(check_multiple_ordering(Group, ['name', '-permissions__codename']))
+        self.assertFalse(check_multiple_ordering(Permission, ['-content_type__model', 'pk']))
+        self.assertFalse(check_multiple_ordering(Group, ['permission_count']))
+
+    def test_check_multiple_joins(self):
+        self.assertFalse(check_multiple_joins(Group.objects.all().query))
+        self.assertFalse(check_multiple_joins(Permission.objects.filter(content_type__model='group').query))
+        # 结果集本身连接了对多关系的表，例如自定义的管理器
+        self.assertTrue(check_multiple_joins(Group.objects.filter(permissions__codename__startswith='semi').query))
+        self.assertTrue(check_multiple_joins(Permission.objects.filter(group__name='group 3').query))
+        # 分组查询不会产生重复的数据
+        self.assertFalse(check_multiple_joins(Group.objects.annotate(permission_count=Count('permissions')).query))
+
+    def test_plain_conditions(self):
+        queryset = Group.objects.all()
+        result, distinct = self.assertSameResult(
+            queryset, [{'field': 'name', 'operator': 'startswith', 'value': 'group'}]
+        )
+        self.assertFalse(distinct)
+        self.assertNotIn(' IN (SELECT', str(result.query))
+
+    def test_multiple_conditions(self):
+        queryset = Group.objects.all()
+        codenames = ['semi_join_0', 'semi_join_2']
+        cases = [
+            [{'field': 'permissions.codename', 'operator': 'in', 'value': codenames}],
+            [
+                {'field': 'name', 'operator': '!=', 'value': 'group 4'},
+                {'field': 'permissions.codename', 'operator': 'in', 'value': codenames},
+            ],
+            [
+                {'field': 'permissions.codename', 'operator': 'startswith', 'value': 'semi_join'},
+                {'field': 'permissions.codename', 'operator': '!=', 'value': 'semi_join_1'},
+            ],
+            [
+                {
+                    'operator': 'or',
+                    'children': [
+                        {'field': 'name', 'operator': '=', 'value': 'group 0'},
+                        {'field': 'permissions.codename', 'operator': '=', 'value': 'semi_join_3'},
+                    ],
+                }
+            ],
+        ]
+        for filters in cases:
+            _, distinct = self.assertSameResult(queryset, filters)
+            self.assertFalse(distinct)
+
+    def test_reverse_conditions(self):
+        queryset = Permission.objects.filter(codename__startswith='semi_join')
+        _, distinct = self.assertSameResult(
+            queryset, [{'field': 'group.name', 'operator': 'in', 'value': ['group 3', 'group 4']}]
+        )
+        self.assertFalse(distinct)
+
+    def test_annotated_conditions(self):
+        queryset = Group.objects.annotate(permission_count=Count('permissions'))
+        _, distinct = self.assertSameResult(
+            queryset, [{'field': 'permission_count', 'operator': '>', 'value': 1}]
+        )
+        self.assertFalse(distinct)
+
+        cons = Q(permission_count__gt=1) | Q(permissions__codename='semi_join_0')
+        _, distinct = semi_join_filter(queryset, cons)
+        self.assertTrue(distinct)
+
+    def test_client_queryset(self):
+        view = QuerySetMixin()
+        view.model, view.tree_data = Group, None
+        view.request = SimpleNamespace(user=SimpleNamespace(is_staff=True, is_superuser=True), data={})
+        self.assertFalse(view._get_queryset(Group.objects.all()).query.distinct)
+
+        # 结果集本身连接了对多关系的表时仍然去重
+        queryset = Group.objects.filter(permissions__codename__startswith='semi_join')
+        result = view._get_queryset(queryset)
+        self.assertTrue(result.query.distinct)
+        self.assertEqual(list(queryset.distinct().order_by('pk')), list(result.order_by('pk')))
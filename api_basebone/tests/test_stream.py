@@ -0,0 +1,90 @@
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+
+import lightning_flags as flags
+from api_basebone.drf.response import streaming_success_response, success_response
+from api_basebone.restful.const import MANAGE_END_SLUG
+from api_basebone.restful.serializers import multiple_create_serializer_class
+from api_basebone.core.exceptions import BusinessException
+from api_basebone.services.rest_services import check_stream_display, iter_display_chunks, serialize_display_data
+from api_basebone.settings import settings
+
+
+class StreamDisplayTest(TestCase):
+    """不分页的列表分块输出的数据和一次性序列化的数据一致"""
+
+    display_fields = ['name', 'permissions.codename', 'permissions.content_type.*']
+
+    def setUp(self):
+        super().setUp()
+        permissions = list(Permission.objects.order_by('pk')[:3])
+        for i in range(5):
+            group = Group.objects.create(name=f'stream {i}')
+            group.permissions.set(permissions[: i % 4])
+
+        serializer_class = multiple_create_serializer_class(
+            Group,
+            ['permissions.content_type'],
+            action='list',
+            end_slug=MANAGE_END_SLUG,
+            display_fields=self.display_fields,
+        )
+        self.view = SimpleNamespace(get_serializer=lambda data, many: serializer_class(data, many=many))
+        self.queryset = (
+            Group.objects.filter(name__startswith='stream')
+            .prefetch_related('permissions__content_type')
+            .order_by('pk')
+        )
+
+        settings._cached_attrs.add('STREAM_CHUNK_SIZE')
+        settings.STREAM_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        settings.STREAM_CHUNK_SIZE = 500
+        super().tearDown()
+
+    def get_stream_content(self):
+        response = streaming_success_response(iter_display_chunks(self.view, self.queryset, self.display_fields))
+        return json.loads(b''.join(response.streaming_content))
+
+    def get_content(self):
+        result = serialize_display_data(self.view, self.queryset, self.display_fields)
+        return json.loads(JSONRenderer().render(success_response(result).data))
+
+    def test_stream(self):
+        chunks = list(iter_display_chunks(self.view, self.queryset, self.display_fields))
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual(self.get_content(), self.get_stream_content())
+
+    def test_stream_with_projector(self):
+        expected = self.get_content()
+        with mock.patch.object(flags, 'ROW_PROJECTOR', True):
+            self.assertEqual(expected, self.get_content())
+            self.assertEqual(expected, self.get_stream_content())
+
+    def test_stream_error(self):
+        def chunks():
+            yield [{'name': 'a'}]
+            raise BusinessException(error_code='10000', error_message='error')
+
+        # 中途出错时仍然输出完整的 JSON，error_code 为异常的错误码
+        content = json.loads(b''.join(streaming_success_response(chunks()).streaming_content))
+        self.assertEqual('10000', content['error_code'])
+        self.assertEqual('error', content['error_message'])
+        self.assertEqual([{'name': 'a'}], content['result'])
+
+    def test_check_stream_display(self):
+        view = SimpleNamespace(request=SimpleNamespace(query_params={'stream': 'true'}))
+        self.assertTrue(check_stream_display(view, self.queryset))
+        # 开启了 SQL 统计时不使用流式输出
+        settings._cached_attrs.add('QUERY_PROFILE')
+        settings.QUERY_PROFILE = True
+        try:
+            self.assertFalse(check_stream_display(view, self.queryset))
+        finally:
+            settings.QUERY_PROFILE = False
@@ -0,0 +1,77 @@
+from django.test import TestCase
+
+from api_basebone.utils import meta
+from api_basebone.utils.tree import prefetch_tree
+from bsm_config.models import Menu
+from puzzle.models import Block
+
+
+def dump(node):
+    """通过 related_name 逐层输出节点名称，和序列化时的读取方式一致"""
+    return {node.name: [dump(child) for child in node.children.all()]}
+
+
+class PrefetchTreeTest(TestCase):
+    """组装树形数据"""
+
+    def setUp(self):
+        super().setUp()
+        # a -> (a1 -> (a11 -> a111), a2), b
+        self.a = self.create('a')
+        self.a1 = self.create('a1', self.a)
+        self.a11 = self.create('a11', self.a1)
+        self.create('a111', self.a11)
+        self.create('a2', self.a)
+        self.b = self.create('b')
+        self.tree_data = meta.tree_parent_field(Menu, 'parent')
+
+    def create(self, name, parent=None):
+        return Menu.objects.create(name=name, parent=parent, type=Menu.TYPE_GROUP)
+
+    def get_roots(self, max_depth=None):
+        roots = Menu.objects.filter(parent__isnull=True).order_by('pk')
+        return prefetch_tree(roots, self.tree_data, max_depth=max_depth)
+
+    def test_adjacency(self):
+        # 根节点 + 每层一次查询
+        with self.assertNumQueries(5):
+            roots = self.get_roots()
+        with self.assertNumQueries(0):
+            result = [dump(root) for root in roots]
+        self.assertEqual(
+            [{'a': [{'a1': [{'a11': [{'a111': []}]}]}, {'a2': []}]}, {'b': []}],
+            result,
+        )
+
+    def test_max_depth(self):
+        with self.assertNumQueries(2):
+            roots = self.get_roots(max_depth=2)
+        with self.assertNumQueries(0):
+            result = [dump(root) for root in roots]
+        self.assertEqual([{'a': [{'a1': []}, {'a2': []}]}, {'b': []}], result)
+
+    def test_cycle(self):
+        # 脏数据中父子关系成环，重复出现的节点不再展开子节点
+        self.a.parent = self.a11
+        self.a.save()
+        with self.assertNumQueries(4):
+            roots = prefetch_tree([self.a], self.tree_data)
+        self.assertEqual(
+            {'a': [{'a1': [{'a11': [{'a': []}, {'a111': []}]}]}, {'a2': []}]},
+            dump(roots[0]),
+        )
+
+    def test_mptt(self):
+        root = Block.objects.create(component='root')
+        child = Block.objects.create(component='child', parent=root)
+        Block.objects.create(component='grandchild', parent=child)
+        Block.objects.create(component='leaf', parent=root)
+        tree_data = meta.tree_parent_field(Block, 'parent')
+
+        roots = list(Block.objects.filter(pk=root.pk))
+        with self.assertNumQueries(1):
+            prefetch_tree(roots, tree_data)
+        with self.assertNumQueries(0):
+            root = roots[0]
+            result = [(node.component, [item.component for item in node.children.all()]) for node in root.children.all()]
+        self.assertEqual([('child', ['grandchild']), ('leaf', [])], result)
@@ -7,6 +7,7 @@ from django.db.models import Q
 from parameterized import parameterized
 from api_basebone.utils.operators import build_filter_conditions
 from api_basebone.utils.operators import build_filter_conditions2
+from api_basebone.utils.operators import compile_filter_conditions
 
 
 class BuildFilterConditionsTest(unittest.TestCase):
@@ -69,3 +70,23 @@ class BuildFilterConditionsTest(unittest.TestCase):
         true_result.append(Q(age=23))
         true_result = reduce(operator.and_, true_result)
         self.assertEqual(true_result, result)
+
+    def test_with_same_structure(self):
+        """结构相同、值不同的过滤条件共用同一个模板"""
+        data = [
+            {
+                'operator': 'or',
+                'children': [
+                    {'field': 'user.name', 'operator': '!=', 'value': 'a'},
+                    {'field': 'age', 'operator': '>', 'value': 1},
+                ],
+            }
+        ]
+        template, values = compile_filter_conditions(data)
+        self.assertEqual(['a', 1], values)
+        self.assertEqual(~Q(user__name='a') | Q(age__gt=1), build_filter_conditions2(data))
+
+        data[0]['children'][1]['value'] = 2
+        other_template, values = compile_filter_conditions(data)
+        self.assertIs(template, other_template)
+        self.assertEqual(~Q(user__name='a') | Q(age__gt=2), template.bind(values))
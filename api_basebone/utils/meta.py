@@ -2,26 +2,134 @@
 涉及到 model._meta 相关的工具方法
 """
 
+from types import MappingProxyType
+
 from django.apps import apps
 from django.conf import settings
 from django.db.models.fields import NOT_PROVIDED
 
+from api_basebone.core import gmeta
 from api_basebone.core.admin import BSMAdminModule
 from api_basebone.utils import module
 
 
+def get_field_related_name(model, field):
+    """获取正向关系字段的 related_name"""
+    if field.one_to_one:
+        return field.remote_field.name
+
+    related_name = field.remote_field.related_name
+    if related_name is None:
+        return '{}_set'.format(model.__name__.lower())
+    return related_name
+
+
+class ModelMetaIndex:
+    """模型元数据的索引
+
+    model._meta.get_fields() 的扫描在很多热点路径中重复执行，有些甚至是每一行数据都执行一次，
+    这里对每个模型只扫描一次，把常用的映射关系预先计算好。索引构建后不再修改。
+
+    - fields 字段名和字段的映射，包含反向字段
+    - reverse_fields 反向字段
+    - related_names 关系字段名和 (related_name, 字段) 的映射，只包含正向的关系字段
+    - related_name_fields 反向字段的 related_name 和反向字段的映射
+    - reverse_field_names 反向字段的 related_name 和反向字段名称的映射
+    - relation_fields 所有的关系字段
+    - multiple_relation_field_names 非一对一的关系字段名称
+    - related_model_fields 关系模型和指向它的第一个正向关系字段的映射，例如指向用户模型的字段
+    - exclude_fields GMeta 中声明的序列化时排除的字段
+    - computed_field_names GMeta 中声明的计算属性字段名称
+    - annotated_field_names GMeta 中声明的 annotate 字段名称
+    """
+
+    def __init__(self, model):
+        all_fields = model._meta.get_fields()
+
+        self.model = model
+        self.fields = MappingProxyType({item.name: item for item in all_fields})
+        self.concrete_fields = tuple(item for item in all_fields if item.concrete)
+        self.reverse_fields = tuple(
+            item for item in all_fields if item.auto_created and not item.concrete
+        )
+        self.relation_fields = tuple(item for item in all_fields if item.is_relation)
+        self.multiple_relation_field_names = frozenset(
+            item.name for item in self.relation_fields if not item.one_to_one
+        )
+
+        related_names, related_model_fields = {}, {}
+        for item in all_fields:
+            if not (item.is_relation and item.concrete):
+                continue
+            related_model_fields.setdefault(item.related_model, item)
+
+            related_name = get_field_related_name(model, item)
+            related_names[item.name] = (related_name, item)
+            # 和 _meta.get_field 保持一致，也可以通过 attname 查找
+            related_names.setdefault(item.attname, (related_name, item))
+        self.related_names = MappingProxyType(related_names)
+        self.related_model_fields = MappingProxyType(related_model_fields)
+
+        related_name_fields = {}
+        for item in self.reverse_fields:
+            # 反向字段的 remote_field 即关系模型中对应的正向字段
+            if item.remote_field.concrete:
+                related_name = get_field_related_name(
+                    item.related_model, item.remote_field
+                )
+                related_name_fields[related_name] = item
+        self.related_name_fields = MappingProxyType(related_name_fields)
+        self.reverse_field_names = MappingProxyType(
+            {key: item.name for key, item in related_name_fields.items()}
+        )
+
+        gmeta_class = getattr(model, 'GMeta', None)
+        exclude = getattr(gmeta_class, gmeta.GMETA_SERIALIZER_EXCLUDE_FIELDS, None)
+        if exclude and isinstance(exclude, (list, tuple)):
+            self.exclude_fields = tuple(item for item in exclude if item in self.fields)
+        else:
+            self.exclude_fields = ()
+
+        computed_fields = getattr(gmeta_class, gmeta.GMETA_COMPUTED_FIELDS, None) or []
+        self.computed_field_names = frozenset(item['name'] for item in computed_fields)
+        annotated_fields = getattr(gmeta_class, gmeta.GMETA_ANNOTATED_FIELDS, None) or {}
+        self.annotated_field_names = frozenset(annotated_fields.keys())
+
+
+_model_meta_indexes = {}
+
+
+def get_model_meta_index(model):
+    """获取模型元数据的索引
+
+    索引在第一次访问时构建，应用注册表就绪前构建的索引不做缓存
+    """
+    index = _model_meta_indexes.get(model)
+    if index is None:
+        index = ModelMetaIndex(model)
+        if apps.ready:
+            _model_meta_indexes[model] = index
+    return index
+
+
+def clear_model_meta_indexes():
+    """清空模型元数据的索引，例如在测试中动态修改了模型的 GMeta"""
+    _model_meta_indexes.clear()
+
+
 def get_reverse_fields(model):
     """获取模型的反向字段"""
-    return [
-        item
-        for item in model._meta.get_fields()
-        if item.auto_created and not item.concrete
-    ]
+    return list(get_model_meta_index(model).reverse_fields)
+
+
+def get_reverse_field_name_map(model):
+    """获取模型反向字段 related_name 和反向字段名称的映射"""
+    return get_model_meta_index(model).reverse_field_names
 
 
 def get_all_relation_fields(model):
     """获取模型中所有的关系字段"""
-    return [item for item in model._meta.get_fields() if item.is_relation]
+    return list(get_model_meta_index(model).relation_fields)
 
 
 def check_field_is_reverse(field):
@@ -38,7 +146,7 @@ def get_field_by_reverse_field(field):
 
 
 def get_concrete_fields(model):
-    return [item for item in model._meta.get_fields() if item.concrete]
+    return list(get_model_meta_index(model).concrete_fields)
 
 
 def get_related_model_field(model, related_model):
@@ -47,10 +155,7 @@ def get_related_model_field(model, related_model):
 
     例如，文章 Article 中的有一个字段
     """
-    for f in model._meta.get_fields():
-        if f.is_relation and f.concrete:
-            if f.related_model is related_model:
-                return f
+    return get_model_meta_index(model).related_model_fields.get(related_model)
 
 
 def get_relation_field(model, field_name, reverse=False):
@@ -79,17 +184,7 @@ def get_relation_field(model, field_name, reverse=False):
 
 def get_relation_field_related_name(model, field_name):
     """获取关系字段的 related_name"""
-    field = get_relation_field(model, field_name)
-    if not field:
-        return
-
-    related_name = field.remote_field.related_name
-
-    if field.one_to_one:
-        return field.remote_field.name, field
-    if related_name is None:
-        return '{}_set'.format(model.__name__.lower()), field
-    return related_name, field
+    return get_model_meta_index(model).related_names.get(field_name)
 
 
 def get_field_default_value(field):
@@ -5,9 +5,14 @@ from django.apps import apps
 from django.db.models import Manager, Q
 from django.template import engines
 from api_basebone.services.expresstion import resolve_expression
+from api_basebone.settings import settings
+from api_basebone.utils.lru import LRUCache
 
 django_engine = engines['django']
 
+# 编译后的过滤条件模板的缓存，键为过滤条件的结构，不包含值
+filter_template_cache = LRUCache(settings.FILTER_TEMPLATE_CACHE_SIZE)
+
 # 运算符映射
 OPERATOR_MAP = {
     ">": "__gt",
@@ -148,50 +153,135 @@ def build_filter_conditions2(filters, context=None):
     if not filters or not isinstance(filters, list):
         return None
 
-    trans_cons = []
-    for item in filters:
-        build_conditions_in_item(trans_cons, item, context or {})
+    template, values = compile_filter_conditions(filters)
+    return template.bind(values, context or {})
+
 
-    return reduce(operator.and_, trans_cons) if trans_cons else None
+# 模板中的节点类型
+FILTER_GROUP = 'group'
+FILTER_VALUE = 'value'
+FILTER_EXPRESSION = 'expression'
 
 
-def build_conditions_in_item(trans_cons, item, context=None):
-    """依据部分子条件构建过滤器"""
+def get_filter_structure(item, values):
+    """提取过滤条件的结构，用作模板的缓存键
+
+    结构中不包含条件的值，值按照遍历的顺序放入 values 中，绑定模板时按照顺序取出。
+    表达式的值依赖于上下文，所以表达式本身是结构的一部分，绑定时再求值。
+
+    Returns:
+        tuple 不合法的条件返回 None
+    """
     if not isinstance(item, dict):
         return
 
-    if ('children' in item) and item['children']:
-        sub_trans_cons = []
-        children = item.get('children')
+    children = item.get('children')
+    if children:
+        structures = []
         for child in children:
-            build_conditions_in_item(sub_trans_cons, child, context)
+            structure = get_filter_structure(child, values)
+            if structure is not None:
+                structures.append(structure)
+        return (FILTER_GROUP, item.get('operator'), tuple(structures))
 
-        if not sub_trans_cons:
-            return
+    if "field" not in item or "operator" not in item:
+        return
 
-        if item['operator'].lower() == 'or':
-            sub_trans_cons = reduce(operator.or_, sub_trans_cons)
-        else:
-            sub_trans_cons = reduce(operator.and_, sub_trans_cons)
+    if "expression" in item:
+        return (
+            FILTER_EXPRESSION, item["field"], item["operator"],
+            item["expression"], item.get("expression_type"), item.get("model"),
+        )
+
+    values.append(item.get("value"))
+    return (FILTER_VALUE, item["field"], item["operator"])
+
+
+def compile_filter_node(structure):
+    """把一个节点的结构编译为 (类型，是否取反或者是否为 OR，查询键或者子节点，表达式)"""
+    kind = structure[0]
+    if kind == FILTER_GROUP:
+        _, group_operator, children = structure
+        return (
+            kind,
+            (group_operator or '').lower() == 'or',
+            [compile_filter_node(child) for child in children],
+            None,
+        )
+
+    field, item_operator = structure[1], structure[2]
+    negated = item_operator in ["!=", "!==", "<>"]
+    key = field.replace('.', '__')
+    if not negated:
+        key = f"{key}{OPERATOR_MAP.get(item_operator, '')}"
+
+    expression = None
+    if kind == FILTER_EXPRESSION:
+        expression = {'expression': structure[3]}
+        if structure[4] is not None:
+            expression['expression_type'] = structure[4]
+        if structure[5] is not None:
+            expression['model'] = structure[5]
+    return (kind, negated, key, expression)
+
+
+class FilterTemplate:
+    """编译后的过滤条件模板
+
+    过滤条件的校验、运算符的映射以及字段名的转换在编译时完成，
+    绑定时只需要按照顺序填入值，并对表达式求值，构造出 Q 对象
+    """
 
-        trans_cons.append(sub_trans_cons)
-    else:
-        valid_keys = {"field", "operator"}
-        if not valid_keys.issubset(set(item.keys())):
-            return
+    def __init__(self, structures):
+        self.nodes = [compile_filter_node(structure) for structure in structures]
+
+    def bind(self, values, context=None):
+        """填入条件的值，构造 Q 对象，没有任何条件时返回 None"""
+        trans_cons = self._bind_nodes(self.nodes, iter(values), context or {})
+        return reduce(operator.and_, trans_cons) if trans_cons else None
+
+    def _bind_nodes(self, nodes, values, context):
+        trans_cons = []
+        for kind, flag, key, expression in nodes:
+            if kind == FILTER_GROUP:
+                sub_trans_cons = self._bind_nodes(key, values, context)
+                if sub_trans_cons:
+                    trans_cons.append(
+                        reduce(operator.or_ if flag else operator.and_, sub_trans_cons)
+                    )
+                continue
+
+            if kind == FILTER_EXPRESSION:
+                item_value = get_expression_value(expression, context)
+            else:
+                item_value = next(values)
+            # 和 Q(**{key: value}) 以及 ~Q(**{key: value}) 等价
+            trans_cons.append(Q((key, item_value), _negated=flag))
+        return trans_cons
+
+
+def compile_filter_conditions(filters):
+    """把过滤条件编译为模板，结构相同的过滤条件共用同一个模板
 
-        if "expression" in item:
-            item_value = get_expression_value(item, context)
-        else:
-            item_value = item.get("value")
-
-        if item["operator"] in ["!=", "!==", "<>"]:
-            trans_cons.append(~Q(**{item["field"].replace('.', '__'): item_value}))
-        else:
-            operate = OPERATOR_MAP.get(item["operator"], "")
-            field = item["field"].replace('.', '__')
-            key = f"{field}{operate}"
-            trans_cons.append(Q(**{key: item_value}))
+    Returns:
+        (FilterTemplate, list) 模板以及按照顺序排列的条件的值
+    """
+    values, structures = [], []
+    for item in filters:
+        structure = get_filter_structure(item, values)
+        if structure is not None:
+            structures.append(structure)
+    structures = tuple(structures)
+    try:
+        template = filter_template_cache.get(structures)
+    except TypeError:
+        # 字段名等不可哈希时不缓存
+        return FilterTemplate(structures), values
+
+    if template is None:
+        template = FilterTemplate(structures)
+        filter_template_cache.set(structures, template)
+    return template, values
 
 
 def get_valid_conditions(filters):
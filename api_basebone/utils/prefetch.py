@@ -0,0 +1,120 @@
+"""
+分块 prefetch
+
+Prefetch 查询时会把所有的原数据的主键拼接为一个 IN (...) 列表，导出或者不分页的列表中原数据很多时，
+SQLite 会超出 999 个参数的限制，MySQL、Postgres 中语句过长，执行计划也很差。
+
+这里把原数据按照 PREFETCH_CHUNK_SIZE 分块，每块单独执行 prefetch，结果写入每条数据各自的
+_prefetched_objects_cache 中，和一次 prefetch 的结果一致。PREFETCH_WORKERS 大于 1 时使用多个线程
+并行执行，每个线程使用各自的数据库连接，事务中执行时其他连接看不到未提交的数据，仍然串行执行。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.db import connections
+from django.db.models import prefetch_related_objects
+
+from api_basebone.settings import settings
+
+# 混入功能后的结果集类，格式为 {(结果集类, 混入类): 新的结果集类}
+mixed_queryset_classes = {}
+
+
+def mixin_queryset(queryset, mixin, **attrs):
+    """复制结果集，并混入 mixin 类的功能，attrs 为设置到新结果集上的属性"""
+    queryset_class = type(queryset)
+    key = (queryset_class, mixin)
+    mixed_class = mixed_queryset_classes.get(key)
+    if mixed_class is None:
+        if issubclass(queryset_class, mixin):
+            mixed_class = queryset_class
+        else:
+            name = mixin.__name__.replace('QuerySetMixin', '') + queryset_class.__name__
+            mixed_class = type(name, (mixin, queryset_class), {})
+        mixed_queryset_classes[key] = mixed_class
+
+    clone = queryset._chain()
+    clone.__class__ = mixed_class
+    for name, value in attrs.items():
+        setattr(clone, name, value)
+    return clone
+
+
+def split_chunks(items, chunk_size):
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefetch_chunk(chunk, lookups):
+    """在工作线程中执行 prefetch，结束后关闭当前线程的数据库连接"""
+    try:
+        prefetch_related_objects(chunk, *lookups)
+    finally:
+        connections.close_all()
+
+
+def prefetch_in_chunks(instances, *lookups, chunk_size=None, workers=None, using=None):
+    """分块执行 prefetch_related_objects
+
+    Params:
+        instances list 原数据
+        lookups prefetch 的查询
+        chunk_size int 每块的数量，默认为 PREFETCH_CHUNK_SIZE
+        workers int 并行的线程数，默认为 PREFETCH_WORKERS
+        using str 数据库的别名，用于检测是否在事务中
+    """
+    if not instances or not lookups:
+        return
+    chunk_size = chunk_size or settings.PREFETCH_CHUNK_SIZE
+    workers = workers or settings.PREFETCH_WORKERS
+    if len(instances) <= chunk_size:
+        prefetch_related_objects(instances, *lookups)
+        return
+
+    chunks = list(split_chunks(instances, chunk_size))
+    if workers <= 1 or connections[using or 'default'].in_atomic_block:
+        for chunk in chunks:
+            prefetch_related_objects(chunk, *lookups)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        # 取出结果，工作线程中的异常在这里抛出
+        for _ in executor.map(prefetch_chunk, chunks, [lookups] * len(chunks)):
+            pass
+
+
+class ChunkedPrefetchQuerySetMixin:
+    """分块执行 prefetch 的结果集"""
+
+    def _prefetch_related_objects(self):
+        prefetch_in_chunks(self._result_cache, *self._prefetch_related_lookups, using=self.db)
+        self._prefetch_done = True
+
+
+def chunked_prefetch_queryset(queryset):
+    """结果集读取数据后分块执行 prefetch"""
+    return mixin_queryset(queryset, ChunkedPrefetchQuerySetMixin)
+
+
+def iterate_chunks(queryset, chunk_size=None):
+    """分块读取结果集，每一块单独执行 prefetch
+
+    iterator 会忽略 prefetch_related，这里对每一块单独执行 prefetch，
+    内存中只保留一块数据，适用于导出等数据量很大的场景
+    """
+    chunk_size = chunk_size or settings.PREFETCH_CHUNK_SIZE
+    lookups = queryset._prefetch_related_lookups
+    for chunk in split_chunks(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        if lookups:
+            prefetch_in_chunks(chunk, *lookups, chunk_size=chunk_size, using=queryset.db)
+        yield chunk
+
+
+def iterate_queryset(queryset, chunk_size=None):
+    """逐条读取结果集，参考 iterate_chunks"""
+    for chunk in iterate_chunks(queryset, chunk_size):
+        yield from chunk
@@ -1,10 +1,18 @@
+import re
 import types
 from django.db.models.query import QuerySet, Prefetch
-from django.db.models import Manager
+from django.db import connections
+from django.db.models import F, Manager, Q, Subquery, Window
+from django.db.models.functions import RowNumber
+from django.utils.tree import Node
 
+from .meta import get_bsm_model_admin, get_model_meta_index, get_relation_field_related_name
 from .operators import build_filter_conditions2
+from .prefetch import chunked_prefetch_queryset, mixin_queryset
 from ..export.fields import get_attr_in_gmeta_class
 from ..core import gmeta
+from ..core.decorators import BSM_ADMIN_COMPUTED_FIELDS_MAP
+from ..restful.display import compile_display_fields
 from ..restful.serializers import multiple_create_serializer_class, get_field, nested_display_fields, \
     sort_expand_fields, display_fields_to_expand_fields
 from ..services.expresstion import resolve_expression
@@ -51,21 +59,6 @@ def get_relation_field(model, field_name, reverse=False):
         return
 
 
-def get_relation_field_related_name(model, field_name):
-    """获取关系字段的 related_name"""
-    field = get_relation_field(model, field_name)
-    if not field:
-        return
-
-    related_name = field.remote_field.related_name
-
-    if field.one_to_one:
-        return field.remote_field.name, field
-    if related_name is None:
-        return '{}_set'.format(model.__name__.lower()), field
-    return related_name, field
-
-
 def translate_expand_fields(_model, expand_fields):
     """转换展开字段"""
     for out_index, item in enumerate(expand_fields):
@@ -134,51 +127,414 @@ def get_real_model(fake_model):
     return apps.get_model(fake_model._meta.app_label, fake_model._meta.model_name)
 
 
+def get_expression_refs(expression):
+    """获取表达式中引用的字段名的第一级，包括子查询中通过 OuterRef 引用的字段"""
+    refs, stack = set(), [expression]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, F):
+            # OuterRef 以及解析后的 ResolvedOuterRef 都是 F 的子类
+            refs.add(item.name.split('__')[0])
+        elif isinstance(item, Node):
+            # Q 对象以及子查询中的 WhereNode
+            stack.extend(child[1] if isinstance(child, tuple) else child for child in item.children)
+        elif isinstance(item, Subquery):
+            query = item.queryset.query
+            stack.append(query.where)
+            stack.extend(query.annotations.values())
+        elif hasattr(item, 'lhs') and hasattr(item, 'rhs'):
+            # 子查询中的查询条件
+            stack.extend([item.lhs, item.rhs])
+
+        if hasattr(item, 'get_source_expressions'):
+            stack.extend(item.get_source_expressions())
+    return refs
+
+
 def annotate_queryset(queryset, fields=None, context=None):
+    """添加 GMeta 中声明的 annotate 字段
+
+    Params:
+        fields 需要 annotate 的字段，为 None 时添加所有的字段，引用了其他 annotate 字段的也会一并添加
+    """
     annotated_fields = {}
     real_model = get_real_model(queryset.model)
     if 'GMeta' in real_model.__dict__:
         # 这样可以避免从继承过来的GMeta里取，对于one to one类型的继承来说会出错
         annotated_fields = getattr(real_model.__dict__['GMeta'], gmeta.GMETA_ANNOTATED_FIELDS, {})
-    if fields is not None:
-        annotated_fields = {k: v for k, v in annotated_fields.items() if k in fields}
-    if annotated_fields:
-        annotations = {name: field['annotation'] for name, field in annotated_fields.items()}
-        for name, annotation in annotations.items():
-            if callable(annotation):
-                annotations[name] = annotation(context or {})
+    if not annotated_fields:
+        return queryset
+
+    annotations = {}
+    names = [name for name in annotated_fields if fields is None or name in fields]
+    while names:
+        name = names.pop()
+        if name in annotations:
+            continue
+        annotation = annotated_fields[name]['annotation']
+        if callable(annotation):
+            annotation = annotation(context or {})
+        annotations[name] = annotation
+        if fields is not None:
+            names.extend(ref for ref in get_expression_refs(annotation) if ref in annotated_fields)
+
+    if annotations:
+        # 保持声明的顺序
+        annotations = {name: annotations[name] for name in annotated_fields if name in annotations}
         queryset._chain = ChainProxy(queryset, annotations)
         queryset = queryset.annotate(**annotations)
     return queryset
 
 
-def expand_dict_to_prefetch(model, expand_dict=None, fields=None, context=None, display_fields=None):
-    result = []
-    if expand_dict is None:
-        if display_fields is not None:
-            expand_dict = sort_expand_fields(display_fields_to_expand_fields(display_fields))
-        else:
-            expand_dict = {}
+def split_field_name(name):
+    """获取字段名的第一级，支持 . 和 __ 两种分隔符"""
+    return re.split(r'\.|__', name, maxsplit=1)[0]
+
+
+def iter_filter_fields(filters):
+    """遍历过滤条件中所有的字段名"""
+    for item in filters or []:
+        if not isinstance(item, dict):
+            continue
+        if item.get('children'):
+            yield from iter_filter_fields(item['children'])
+        elif isinstance(item.get('field'), str):
+            yield item['field']
+
+
+def get_filter_field_names(filters):
+    """获取过滤条件中所有字段名的第一级"""
+    return {split_field_name(name) for name in iter_filter_fields(filters)}
+
+
+def get_annotated_field_names(model, display_fields=None, filters=None, order=None, fields=None):
+    """获取列表查询中实际用到的 annotate 字段
+
+    annotate 字段一般是关联子查询，只添加显示、过滤、排序、统计以及计算属性依赖的字段
+
+    Params:
+        display_fields list 显示字段，为 None 时表示显示所有的字段
+        filters list 过滤条件，包括客户端、admin 默认以及角色的过滤条件
+        order list 排序字段
+        fields list 其他用到的字段，例如统计的字段
+
+    Returns:
+        set 需要 annotate 的字段，显示字段不受限制时返回 None，即添加所有的字段
+    """
+    if display_fields is None:
+        return
+    real_model = get_real_model(model)
+    plan = compile_display_fields(display_fields)
+    annotated_fields = get_attr_in_gmeta_class(real_model, gmeta.GMETA_ANNOTATED_FIELDS, {})
+    names = {name for name in annotated_fields if plan.check(name)}
+
+    # 计算属性依赖的字段
+    computed_fields = get_attr_in_gmeta_class(real_model, gmeta.GMETA_COMPUTED_FIELDS, [])
+    for c in computed_fields:
+        if plan.check(c['name']):
+            names.update(split_field_name(dep) for dep in c.get('deps', []))
+
+    names |= get_filter_field_names(filters)
+    for item in list(order or []) + list(fields or []):
+        if isinstance(item, str):
+            names.add(split_field_name(item.lstrip('-')))
+    return names
+
+
+def check_select_related(field, display_fields=None):
+    """检测展开的关系字段是否可以使用 select_related 连接查询
+
+    只有正向的外键、一对一字段是单值的，连接查询不会产生重复的数据。
+    关联模型的默认管理器有过滤条件，或者需要添加 annotate 字段时，连接查询无法保持原来的结果，仍然使用 Prefetch
+    """
+    if not field.concrete or not (field.many_to_one or field.one_to_one):
+        return False
+
+    next_model = field.related_model
+    if next_model.objects.all().query.where:
+        return False
+
+    real_model = get_real_model(next_model)
+    if 'GMeta' in real_model.__dict__:
+        annotated_fields = getattr(real_model.__dict__['GMeta'], gmeta.GMETA_ANNOTATED_FIELDS, {})
+        if annotated_fields:
+            names = get_annotated_field_names(next_model, display_fields)
+            if names is None or names & set(annotated_fields):
+                return False
+    return True
+
 
+def get_concrete_columns(model):
+    """模型可以查询的列对应的字段"""
+    return [field for field in get_model_meta_index(model).concrete_fields if not field.many_to_many]
+
+
+def get_computed_field_deps(model, plan):
+    """显示的计算属性依赖的字段
+
+    Returns:
+        set 依赖的字段，有显示的计算属性没有声明依赖时返回 None
+    """
+    deps = set()
+    computed_fields = get_attr_in_gmeta_class(get_real_model(model), gmeta.GMETA_COMPUTED_FIELDS, [])
+    for c in computed_fields:
+        if not plan.check(c['name']):
+            continue
+        if 'deps' not in c:
+            return
+        deps.update(c['deps'])
+
+    # admin 中的计算属性传入整个对象计算，无法声明依赖
+    admin_computed_fields = getattr(model, BSM_ADMIN_COMPUTED_FIELDS_MAP, None) or {}
+    if any(plan.check(name) for name in admin_computed_fields) and get_bsm_model_admin(model):
+        return
+    return deps
+
+
+def get_display_columns(model, display_fields, expand_dict=None):
+    """根据显示字段计算需要查询的列
+
+    展开的关系字段即使不显示，prefetch 时也需要外键的值，所以外键总是会被查询
+
+    Returns:
+        (bool, list) 是否为排除的模式，排除的模式下返回需要 defer 的字段，否则返回需要 only 的字段
+    """
+    plan = compile_display_fields(display_fields)
+    deps = get_computed_field_deps(model, plan)
+    # 显示的计算属性没有声明依赖的字段时，不知道会用到哪些列，查询所有的列
+    if deps is None:
+        return True, []
+
+    columns = get_concrete_columns(model)
+    if plan.star:
+        return True, [
+            field.name
+            for field in columns
+            if not field.primary_key
+            and not field.is_relation
+            and field.name in plan.exclude
+            and field.name not in deps
+        ]
+
+    only = [field.name for field in columns if plan.check(field.name)]
+    # 展开的关系字段需要查询外键
+    relation_names = [name for name in plan.nested if plan.check(name)]
+    relation_names += list(expand_dict or [])
+    for name in relation_names:
+        field = get_field(model, name)
+        if field and field.concrete and not field.many_to_many:
+            only.append(field.name)
+    only += deps
+    only.append('pk')
+    return False, only
+
+
+def get_select_related_columns(model, display_fields=None, expand_dict=None):
+    """连接查询的模型需要查询的列，规则和 Prefetch 的 queryset 一致
+
+    Returns:
+        (bool, set) 是否为排除的模式以及对应的字段名
+    """
+    exclude_fields = set(get_exclude_fields_by_model(model))
+    if not display_fields:
+        return True, exclude_fields
+
+    defer, names = get_display_columns(model, display_fields, expand_dict)
+    if defer:
+        return True, set(names) | exclude_fields
+    pk_name = model._meta.pk.name
+    return False, {pk_name if name == 'pk' else name for name in names if name not in exclude_fields} | {pk_name}
+
+
+def plan_expand_fields(
+    model, expand_dict, fields=None, context=None, display_fields=None, prefix='', limits=None, select_related=True
+):
+    """规划展开字段的查询方式
+
+    原来所有的展开字段都使用 Prefetch，正向的外键链每一层都会多一次查询。这里单值的正向关系使用 select_related
+    连接查询，反向以及多对多的关系仍然使用 Prefetch，两者可以在任意一层混合使用，例如 Prefetch 的 queryset
+    中继续使用 select_related，或者连接查询的模型上继续 Prefetch 对多的关系。
+
+    Params:
+        limits dict 对多关系的数量限制，格式为 {展开字段: (数量, 排序字段)}，参考 parse_expand_fields
+        select_related bool 是否允许连接查询，按照数量限制查询的结果集不支持连接查询
+
+    Returns:
+        (list, dict, list) select_related 的路径，连接查询的模型以及需要查询的列，Prefetch 的列表
+    """
+    select, columns, prefetches = [], {}, []
     for key, value in expand_dict.items():
         field = get_field(model, key)
         next_model = field.related_model
         next_fields = fields and [field.split('.', maxsplit=1)[-1] for field in fields if field.startswith(key+'.')]
         nested = nested_display_fields(model, display_fields, key)
+        path = prefix + key
+        next_limits = limits and {k[len(key) + 1:]: v for k, v in limits.items() if k.startswith(key + '.')}
+
+        # 排除的外键不会被查询，无法连接查询
+        if (
+            select_related
+            and not next_fields
+            and field.name not in get_exclude_fields_by_model(model)
+            and check_select_related(field, nested)
+        ):
+            select.append(path)
+            columns[path] = (next_model, *get_select_related_columns(next_model, nested, value))
+            s, c, p = plan_expand_fields(
+                next_model, value, context=context, display_fields=nested, prefix=path + '__', limits=next_limits
+            )
+            select += s
+            columns.update(c)
+            prefetches += p
+            continue
+
         if nested is not None and not field.concrete:
             nested.append(field.field.name)
-        pfs = expand_dict_to_prefetch(next_model, value, fields=next_fields, context=context, display_fields=nested)
-        # if not pfs:
-        # 是否能节省资源？
-        #     result.append(key)
-        #     continue
-        qs = next_model.objects.defer(*get_exclude_fields_by_model(next_model)).prefetch_related(*pfs)
+        qs = next_model.objects.defer(*get_exclude_fields_by_model(next_model))
         if display_fields is not None and nested:
-            qs = queryset_only(qs, nested)
+            qs = queryset_only(qs, nested, value)
+        limit = limits and limits.get(key)
+        qs = queryset_expand(
+            qs, value, fields=next_fields, context=context, display_fields=nested,
+            limits=next_limits, select_related=not limit,
+        )
+        if limit and (field.many_to_many or field.one_to_many):
+            qs = limit_queryset(qs, get_partition_name(field), *limit)
         # 使关联关系也能用annotated_field
-        prefetch = Prefetch(key, queryset=annotate_queryset(qs, fields=next_fields, context=context))
-        result.append(prefetch)
-    return result
+        prefetch = Prefetch(path, queryset=annotate_queryset(qs, fields=next_fields, context=context))
+        prefetches.append(prefetch)
+    return select, columns, prefetches
+
+
+def select_related_columns(queryset, columns):
+    """按照结果集的列选择模式，选择连接查询的模型需要查询的列"""
+    existing, defer = queryset.query.deferred_loading
+    names = []
+    for path, (model, column_defer, column_names) in columns.items():
+        if column_defer == defer:
+            names += [f'{path}__{name}' for name in column_names]
+            continue
+        # 模式不同时，排除的字段转换为查询的字段，或者反过来
+        for field in get_concrete_columns(model):
+            if field.name not in column_names and not (defer and field.primary_key):
+                names.append(f'{path}__{field.name}')
+    if not names:
+        return queryset
+    if defer:
+        return queryset.defer(*names)
+    # only 会替换原来的字段，需要带上已经选择的字段
+    return queryset.only(*existing, *names)
+
+
+def queryset_expand(
+    queryset, expand_dict, fields=None, context=None, display_fields=None, limits=None, select_related=True
+):
+    """按照查询计划添加展开字段的连接查询和 Prefetch"""
+    select, columns, prefetches = plan_expand_fields(
+        queryset.model, expand_dict, fields=fields, context=context, display_fields=display_fields,
+        limits=limits, select_related=select_related,
+    )
+    if select:
+        queryset = select_related_columns(queryset.select_related(*select), columns)
+    if prefetches:
+        # 原数据很多时分块 prefetch，避免 IN 列表过长
+        queryset = chunked_prefetch_queryset(queryset.prefetch_related(*prefetches))
+    return queryset
+
+
+# 展开字段的数量限制，例如 items[:5 order by -id]
+EXPAND_LIMIT_PATTERN = re.compile(r'^(?P<name>\w+)\[:(?P<limit>\d+)(?:\s+order\s+by\s+(?P<order>[^\]]+))?\]$', re.I)
+
+# 窗口函数编号的列名
+ROW_NUMBER_NAME = 'basebone_row_number'
+
+
+def split_expand_fields(fields):
+    """按照逗号拆分展开字段，方括号中的逗号不拆分"""
+    return re.split(r',(?![^\[]*\])', fields)
+
+
+def parse_expand_fields(expand_fields):
+    """解析展开字段中对多关系的数量限制
+
+    例如 items[:5 order by -id] 表示每条数据只展开按照 id 倒序的前 5 条 items，多个排序字段使用空格或者逗号分隔
+
+    Returns:
+        (list, dict) 去掉数量限制后的展开字段，以及展开字段和数量限制的映射 {展开字段: (数量, 排序字段)}
+    """
+    if not expand_fields:
+        return expand_fields, {}
+
+    result, limits = [], {}
+    for item in expand_fields:
+        names = []
+        for part in re.findall(r'[^.\[]+(?:\[[^\]]*\])?', item):
+            match = EXPAND_LIMIT_PATTERN.match(part.strip())
+            if not match:
+                names.append(part)
+                continue
+            names.append(match.group('name'))
+            order = match.group('order')
+            limits['.'.join(names)] = (int(match.group('limit')), order.replace(',', ' ').split() if order else [])
+        result.append('.'.join(names))
+    return result, limits
+
+
+def get_partition_name(field):
+    """对多关系 Prefetch 时关联数据指向原数据的查询名称，按照此名称分组"""
+    if field.many_to_many and field.concrete:
+        return field.related_query_name()
+    return field.field.name
+
+
+class LimitedQuerySetMixin:
+    """每个分组只查询排序后的前几条数据的结果集，用于对多关系的展开
+
+    Prefetch 查询时才会在结果集上追加 关系__in 的过滤条件，所以在查询时才添加窗口函数：
+    ROW_NUMBER() OVER (PARTITION BY 关系 ORDER BY 排序字段) 给每个分组内的数据编号，
+    再通过派生表筛选编号不超过数量限制的数据，只查询需要的数据。
+
+    派生表通过 raw 查询读取，所以不支持 select_related，关联数据需要使用 Prefetch
+    """
+
+    limit_per_partition = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone.limit_per_partition = self.limit_per_partition
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None and self.limit_per_partition:
+            self._result_cache = list(self.limited_rows())
+        super()._fetch_all()
+
+    def limited_rows(self):
+        partition, limit, order_by = self.limit_per_partition
+        order_by = order_by or self.query.order_by or self.model._meta.ordering or ['pk']
+        expressions = [
+            F(name[1:]).desc() if name.startswith('-') else F(name).asc()
+            for name in order_by
+        ]
+        window = Window(RowNumber(), partition_by=[F(partition)], order_by=expressions)
+        sql, params = self.order_by().annotate(**{ROW_NUMBER_NAME: window}).query.sql_with_params()
+        row_number = connections[self.db].ops.quote_name(ROW_NUMBER_NAME)
+        return self.model._base_manager.db_manager(self.db).raw(
+            f'SELECT * FROM ({sql}) top_n WHERE top_n.{row_number} <= %s ORDER BY top_n.{row_number}',
+            (*params, limit),
+        )
+
+
+def limit_queryset(queryset, partition, limit, order_by=None):
+    """按照 partition 分组，每组只查询按照 order_by 排序后的前 limit 条数据
+
+    Params:
+        queryset QuerySet 结果集
+        partition str 分组的字段
+        limit int 每组的数量
+        order_by list 排序字段，默认使用结果集或者模型的排序
+    """
+    return mixin_queryset(queryset, LimitedQuerySetMixin, limit_per_partition=(partition, limit, order_by))
 
 
 def get_exclude_fields_by_model(model):
@@ -187,35 +543,24 @@ def get_exclude_fields_by_model(model):
     return getattr(model.GMeta, gmeta.GMETA_SERIALIZER_EXCLUDE_FIELDS, [])
 
 
-def queryset_only(queryset, display_fields):
-    real_model = get_real_model(queryset.model)
-    annotated_fields = get_attr_in_gmeta_class(real_model, gmeta.GMETA_ANNOTATED_FIELDS, {})
-    computed_fields = get_attr_in_gmeta_class(real_model, gmeta.GMETA_COMPUTED_FIELDS, [])
-    computed_field_names = {c['name'] for c in computed_fields}
-    only = [d for d in display_fields if '.' not in d and d not in annotated_fields and d not in computed_field_names]
-    for d in display_fields:
-        if '.' in d:
-            field = get_field(queryset.model, d.split('.')[0])
-            if field:
-                if field.concrete:
-                    only.append(field.name)
-
-    for c in computed_fields:
-        only += c.get('deps', [])
-    if '*' in only:
-        return queryset
-    only.append('pk')
-    return queryset.only(*only)
+def queryset_only(queryset, display_fields, expand_dict=None):
+    """根据显示字段选择查询的列，支持 * 通配符和 - 排除"""
+    defer, names = get_display_columns(queryset.model, display_fields, expand_dict)
+    if defer:
+        return queryset.defer(*names) if names else queryset
+    return queryset.only(*names)
 
 
-def queryset_prefetch(queryset, expand_dict=None, context=None, display_fields=None):
+def queryset_prefetch(queryset, expand_dict=None, context=None, display_fields=None, limits=None):
     if display_fields is not None:
-        queryset = queryset_only(queryset, display_fields)
-    return queryset.defer(*get_exclude_fields_by_model(queryset.model)).prefetch_related(
-        *expand_dict_to_prefetch(
-            queryset.model, expand_dict, context=context, display_fields=display_fields,
-        )
-    )
+        queryset = queryset_only(queryset, display_fields, expand_dict)
+    if expand_dict is None:
+        if display_fields is not None:
+            expand_dict = sort_expand_fields(display_fields_to_expand_fields(display_fields))
+        else:
+            expand_dict = {}
+    queryset = queryset.defer(*get_exclude_fields_by_model(queryset.model))
+    return queryset_expand(queryset, expand_dict, context=context, display_fields=display_fields, limits=limits)
 
 
 # alias
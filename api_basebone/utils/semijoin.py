@@ -0,0 +1,129 @@
+"""
+对多关系筛选条件的半连接改写
+
+筛选条件中涉及一对多、多对多的关系字段时，连接查询会产生重复的数据，原来的做法是对结果集
+去重，即 SELECT DISTINCT，宽表上去重需要对所有的查询列排序或者使用临时表，非常慢。
+
+这里把涉及对多关系的条件改写为主键的子查询，即 pk IN (SELECT pk ... WHERE 条件)，
+主查询不再连接对多关系的表，也就不会产生重复的数据，不需要去重。
+
+- 同一次 filter 中对同一个对多关系的多个条件指向同一条关联数据，所以涉及对多关系的条件都放到同一个子查询中
+- 不涉及对多关系的条件仍然直接在主查询中筛选
+- 涉及对多关系的条件中引用了 annotate 的字段等无法解析的字段时，不做改写，仍然需要去重
+- 排序字段经过对多的关系时，同样会连接对多关系的表，仍然需要去重
+- 结果集本身已经连接了对多关系的表时（例如 GMeta 中 client_api 的管理器），仍然需要去重
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+
+
+def get_condition_lookups(condition):
+    """获取条件中所有的查询键"""
+    if isinstance(condition, Q):
+        for child in condition.children:
+            yield from get_condition_lookups(child)
+    else:
+        yield condition[0]
+
+
+@lru_cache(maxsize=1024)
+def check_multiple_lookup(model, lookup):
+    """检测查询键是否经过对多的关系
+
+    Returns:
+        bool 无法解析的查询键（例如 annotate 的字段、GenericForeignKey）返回 None
+    """
+    opts = model._meta
+    for index, name in enumerate(lookup.split(LOOKUP_SEP)):
+        if name == 'pk':
+            name = opts.pk.name
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            # 第一级不是模型的字段，例如 annotate 的字段，后面的部分为查询的运算符、JSON 的键等
+            return None if index == 0 else False
+
+        if not field.is_relation:
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        if field.related_model is None:
+            return None
+        opts = field.related_model._meta
+    return False
+
+
+def check_multiple_ordering(model, ordering):
+    """检测排序字段是否经过对多的关系，排序时会连接对多关系的表，产生重复的数据"""
+    return any(
+        isinstance(item, str) and check_multiple_lookup(model, item.lstrip('-+'))
+        for item in ordering
+    )
+
+
+def check_multiple_joins(query):
+    """检测查询中是否已经连接了对多关系的表
+
+    分组查询（例如 annotate 了聚合函数）按照主键分组，不会产生重复的数据
+    """
+    if query.group_by is not None:
+        return False
+    for alias, join in query.alias_map.items():
+        join_field = getattr(join, 'join_field', None)
+        if join_field is None or not query.alias_refcount.get(alias):
+            continue
+        if join_field.one_to_many or join_field.many_to_many:
+            return True
+    return False
+
+
+def split_conditions(model, cons):
+    """把 AND 连接的条件拆分为直接筛选的条件和涉及对多关系的条件
+
+    Returns:
+        (list, list) 涉及对多关系的条件无法解析时返回 None
+    """
+    if cons.connector == Q.AND and not cons.negated:
+        children = cons.children
+    else:
+        children = [cons]
+
+    plain, multiple = [], []
+    for child in children:
+        result = {check_multiple_lookup(model, lookup) for lookup in get_condition_lookups(child)}
+        if True not in result:
+            plain.append(child)
+        elif None in result:
+            return
+        else:
+            multiple.append(child)
+    return plain, multiple
+
+
+def semi_join_filter(queryset, cons):
+    """按照条件筛选结果集，涉及对多关系的条件改写为主键的子查询
+
+    结果和 queryset.filter(cons).distinct() 的数据一致
+
+    Params:
+        queryset QuerySet 结果集
+        cons Q 筛选条件
+
+    Returns:
+        (QuerySet, bool) 筛选后的结果集以及是否仍然需要去重
+    """
+    model = queryset.model
+    conditions = split_conditions(model, cons)
+    if conditions is None:
+        return queryset.filter(cons), True
+
+    plain, multiple = conditions
+    if plain:
+        queryset = queryset.filter(Q(*plain))
+    if multiple:
+        subquery = model._base_manager.filter(Q(*multiple)).values('pk')
+        queryset = queryset.filter(pk__in=subquery)
+    return queryset, False
@@ -0,0 +1,139 @@
+"""
+树形数据的组装
+
+树形结构的接口只查询根节点，子节点由 RecursiveSerializer 通过 instance.{related_name}.all()
+逐个节点查询，节点多的时候查询次数非常多。这里批量查询出子孙节点，在内存中按照父节点
+组装好，写入每个节点的 prefetch 缓存，序列化时不再查询数据库，输出的数据结构保持不变。
+
+- mptt 的模型使用 tree_id、lft、rght 的范围查询子孙节点
+- 普通的外键从根节点开始逐层查询，每层一次查询，最多查询到 max_depth 层
+"""
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q, prefetch_related_objects
+
+
+def get_tree_max_depth(value):
+    """获取树的最大深度，根节点为第一层，不合法时返回 None，即不限制深度"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return
+    return value if value > 0 else None
+
+
+def get_mptt_descendants(model, roots, max_depth=None):
+    """通过 mptt 的左右值范围查询子孙节点"""
+    mptt_meta = model._mptt_meta
+    tree_id_attr, level_attr = mptt_meta.tree_id_attr, mptt_meta.level_attr
+    left_attr, right_attr = mptt_meta.left_attr, mptt_meta.right_attr
+
+    conditions = []
+    for root in roots:
+        left, right = getattr(root, left_attr), getattr(root, right_attr)
+        # 叶子节点没有子孙节点
+        if right - left <= 1:
+            continue
+
+        params = {
+            tree_id_attr: getattr(root, tree_id_attr),
+            f'{left_attr}__gt': left,
+            f'{right_attr}__lt': right,
+        }
+        if max_depth:
+            params[f'{level_attr}__lt'] = getattr(root, level_attr) + max_depth
+        conditions.append(Q(**params))
+
+    if not conditions:
+        return []
+    return list(model._default_manager.filter(reduce(or_, conditions)))
+
+
+def get_adjacency_descendants(model, field, roots, max_depth=None):
+    """通过父节点逐层查询子孙节点，查询次数为树的深度"""
+    key_attr = field.target_field.attname
+    descendants, depth = [], 1
+    keys = {getattr(root, key_attr) for root in roots}
+    visited = set(keys)
+    while keys and not (max_depth and depth >= max_depth):
+        nodes = list(model._default_manager.filter(**{f'{field.name}__in': keys}))
+        descendants.extend(nodes)
+        # 避免脏数据中父子关系成环导致死循环
+        keys = {getattr(node, key_attr) for node in nodes} - visited
+        visited |= keys
+        depth += 1
+    return descendants
+
+
+def get_tree_descendants(model, tree_data, roots, max_depth=None):
+    """查询根节点的子孙节点"""
+    field_name = tree_data[0]
+    field = model._meta.get_field(field_name)
+    # 子节点是声明父亲字段的模型，例如多表继承时父模型中声明的父亲字段
+    model = field.model
+
+    mptt_meta = getattr(model, '_mptt_meta', None)
+    if mptt_meta is not None and mptt_meta.parent_attr == field_name:
+        return get_mptt_descendants(model, roots, max_depth)
+    return get_adjacency_descendants(model, field, roots, max_depth)
+
+
+def set_children_cache(instance, related_name, children):
+    """把子节点写入 prefetch 缓存，instance.{related_name}.all() 直接返回缓存的数据"""
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+
+    queryset = getattr(instance, related_name).all()
+    queryset._result_cache = children
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache[related_name] = queryset
+
+
+def prefetch_tree(roots, tree_data, max_depth=None, lookups=None):
+    """组装树形数据，一次性查询出子孙节点后在内存中组装
+
+    Params:
+        roots list 根节点
+        tree_data tuple (字段名，related_name, 默认值)，即 meta.tree_parent_field 的返回值
+        max_depth int 树的最大深度，根节点为第一层，超过的节点的子节点输出为空列表
+        lookups list 子孙节点也需要 prefetch 的字段，一般为根节点查询集的 prefetch 字段
+
+    Returns:
+        list 根节点
+    """
+    roots = list(roots)
+    if not roots:
+        return roots
+
+    model = type(roots[0])
+    field_name, related_name, _ = tree_data
+    field = model._meta.get_field(field_name)
+    parent_attr, key_attr = field.attname, field.target_field.attname
+
+    children_map = defaultdict(list)
+    for node in get_tree_descendants(model, tree_data, roots, max_depth):
+        children_map[getattr(node, parent_attr)].append(node)
+
+    descendants, visited, level, depth = [], set(), roots, 1
+    while level:
+        next_level = []
+        for node in level:
+            key = getattr(node, key_attr)
+            # 避免脏数据中父子关系成环导致死循环
+            if key in visited:
+                children = []
+            elif max_depth and depth >= max_depth:
+                children = []
+            else:
+                children = children_map.get(key, [])
+            visited.add(key)
+            set_children_cache(node, related_name, children)
+            next_level.extend(children)
+        descendants.extend(next_level)
+        level, depth = next_level, depth + 1
+
+    if descendants and lookups:
+        prefetch_related_objects(descendants, *lookups)
+    return roots
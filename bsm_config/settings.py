@@ -104,7 +104,7 @@ class SiteSetting:
 
     def __getitem__(self, item):
         if isinstance(item, tuple):
-            setting_list = Setting.objects.using('default').annotate(key_lower=Lower('key')).filter(
+            setting_list = Setting.objects.annotate(key_lower=Lower('key')).filter(
                 key_lower__in=map(str.lower, item)).values_list('key', 'value')
             setting_dict = dict(setting_list)
 
@@ -116,7 +116,7 @@ class SiteSetting:
                     value.append(setting_dict[key])
             return value
         else:
-            setting = Setting.objects.annotate(key_lower=Lower('key')).using('default').filter(
+            setting = Setting.objects.annotate(key_lower=Lower('key')).filter(
                 key_lower=item.lower()).first()
             if setting:
                 return setting.value
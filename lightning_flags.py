@@ -8,3 +8,4 @@ def conf(label, default):
 NUMERIC_RESPONSE_STATUS = conf('NUMERIC_RESPONSE_STATUS', False)
 BUILTIN_ADMIN = conf('BUILTIN_ADMIN', True)
 QUERYSET_VERSION = conf('QUERYSET_VERSION', 'v1')
+ROW_PROJECTOR = conf('ROW_PROJECTOR', False)
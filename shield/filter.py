@@ -7,6 +7,7 @@
 TODO 一个方案是，将rule按角色分组后，还要判断其角色有没有can view权限，再决定要不要OR进来。
 """
 import logging
+import time
 from collections import defaultdict
 
 from django.conf import settings
@@ -15,18 +16,46 @@ from django.core.cache import cache
 from django.db.models import Q
 
 from api_basebone.restful.manage.views import QuerySetMixin
+from api_basebone.utils.lru import LRUCache
 from .models import Rule
 log = logging.getLogger(__name__)
 
-SHIELD_RULES_DICT_CACHE_KEY = 'shield_rules_dict:{app_label}.{model_slug}'
-USER_GROUP_MAP_CACHE_KEY = 'user_group_map'
+SHIELD_RULES_DICT_CACHE_KEY = 'shield_rules_dict:{app_label}.{model_slug}:{version}'
+SHIELD_RULES_VERSION_CACHE_KEY = 'shield_rules_version:{app_label}.{model_slug}'
+USER_GROUPS_CACHE_KEY = 'shield_user_groups:{user_id}'
 
+# 共享缓存前的进程内缓存，条目为 (过期时间，用户组名称的集合)，
+# 其他进程中用户组的变更最多延迟 SHIELD_USER_GROUPS_LOCAL_TIMEOUT 秒生效
+USER_GROUPS_LOCAL_TIMEOUT = getattr(settings, 'SHIELD_USER_GROUPS_LOCAL_TIMEOUT', 5)
+user_groups_local_cache = LRUCache(getattr(settings, 'SHIELD_USER_GROUPS_LOCAL_SIZE', 1024))
 
-def get_role_config_with_group(app_label, model_slug):
+# 按照 (应用，模型，规则版本号，用户组) 缓存的规则配置
+rule_plan_cache = LRUCache(getattr(settings, 'SHIELD_RULE_PLAN_CACHE_SIZE', 1024))
+
+
+def get_rules_version(app_label, model_slug):
+    """模型规则的版本号，规则变更时递增"""
+    if hasattr(settings, 'SHIELD_RULES'):
+        return 0
+    return cache.get(SHIELD_RULES_VERSION_CACHE_KEY.format(app_label=app_label, model_slug=model_slug), 0)
+
+
+def clean_rules_cache(app_label, model_slug):
+    """规则变更后递增模型规则的版本号，旧版本的缓存不再命中"""
+    cache_key = SHIELD_RULES_VERSION_CACHE_KEY.format(app_label=app_label, model_slug=model_slug)
+    try:
+        cache.incr(cache_key)
+    except ValueError:
+        cache.set(cache_key, 1, None)
+
+
+def get_role_config_with_group(app_label, model_slug, version=None):
     if hasattr(settings, 'SHIELD_RULES'):
         return settings.SHIELD_RULES.get(f'{app_label}__{model_slug}', [])
 
-    cache_key = SHIELD_RULES_DICT_CACHE_KEY.format(app_label=app_label, model_slug=model_slug)
+    if version is None:
+        version = get_rules_version(app_label, model_slug)
+    cache_key = SHIELD_RULES_DICT_CACHE_KEY.format(app_label=app_label, model_slug=model_slug, version=version)
     record = cache.get(cache_key, None)
     if record:
         return record
@@ -37,33 +66,57 @@ def get_role_config_with_group(app_label, model_slug):
     return result
 
 
-def get_user_group_map():
-    cache_key = USER_GROUP_MAP_CACHE_KEY
-    record = cache.get(cache_key, None)
-    if record:
-        return record
-    result = defaultdict(set)
-    groups = get_user_model().groups
-    for user, group_name in groups.through.objects.values_list(groups.field.m2m_field_name(), 'group__name'):
-        result[user].add(group_name)
-    cache.set(cache_key, result, 600)
+def get_user_groups(user_id):
+    """获取用户所属的用户组名称的集合，只查询当前用户的用户组"""
+    if user_id is None:
+        return frozenset()
+
+    record = user_groups_local_cache.get(user_id)
+    if record and record[0] > time.monotonic():
+        return record[1]
+
+    cache_key = USER_GROUPS_CACHE_KEY.format(user_id=user_id)
+    result = cache.get(cache_key, None)
+    if result is None:
+        groups = get_user_model().groups
+        result = frozenset(
+            groups.through.objects.filter(**{groups.field.m2m_field_name(): user_id})
+            .values_list('group__name', flat=True)
+        )
+        cache.set(cache_key, result, 600)
+    user_groups_local_cache.set(user_id, (time.monotonic() + USER_GROUPS_LOCAL_TIMEOUT, result))
     return result
 
 
+def get_group_user_ids(group):
+    """获取用户组中所有用户的主键"""
+    groups = get_user_model().groups
+    return groups.through.objects.filter(
+        **{groups.field.m2m_reverse_field_name(): group.pk}
+    ).values_list(groups.field.m2m_field_name(), flat=True)
+
+
+def clean_user_groups_cache(user_ids):
+    """用户组变更后，清理对应用户的用户组缓存"""
+    user_ids = list(user_ids)
+    for user_id in user_ids:
+        user_groups_local_cache.delete(user_id)
+    cache.delete_many([USER_GROUPS_CACHE_KEY.format(user_id=user_id) for user_id in user_ids])
+
+
 none = {'field': 'pk', 'operator': 'in', 'value': []}  # trick，可以避免django发起数据库查询，返回空列表，效果相当于.none()
 
 
-def basebone_get_model_role_config(self):
+def get_rule_filters(rules, user_groups):
+    """合并用户所属的用户组对应的规则条件"""
     filters = [none]  # 默认返回空列表
-    rules = get_role_config_with_group(self.app_label, self.model_slug)
-    user_group_map = get_user_group_map()
-    user_groups = user_group_map.get(self.request.user.id, set())
     if not rules:  # 开放所有人都能访问的模型
         filters = []
     elif user_groups:  # 无角色的用户不允许访问有rule的模型
         group = defaultdict(list)
         for r in rules:
-            for g in user_groups & r['groups'] if r['groups'] else user_groups:
+            # 按照名称排序，相同的用户组合并出来的条件结构相同，可以共用编译好的过滤条件模板
+            for g in sorted(user_groups & r['groups'] if r['groups'] else user_groups):
                 group[g] += r['conditions']
         if group:  # 无匹配角色则返回空列表
             filters = []
@@ -75,11 +128,34 @@ def basebone_get_model_role_config(self):
                         'children': cs,
                     } for cs in group.values()]
                 })
-    return {
-        'use_admin_filter_by_login_user': False,
-        'distinct': bool(filters) and filters != [none],
-        'filters': filters,
-    }
+    return filters
+
+
+def get_rule_plan(app_label, model_slug, user_groups):
+    """获取模型在用户组组合下的规则配置
+
+    同一个模型、同一组用户组的规则配置是相同的，缓存在进程内，规则变更时模型的版本号递增，旧的配置不再命中。
+    条件中的 user 变量在构造 Q 对象时才求值，所以配置可以在不同的用户之间共用。
+    """
+    version = get_rules_version(app_label, model_slug)
+    key = (app_label, model_slug, version, tuple(sorted(user_groups)))
+    plan = rule_plan_cache.get(key)
+    if plan is None:
+        rules = get_role_config_with_group(app_label, model_slug, version)
+        plan = {
+            'use_admin_filter_by_login_user': False,
+            # 规则的过滤条件涉及对多关系时，查询时会改写为子查询，不会产生重复的数据，不需要去重
+            'distinct': False,
+            'filters': get_rule_filters(rules, user_groups),
+        }
+        rule_plan_cache.set(key, plan)
+    # 配置在请求之间共用，返回副本，避免调用方修改
+    return {**plan, 'filters': list(plan['filters'])}
+
+
+def basebone_get_model_role_config(self):
+    user_groups = get_user_groups(self.request.user.id)
+    return get_rule_plan(self.app_label, self.model_slug, user_groups)
 
 
 QuerySetMixin.basebone_get_model_role_config = basebone_get_model_role_config
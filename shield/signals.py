@@ -2,11 +2,11 @@ import logging
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models.signals import m2m_changed
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete
 from django.dispatch import receiver
-from shield.filter import SHIELD_RULES_DICT_CACHE_KEY, USER_GROUP_MAP_CACHE_KEY
+from shield.filter import clean_rules_cache, clean_user_groups_cache, get_group_user_ids
 from shield.models import Rule
-from django.core.cache import cache
 
 from api_basebone.signals import post_bsm_create, post_bsm_delete
 
@@ -25,16 +25,14 @@ def clean_rule_cache_by_save(sender, instance: Rule, create, request, old_instan
             app_name = old_instance.model.app.name
         else:
             app_name, model_name = old_instance.model.split('__', 1)
-        cache_key = SHIELD_RULES_DICT_CACHE_KEY.format(app_label=app_name, model_slug=model_name)
-        cache.delete(cache_key)
+        clean_rules_cache(app_name, model_name)
 
     if HAS_SHIELD_MODEL:
         model_name = instance.model.name.lower()
         app_name = instance.model.app.name
     else:
         app_name, model_name = instance.model.split('__', 1)
-    cache_key = SHIELD_RULES_DICT_CACHE_KEY.format(app_label=app_name, model_slug=model_name)
-    cache.delete(cache_key)
+    clean_rules_cache(app_name, model_name)
 
 
 @receiver(post_bsm_delete, sender=Rule, dispatch_uid='clean_rule_cache_by_delete')
@@ -45,12 +43,29 @@ def clean_rule_cache_by_delete(sender, instance: Rule, **kwargs):
         app_name = instance.model.app.name
     else:
         app_name, model_name = instance.model.split('__', 1)
-    cache_key = SHIELD_RULES_DICT_CACHE_KEY.format(app_label=app_name, model_slug=model_name)
-    cache.delete(cache_key)
+    clean_rules_cache(app_name, model_name)
 
 
 @receiver(m2m_changed, sender=get_user_model().groups.through, dispatch_uid='user_group_changed')
-def user_group_changed(sender, instance, model, pk_set, action, **kwargs):
-    if action in ('post_add', 'post_remove', 'post_clear'):
-        cache_key = USER_GROUP_MAP_CACHE_KEY
-        cache.delete(cache_key)
+def user_group_changed(sender, instance, model, pk_set, action, reverse, **kwargs):
+    """只清理用户组有变更的用户的缓存
+
+    - 正向为 user.groups 的变更，instance 为用户
+    - 反向为用户组中用户的变更，pk_set 为用户的主键，清空时在 pre_clear 获取所有的用户
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            clean_user_groups_cache([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        clean_user_groups_cache(pk_set)
+    elif action == 'pre_clear':
+        clean_user_groups_cache(get_group_user_ids(instance))
+
+
+@receiver(post_save, sender=Group, dispatch_uid='user_group_renamed')
+@receiver(pre_delete, sender=Group, dispatch_uid='user_group_deleted')
+def user_group_renamed_or_deleted(sender, instance, **kwargs):
+    """用户组改名或者删除时，清理用户组中所有用户的缓存"""
+    if kwargs.get('created'):
+        return
+    clean_user_groups_cache(get_group_user_ids(instance))